@@ -1,810 +1,479 @@
 #!/usr/bin/env python3
 """
 Email automation system for Dessert Marine with SendGrid integration.
+
+Web entry point: the Flask API. Scheduled jobs live in reminders.py and
+reports.py and are run by scheduler.py; heavy dependencies (Firestore,
+pandas, the HTTP client) are loaded on first use.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
 import os
-from dotenv import load_dotenv
-import schedule
 import time
 import threading
-import pandas as pd
-from datetime import datetime, timedelta
-import pytz
+from collections import OrderedDict
+import queue
+import uuid
+import json
+import hashlib
 import traceback
-import socket
-import requests
-import resend  # ADDED: Resend library
-from firebase_admin import credentials, firestore, initialize_app
-
-# Load environment variables
-load_dotenv()
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import IS_RENDER, RESEND_API_KEY, SENDGRID_API_KEY
+from firestore_client import get_db
+from bookings import entries_index_available, get_entries_index, start_entries_index
+from email_service import (
+    SENDER_EMAIL_MUMBAI, SENDER_PASSWORD_MUMBAI, provider_breakers,
+    get_sender_by_location, send_durable, send_email_durable, start_outbox_worker, smtp_pool,
+)
+from email_templates import render_email, SOB_TEMPLATE, SELLING_TEMPLATE
+import metrics
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000", "https://booking-report.vercel.app"]}})
 
-# Initialize Firestore
-credential_path = os.environ.get(
-    "GOOGLE_APPLICATION_CREDENTIALS",
-    os.path.join(os.path.dirname(__file__), "firebase-admin-sdk.json"),
-)
-if not os.path.exists(credential_path):
-    raise FileNotFoundError(f"Firebase credentials file not found at: {credential_path}")
-
-cred = credentials.Certificate(credential_path)
-initialize_app(cred)
-db = firestore.client()
-
-# Email configuration
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-
-# Email credentials
-SENDER_EMAIL_MUMBAI = "info@dessertmarine.com"
-SENDER_PASSWORD_MUMBAI = "myud rkxh uomg qjra"
-SENDER_EMAIL_GUJARAT = "mundra@dessertmarine.com"
-SENDER_PASSWORD_GUJARAT = "zvvw gynt tedl ihbq"
-
-BRANCH_EMAILS = {
-    "MUMBAI": (SENDER_EMAIL_MUMBAI, SENDER_PASSWORD_MUMBAI),
-    "GUJARAT": (SENDER_EMAIL_GUJARAT, SENDER_PASSWORD_GUJARAT),
-}
-
-# Check if we're on Render
-IS_RENDER = os.environ.get('RENDER', '').lower() == 'true'
-RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
-SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
-
-def normalized_app_password(pw: str) -> str:
-    """Gmail app passwords are shown with spaces; SMTP expects no spaces."""
-    return pw.replace(" ", "") if isinstance(pw, str) else pw
-
-def get_sender_by_location(location):
-    """Get email credentials based on location."""
-    if location:
-        loc = str(location).strip().upper()
-        if "MUMBAI" in loc:
-            return BRANCH_EMAILS["MUMBAI"]
-        if "GUJARAT" in loc:
-            return BRANCH_EMAILS["GUJARAT"]
-    return BRANCH_EMAILS["MUMBAI"]
-
-def send_via_resend(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
-    """Send email using Resend API."""
-    if not RESEND_API_KEY:
-        return False, 'RESEND_API_KEY not set'
-    
-    resend.api_key = RESEND_API_KEY
-    
-    try:
-        # Prepare recipients
-        to_list = []
-        for email in to_emails:
-            if isinstance(email, str) and email.strip():
-                to_list.append(email.strip())
-        
-        cc_list = []
-        for email in cc_emails:
-            if isinstance(email, str) and email.strip():
-                cc_list.append(email.strip())
-        
-        # Prepare from address with name
-        from_address = f"{sender_name} <{sender_email}>" if sender_name else sender_email
-        
-        # Build email params
-        params = {
-            "from": from_address,
-            "to": to_list,
-            "subject": subject,
-            "html": html_body,
-            "text": plain_body,
-        }
-        
-        # Add CC if exists
-        if cc_list:
-            params["cc"] = cc_list
-        
-        # Send email
-        response = resend.Emails.send(params)
-        email_id = response.get('id', 'unknown')
-        print(f"[RESEND] Email sent successfully! ID: {email_id}")
-        return True, f"Email sent (ID: {email_id})"
-        
-    except Exception as e:
-        print(f"[RESEND][ERROR] {str(e)}")
-        traceback.print_exc()
-        return False, str(e)
-
-def send_via_sendgrid(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
-    """Send email using SendGrid Web API v3."""
-    if not SENDGRID_API_KEY:
-        return False, 'SENDGRID_API_KEY not set'
-    
-    url = 'https://api.sendgrid.com/v3/mail/send'
-    headers = {
-        'Authorization': f'Bearer {SENDGRID_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    
-    def to_list(emails):
-        out = []
-        for e in emails:
-            if isinstance(e, str) and e:
-                out.append({"email": e})
-        return out
-    
-    # Build payload according to SendGrid API v3
-    payload = {
-        "personalizations": [
-            {
-                "to": to_list(to_emails),
-                "cc": to_list(cc_emails)
-            }
-        ],
-        "from": {
-            "email": sender_email,
-            "name": sender_name or ""
-        },
-        "subject": subject,
-        "content": [
-            {
-                "type": "text/plain",
-                "value": plain_body
-            },
-            {
-                "type": "text/html",
-                "value": html_body
-            }
-        ]
-    }
-    
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
-        if resp.status_code in (200, 202):
-            print(f"[SENDGRID] Email sent successfully (status={resp.status_code})")
-            return True, f'status={resp.status_code}'
-        else:
-            print(f"[SENDGRID][ERROR] Status {resp.status_code}: {resp.text}")
-            return False, f'status={resp.status_code}, body={resp.text}'
-    except Exception as e:
-        print(f"[SENDGRID][ERROR] {str(e)}")
-        return False, str(e)
-
-def send_email_smart(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_seconds.observe(time.perf_counter() - started, route=route,
+                                        method=request.method, status=response.status_code)
+    return response
+
+# Optional background sending for the Flask email endpoints
+EMAIL_ASYNC_MODE = os.environ.get("EMAIL_ASYNC_MODE", "false").lower() == "true"
+EMAIL_QUEUE_WORKERS = int(os.environ.get("EMAIL_QUEUE_WORKERS", "4"))
+EMAIL_QUEUE_MAX_SIZE = int(os.environ.get("EMAIL_QUEUE_MAX_SIZE", "100"))
+EMAIL_STATUS_RETENTION_SECONDS = int(os.environ.get("EMAIL_STATUS_RETENTION_SECONDS", "3600"))
+
+class EmailSendQueue:
     """
-    Smart email sending that chooses the best provider.
-    Prioritize SendGrid when on Render.
+    Bounded queue drained by a fixed pool of worker threads calling
+    send_email_smart. Keeps a status record per message id for polling.
     """
-    print(f"[EMAIL] Attempting to send email from: {sender_email}")
-    print(f"[EMAIL] To: {to_emails}, CC: {cc_emails}")
-    print(f"[EMAIL] Subject: {subject}")
-    
-    # If we're on Render and have SendGrid key, use SendGrid first
-    if IS_RENDER and SENDGRID_API_KEY:
-        print("[EMAIL] On Render, trying SendGrid first...")
-        ok, details = send_via_sendgrid(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
-        if ok:
-            return True, f"SendGrid: {details}"
-        else:
-            print(f"[EMAIL] SendGrid failed: {details}")
-    
-    # Then try SMTP (even on Render - might work with Gmail)
-    try:
-        print("[EMAIL] Trying SMTP...")
-        # Use Mumbai credentials for all emails
-        smtp_email = "info@dessertmarine.com"
-        smtp_password = "wrkq sobg qdyc ujff"
-        
-        msg = MIMEMultipart('alternative')
-        msg['From'] = f"{sender_name} <{smtp_email}>"
-        msg['To'] = ", ".join(to_emails)
-        if cc_emails:
-            msg['Cc'] = ", ".join(cc_emails)
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(plain_body, 'plain'))
-        msg.attach(MIMEText(html_body, 'html'))
-        
-        with smtplib.SMTP("smtp.gmail.com", 587, timeout=10) as server:
-            server.starttls()
-            server.login(smtp_email, normalized_app_password(smtp_password))
-            recipients = to_emails + cc_emails
-            server.sendmail(smtp_email, recipients, msg.as_string())
-            print("[EMAIL] Sent via SMTP (Gmail)")
-            return True, "SMTP (Gmail)"
-            
-    except Exception as e:
-        print(f"[EMAIL] SMTP failed: {str(e)}")
-    
-    # Then try Resend if available
-    if RESEND_API_KEY:
-        print("[EMAIL] Trying Resend...")
-        ok, details = send_via_resend(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
-        if ok:
-            return True, f"Resend: {details}"
-    
-    # Last fallback: Try SendGrid again (in case it wasn't tried above)
-    if SENDGRID_API_KEY:
-        print("[EMAIL] Trying SendGrid as fallback...")
-        ok, details = send_via_sendgrid(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
-        if ok:
-            return True, f"SendGrid (fallback): {details}"
-    
-    return False, "All email methods failed"
 
-def parse_si_cutoff_date(si_cutoff):
-    """Parse SI cutoff date from dd/mm-hhmm HRS format to timezone-aware datetime."""
-    try:
-        date_part, time_part = si_cutoff.split('-')
-        hour_minute = time_part.replace(" HRS", "").strip()
-        day, month = date_part.split('/')
-        hour, minute = hour_minute[:2], hour_minute[2:]
-        year = datetime.now().year
-        dt = datetime.strptime(f"{day}/{month}/{year} {hour}:{minute}", "%d/%m/%Y %H:%M")
-        ist = pytz.timezone('Asia/Kolkata')
-        return ist.localize(dt)
-    except Exception as e:
-        print(f"Error parsing SI cutoff date {si_cutoff}: {str(e)}")
-        return None
-
-def fetch_si_cutoff_data():
-    """
-    Fetch bookings with SI cutoff dates and group by customer/salesperson.
-    Returns a dictionary with customer emails as keys and lists of bookings as values.
-    """
-    try:
-        bookings_ref = db.collection("entries")
-        docs = bookings_ref.stream()
-        si_cutoff_data = {}
-
-        for doc in docs:
-            entry = doc.to_dict()
-            entry["id"] = doc.id
-
-            # Skip if SI is already filed
-            si_filed = entry.get("siFiled", False)
-            if si_filed:
-                print(f"SI already filed for entry {entry['id']}, skipping SI cutoff reminder.")
-                continue
-
-            si_cutoff = entry.get("siCutOff", "")
-            if not si_cutoff:
-                print(f"No SI cutoff found for entry {entry['id']}")
-                continue
-
-            si_cutoff_dt = parse_si_cutoff_date(si_cutoff)
-            if not si_cutoff_dt:
-                print(f"Invalid SI cutoff date for entry {entry['id']}: {si_cutoff}")
-                continue
-
-            customer = entry.get("customer", {})
-            if not isinstance(customer, dict):
-                print(f"Skipping entry {entry['id']}: 'customer' field is not a dictionary, found {type(customer)}: {customer}")
-                continue
-
-            customer_emails = customer.get("customerEmail", [])
-            if not customer_emails:
-                print(f"No customer email found for entry {entry['id']}")
-                continue
-            customer_emails = [email.strip() for email in customer_emails if email.strip()]
-            print(f"Fetched customer emails for booking {entry.get('bookingNo', entry['id'])}: {customer_emails}")
-
-            sales_person_emails = customer.get("salesPersonEmail", [])
-            if not sales_person_emails:
-                print(f"No salesperson email found for entry {entry['id']}")
-                continue
-            sales_person_emails = [email.strip() for email in sales_person_emails if email.strip()]
-
-            customer_name = customer.get("name", "")
-            booking_no = entry.get("bookingNo", "")
-            if not booking_no:
-                print(f"No booking number found for entry {entry['id']}")
-                continue
-
-            volume = entry.get("volume", "")
-
-            # Location can be a string or {name: "..."}
-            raw_loc = entry.get("location", "")
-            location = raw_loc.get("name") if isinstance(raw_loc, dict) else raw_loc
-
-            reminder_data = {
-                "Customer Emails": customer_emails,
-                "Sales Person Emails": sales_person_emails,
-                "Customer Name": customer_name,
-                "Booking No": booking_no,
-                "SI Cutoff": si_cutoff_dt,
-                "Vessel": entry.get("vessel", ""),
-                "Voyage": entry.get("voyage", ""),
-                "FPOD": entry.get("fpod", ""),
-                "Volume": volume,
-                "Location": location or "",
-                "POL": entry.get("pol", "")
+    def __init__(self, workers=4, max_size=100, retention_seconds=3600):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_size)
+        self._statuses = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"email-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _set_status(self, message_id, **fields):
+        with self._lock:
+            record = self._statuses.get(message_id)
+            if record is not None:
+                record.update(fields, updated_at=datetime.now().isoformat())
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            for message_id in [m for m, r in self._statuses.items()
+                               if r["status"] in ("sent", "failed", "retrying") and r["_finished"] < cutoff]:
+                del self._statuses[message_id]
+
+    def submit(self, kind, send_args, idempotency_key=None):
+        """Queue a send_durable call. Returns the message id, or None when the queue is full."""
+        self._ensure_workers()
+        self._prune()
+        message_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._statuses[message_id] = {
+                "id": message_id, "kind": kind, "status": "queued", "details": "",
+                "created_at": now, "updated_at": now, "_finished": None,
             }
+        try:
+            self._queue.put_nowait((message_id, send_args, idempotency_key))
+        except queue.Full:
+            with self._lock:
+                del self._statuses[message_id]
+            print(f"[QUEUE] Queue full, rejecting {kind} email")
+            return None
+        print(f"[QUEUE] Queued {kind} email {message_id} (depth {self._queue.qsize()})")
+        return message_id
+
+    def status(self, message_id):
+        with self._lock:
+            record = self._statuses.get(message_id)
+            if record is None:
+                return None
+            return {k: v for k, v in record.items() if not k.startswith("_")}
+
+    def _kind(self, message_id):
+        with self._lock:
+            record = self._statuses.get(message_id)
+            return record["kind"] if record else "email"
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            message_id, send_args, idempotency_key = self._queue.get()
+            try:
+                self._set_status(message_id, status="sending")
+                status, details, _ = send_durable(idempotency_key, self._kind(message_id), send_args)
+                # "sending"/"queued": the outbox has it and will retry until it goes out
+                status = {"sending": "retrying", "queued": "retrying"}.get(status, status)
+                self._set_status(message_id, status=status, details=details, _finished=time.time())
+                print(f"[QUEUE] Email {message_id} {status}: {details}")
+            except Exception as e:
+                self._set_status(message_id, status="failed", details=str(e), _finished=time.time())
+                print(f"[QUEUE] Email {message_id} failed: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+email_queue = EmailSendQueue(
+    workers=EMAIL_QUEUE_WORKERS,
+    max_size=EMAIL_QUEUE_MAX_SIZE,
+    retention_seconds=EMAIL_STATUS_RETENTION_SECONDS,
+)
 
-            # Group by customer emails as a tuple to handle multiple emails
-            customer_emails_key = tuple(customer_emails)
-            if customer_emails_key not in si_cutoff_data:
-                si_cutoff_data[customer_emails_key] = []
-            si_cutoff_data[customer_emails_key].append(reminder_data)
-
-        return si_cutoff_data
-
-    except Exception as e:
-        print(f"Error fetching SI cutoff data: {str(e)}")
-        return {}
-
-def send_si_cutoff_reminder():
-    """Send SI cutoff reminders 48 and 24 hours before the cutoff date."""
-    try:
-        si_cutoff_data = fetch_si_cutoff_data()
-        if not si_cutoff_data:
-            print("No SI cutoff data found.")
-            return
-
-        now = datetime.now(pytz.timezone('Asia/Kolkata'))
-        print(f"Checking SI cutoff reminders at {now}")
-
-        for customer_emails_key, bookings in si_cutoff_data.items():
-            customer_emails = list(customer_emails_key)  # Convert tuple back to list
-            for booking in bookings:
-                si_cutoff = booking["SI Cutoff"]
-                time_diff = si_cutoff - now
-                hours_diff = time_diff.total_seconds() / 3600
-
-                if hours_diff < 0:
-                    print(f"Skipping booking {booking['Booking No']} for {customer_emails}: SI Cutoff at {si_cutoff} has already passed (hours remaining: {hours_diff})")
-                    continue
-
-                print(f"Booking {booking['Booking No']} for {customer_emails}: SI Cutoff at {si_cutoff}, hours remaining: {hours_diff}")
-
-                reminder_type = None
-                if 47.5 <= hours_diff <= 48.5:
-                    reminder_type = "48 hours"
-                elif 23.5 <= hours_diff <= 24.5:
-                    reminder_type = "24 hours"
-
-                if reminder_type:
-                    sender_email, _ = get_sender_by_location(booking.get("Location", "MUMBAI"))
-                    sender_name = "Dessert Marine Services"
-                    
-                    subject = f"!! Reminder for Pending SI !! Booking No: {booking['Booking No']} // Vessel: {booking['Vessel']} // Customer Name: {booking['Customer Name']}"
-                    
-                    plain_body = f"""
-Dear Sir / Madam,
-
-Please note the SI cut-off for below shipment is nearing & request you to please send us the SI on info@dessertmarine.com without delays.
-
-Any change in shipment planning please notify CS team for timely roll-over.
-
-DO NOT REPLY ON THIS MAIL.
-
-Booking No: {booking['Booking No']}
-SI Cutoff: {booking['SI Cutoff'].strftime('%d/%m/%Y %H:%M') if booking['SI Cutoff'] else 'N/A'}
-Volume: {booking['Volume']}
-POL: {booking['POL']}
-FPOD: {booking['FPOD']}
-Vessel: {booking['Vessel']}
-Voyage: {booking['Voyage']}
-
-Note: This is System Generated email. If the SI is already submitted, please ignore & coordinate with doc team for the first print & further process.
-
-Thank you for your support.
-
-Regards,
-Dessert Marine Services (I) Pvt Ltd
-info@dessertmarine.com
-doc@dessertmarine.com
-"""
-                    html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear Sir / Madam,</p>
-    <p>Please note the SI cut-off for below shipment is nearing & request you to please send us the SI on <a href="mailto:info@dessertmarine.com">info@dessertmarine.com</a> without delays.</p>
-    <p>Any change in shipment planning please notify CS team for timely roll-over.</p>
-    <p><strong>DO NOT REPLY ON THIS MAIL.</strong></p>
-    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
-        <tr style="background-color: #f2f2f2;">
-            <th>Booking No</th>
-            <th>SI Cutoff</th>
-            <th>Volume</th>
-            <th>POL</th>
-            <th>FPOD</th>
-            <th>Vessel</th>
-            <th>Voyage</th>
-        </tr>
-        <tr>
-            <td>{booking['Booking No']}</td>
-            <td>{booking['SI Cutoff'].strftime('%d/%m/%Y %H:%M') if booking['SI Cutoff'] else 'N/A'}</td>
-            <td>{booking['Volume'] if booking['Volume'] else 'N/A'}</td>
-            <td>{booking['POL'] if booking['POL'] else 'N/A'}</td>
-            <td>{booking['FPOD']}</td>
-            <td>{booking['Vessel']}</td>
-            <td>{booking['Voyage']}</td>
-        </tr>
-    </table>
-    <p><em>Note: This is System Generated email. If the SI is already submitted, please ignore & coordinate with doc team for the first print & further process.</em></p>
-    <p>Thank you for your support.</p>
-    <p>Regards,<br>
-    Dessert Marine Services (I) Pvt Ltd<br>
-    <a href="mailto:info@dessertmarine.com">info@dessertmarine.com</a><br>
-    <a href="mailto:doc@dessertmarine.com">doc@dessertmarine.com</a></p>
-</body>
-</html>
-"""
-                    # Use smart email sending
-                    ok, details = send_email_smart(
-                        sender_email, sender_name, customer_emails, 
-                        booking["Sales Person Emails"], subject, plain_body, html_body
-                    )
-                    
-                    if ok:
-                        print(f"SI Cutoff reminder ({reminder_type}) sent to {customer_emails} (CC: {booking['Sales Person Emails']}) for booking {booking['Booking No']} via {details}")
-                    else:
-                        print(f"Failed to send SI Cutoff reminder: {details}")
-
-    except Exception as e:
-        print(f"Error sending SI cutoff reminders: {str(e)}")
-        traceback.print_exc()
+def wants_async_send(data):
+    """Async sending is opt-in: EMAIL_ASYNC_MODE, or "async" in the query string or body."""
+    flag = request.args.get("async")
+    if flag is None and isinstance(data, dict):
+        flag = data.get("async")
+    if flag is None:
+        return EMAIL_ASYNC_MODE
+    return str(flag).lower() in ("1", "true", "yes")
+
+def request_idempotency_key(data):
+    """Client-supplied idempotency key from the Idempotency-Key header or the body."""
+    key = request.headers.get("Idempotency-Key")
+    if not key and isinstance(data, dict):
+        key = data.get("idempotency_key")
+    if not key:
+        return None
+    return str(key).strip() or None
 
-def fetch_pending_si_data():
+def default_idempotency_key(kind, booking_no, send_args):
     """
-    Fetch bookings where SI cutoff is within the next 24 hours from 6:00 PM IST.
-    Returns a list of dictionaries with the required fields.
+    Key for a send without a client-supplied one, so a retried request for
+    the same message (same booking and content) is not sent twice.
     """
-    try:
-        bookings_ref = db.collection("entries")
-        docs = bookings_ref.stream()
-        pending_si_data = []
-
-        now = datetime.now(pytz.timezone('Asia/Kolkata'))
-        reference_time = now.replace(hour=18, minute=0, second=0, microsecond=0)
-        if now.time() > reference_time.time():
-            reference_time = reference_time + timedelta(days=1)
-
-        for doc in docs:
-            entry = doc.to_dict()
-            entry["id"] = doc.id
-
-            si_cutoff = entry.get("siCutOff", "")
-            if not si_cutoff:
-                print(f"No SI cutoff found for entry {entry['id']}")
-                continue
-
-            si_cutoff_dt = parse_si_cutoff_date(si_cutoff)
-            if not si_cutoff_dt:
-                print(f"Invalid SI cutoff date for entry {entry['id']}: {si_cutoff}")
-                continue
-
-            time_diff = si_cutoff_dt - reference_time
-            hours_diff = time_diff.total_seconds() / 3600
-
-            if 0 <= hours_diff <= 24:
-                customer = entry.get("customer", {})
-                if not isinstance(customer, dict):
-                    print(f"Skipping entry {entry['id']}: 'customer' field is not a dictionary, found {type(customer)}: {customer}")
-                    continue
-
-                customer_name = customer.get("name", "")
-                booking_no = entry.get("bookingNo", "")
-                if not booking_no:
-                    print(f"No booking number found for entry {entry['id']}")
-                    continue
-
-                equipment_type = ""
-                if "equipmentDetails" in entry and entry["equipmentDetails"]:
-                    if isinstance(entry["equipmentDetails"], list) and len(entry["equipmentDetails"]) > 0:
-                        equipment_type = entry["equipmentDetails"][0].get("equipmentType", "")
-
-                etd = entry.get("etd", "")
-                if etd:
-                    try:
-                        etd = pd.to_datetime(etd).strftime('%d-%m-%Y')
-                    except Exception as e:
-                        print(f"Error parsing ETD for entry {entry['id']}: {e}")
-                        etd = ""
-
-                booking_data = {
-                    "Booking No": booking_no,
-                    "Customer": customer_name,
-                    "FPOD": entry.get("fpod", ""),
-                    "Equipment Type": equipment_type,
-                    "Vessel": entry.get("vessel", ""),
-                    "ETD": etd,
-                    "SI Cutoff": si_cutoff_dt.strftime('%d/%m/%Y %H:%M')
-                }
-                pending_si_data.append(booking_data)
-
-        return pending_si_data
-
-    except Exception as e:
-        print(f"Error fetching pending SI data: {str(e)}")
+    digest = hashlib.sha1(json.dumps(list(send_args), default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{kind}:{booking_no}:{digest}"
+
+def durable_send_response(status, details, outbox_id):
+    """202 for a send the outbox will finish (or retry), 502 for one that failed for good."""
+    if status in ("sending", "queued"):
+        return jsonify({"message": "Email queued for retry", "outbox_id": outbox_id, "details": details}), 202
+    return jsonify({"error": f"Email sending failed: {details}"}), 502
+
+def queue_email_response(kind, send_args, idempotency_key=None):
+    """Enqueue a send and build the 202 (or 503 when full) response."""
+    message_id = email_queue.submit(kind, send_args, idempotency_key)
+    if not message_id:
+        return jsonify({"error": "Email queue is full, please retry later"}), 503
+    return jsonify({
+        "message": "Email queued",
+        "message_id": message_id,
+        "status_url": f"/api/email-status/{message_id}",
+    }), 202
+
+# Bulk SOB sends: bookings per request and concurrent sends per batch
+SOB_BATCH_MAX = int(os.environ.get("SOB_BATCH_MAX", "200"))
+SOB_BATCH_WORKERS = int(os.environ.get("SOB_BATCH_WORKERS", "8"))
+FIRESTORE_IN_LIMIT = 30  # values allowed in one "in" filter
+
+def _extract_loc_str(loc_val):
+    if isinstance(loc_val, dict):
+        return (loc_val.get('name') or '').strip()
+    return (loc_val or '').strip()
+
+def _coerce_emails(val):
+    if not val:
         return []
+    if isinstance(val, list):
+        return [e.strip() for e in val if str(e).strip()]
+    if isinstance(val, str):
+        parts = [p.strip() for p in val.split(",")]
+        return [p for p in parts if p]
+    return [str(val).strip()] if str(val).strip() else []
+
+# Booking location lookups for the SOB path: locations almost never change,
+# so resolved ones are kept for an hour and "not found" for two minutes
+LOCATION_CACHE_SIZE = int(os.environ.get("LOCATION_CACHE_SIZE", "2048"))
+LOCATION_CACHE_TTL = int(os.environ.get("LOCATION_CACHE_TTL", "3600"))
+LOCATION_CACHE_NEGATIVE_TTL = int(os.environ.get("LOCATION_CACHE_NEGATIVE_TTL", "120"))
+
+class LocationCache:
+    """
+    Bounded LRU of booking location lookups with a TTL per entry. Keys are
+    ("id", document id) and ("bookingNo", booking no); a None value records
+    that Firestore had no location and expires after the shorter negative TTL.
+    """
 
-def generate_pending_si_excel(data):
-    """Generate an Excel file with the pending SI data."""
-    if not data:
-        print("No pending SI data to generate Excel report.")
-        return None
-
-    df = pd.DataFrame(data)
-    if 'SI Cutoff' in df.columns:
-        df = df.drop(columns=['SI Cutoff'])
-    excel_filename = f"pending_si_report_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
-    df.to_excel(excel_filename, index=False)
-    return excel_filename
-
-def send_pending_si_report():
-    """Send a daily report at 6:00 PM IST with pending SI bookings."""
-    try:
-        pending_si_data = fetch_pending_si_data()
-        if not pending_si_data:
-            print("No bookings with SI cutoff within the next 24 hours.")
-            return
-
-        # Sort the data by ETD (earliest first)
-        pending_si_data.sort(key=lambda x: pd.to_datetime(x.get('ETD', ''), errors='coerce'))
-
-        excel_file = generate_pending_si_excel(pending_si_data)
-        if not excel_file:
-            print("Failed to generate Excel file for pending SI report.")
-            return
-
-        # Read Excel file for attachment
-        with open(excel_file, 'rb') as f:
-            excel_content = f.read()
-
-        # Email content
-        sender_email = SENDER_EMAIL_MUMBAI
-        sender_name = "Dessert Marine Services"
-        to_emails = ["info@dessertmarine.com", "doc@dessertmarine.com"]
-        cc_emails = ["chirag@dessertmarine.com"]
-        subject = f"PENDING SI : | {datetime.now().strftime('%Y-%m-%d')}"
-        
-        plain_body = "Dear Team,\n\nPlease find below the list of bookings with SI cutoff dates within the next 24 hours.\n\n"
-        for booking in pending_si_data:
-            plain_body += f"""
-Booking No: {booking['Booking No']}
-Customer: {booking['Customer']}
-FPOD: {booking['FPOD']}
-Equipment Type: {booking['Equipment Type']}
-Vessel: {booking['Vessel']}
-ETD: {booking['ETD']}
-SI Cutoff: {booking['SI Cutoff']}
-"""
-        plain_body += "\nAn Excel file with the details is also attached.\n\nNote: This is an Auto Generated Mail."
-        
-        html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear Team,</p>
-    <p>Please find below the list of bookings with SI cutoff dates within the next 24 hours.</p>
-    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
-        <tr style="background-color: #f2f2f2;">
-            <th>Booking No</th>
-            <th>Customer</th>
-            <th>FPOD</th>
-            <th>Equipment Type</th>
-            <th>Vessel</th>
-            <th>ETD</th>
-            <th>SI Cutoff</th>
-        </tr>
-"""
-        for booking in pending_si_data:
-            html_body += f"""
-        <tr>
-            <td>{booking['Booking No']}</td>
-            <td>{booking['Customer']}</td>
-            <td>{booking['FPOD']}</td>
-            <td>{booking['Equipment Type'] if booking['Equipment Type'] else 'N/A'}</td>
-            <td>{booking['Vessel']}</td>
-            <td>{booking['ETD']}</td>
-            <td>{booking['SI Cutoff']}</td>
-        </tr>
-"""
-        html_body += """
-    </table>
-    <p>An Excel file with the details is also attached.</p>
-    <p><em>Note: This is an Auto Generated Mail.</em></p>
-</body>
-</html>
-"""
-        
-        # For API-based email services, we need to handle attachments differently
-        # Since Resend/SendGrid API don't easily support attachments in this simple implementation,
-        # we'll send without attachment for now, or use SMTP if local
-        if not IS_RENDER:
-            # Local: Use SMTP with attachment
-            try:
-                msg = MIMEMultipart('alternative')
-                msg['From'] = sender_email
-                msg['To'] = ", ".join(to_emails)
-                msg['Cc'] = ", ".join(cc_emails)
-                msg['Subject'] = subject
-                
-                msg.attach(MIMEText(plain_body, 'plain'))
-                msg.attach(MIMEText(html_body, 'html'))
-                
-                # Attach Excel file
-                attachment = MIMEApplication(excel_content, _subtype="xlsx")
-                attachment.add_header('Content-Disposition', 'attachment', filename=excel_file)
-                msg.attach(attachment)
-                
-                with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                    server.starttls()
-                    server.login(sender_email, normalized_app_password(SENDER_PASSWORD_MUMBAI))
-                    recipients = to_emails + cc_emails
-                    server.sendmail(sender_email, recipients, msg.as_string())
-                    print(f"Pending SI report sent via SMTP")
-            except Exception as e:
-                print(f"SMTP failed for pending SI report: {e}")
-                # Fallback to API without attachment
-                ok, details = send_email_smart(sender_email, sender_name, to_emails, cc_emails, 
-                                              subject + " (No attachment - SMTP failed)", plain_body, html_body)
-                if ok:
-                    print(f"Pending SI report sent via API (no attachment): {details}")
-        else:
-            # On Render: Use API without attachment for now
-            plain_body += "\n\n[Note: Excel attachment not available via API on Render]"
-            html_body += "<p><em>[Note: Excel attachment not available via API on Render]</em></p>"
-            
-            ok, details = send_email_smart(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
-            if ok:
-                print(f"Pending SI report sent via API: {details}")
+    def __init__(self, max_size=2048, ttl=3600, negative_ttl=120):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # key -> (location or None, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return (found, location). found is False when the key is absent or expired."""
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[1] > now:
+                self._entries.move_to_end(key)
+                if cached[0] is None:
+                    self.negative_hits += 1
+                    metrics.location_cache.inc(result="negative_hit")
+                else:
+                    self.hits += 1
+                    metrics.location_cache.inc(result="hit")
+                return True, cached[0]
+            if cached is not None:
+                del self._entries[key]
+            self.misses += 1
+        metrics.location_cache.inc(result="miss")
+        return False, None
+
+    def put(self, key, location):
+        ttl = self.ttl if location else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (location or None, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, booking_id=None, booking_no=None):
+        """Drop one booking's entries, or everything when neither key is given."""
+        with self._lock:
+            if not booking_id and not booking_no:
+                self._entries.clear()
+                return
+            self._entries.pop(("id", booking_id), None)
+            self._entries.pop(("bookingNo", booking_no), None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits,
+                    "negative_hits": self.negative_hits, "misses": self.misses}
+
+location_cache = LocationCache(LOCATION_CACHE_SIZE, LOCATION_CACHE_TTL, LOCATION_CACHE_NEGATIVE_TTL)
+
+def _cached_location(booking_id, booking_no):
+    """(found, location) from the cache; found only when every given key is cached or one is positive."""
+    found_all = True
+    for key in (("id", booking_id), ("bookingNo", booking_no)):
+        if not key[1]:
+            continue
+        found, location = location_cache.get(key)
+        if found and location:
+            return True, location
+        found_all = found_all and found
+    return found_all and bool(booking_id or booking_no), None
+
+def _remember_location(booking_id, booking_no, location):
+    for key in (("id", booking_id), ("bookingNo", booking_no)):
+        if key[1]:
+            location_cache.put(key, location)
+
+def sob_booking_keys(data):
+    """(Firestore document id, bookingNo) from an SOB request body."""
+    booking_id = data.get('id') or data.get('entry_id')
+    booking_no = data.get('booking_no') or data.get('bookingNo') or ''
+    return booking_id, booking_no
+
+def resolve_sob_location(booking_id, booking_no):
+    """Location of one booking: live index first, then Firestore by id, then by bookingNo."""
+    location_from_db = None
+
+    # Live index first, when the listener is connected
+    if entries_index_available():
+        entries_index = get_entries_index()
+        indexed = None
+        if booking_id:
+            indexed = entries_index.get_by_id(booking_id)
+        if indexed is None and booking_no:
+            indexed = entries_index.get_by_booking_no(booking_no)
+        if indexed is not None:
+            location_from_db = indexed.location.strip()
+            print(f"[SOB] Location from index for {booking_id or booking_no}: {location_from_db}")
+    if location_from_db:
+        return location_from_db
+
+    found, location = _cached_location(booking_id, booking_no)
+    if found:
+        print(f"[SOB] Location from cache for {booking_id or booking_no}: {location}")
+        return location
+
+    lookup_failed = False
+    # Prefer lookup by Firestore document id
+    if not location_from_db and booking_id:
+        try:
+            doc_ref = get_db().collection("entries").document(booking_id)
+            doc = doc_ref.get(field_paths=["location"])
+            if doc.exists:
+                entry = doc.to_dict()
+                location_from_db = _extract_loc_str(entry.get('location'))
+                print(f"[SOB] Location by id {booking_id}: {location_from_db}")
             else:
-                print(f"Failed to send pending SI report: {details}")
-        
-        # Clean up
-        if os.path.exists(excel_file):
-            os.remove(excel_file)
-
-    except Exception as e:
-        print(f"Error sending pending SI report: {str(e)}")
-        traceback.print_exc()
-
-def fetch_royal_castor_data():
-    """Fetch bookings for Royal Castor where referenceNo exists."""
-    try:
-        bookings_ref = db.collection("entries")
-        docs = bookings_ref.stream()
-        royal_castor_data = []
-
-        for doc in docs:
-            entry = doc.to_dict()
-            entry["id"] = doc.id
-
-            customer = entry.get("customer", {})
-            if not isinstance(customer, dict):
-                print(f"Skipping entry {entry['id']}: 'customer' field is not a dictionary, found {type(customer)}: {customer}")
-                continue
-
-            customer_name = customer.get("name", "")
-            if "ROYAL CASTOR" in customer_name.upper():
-                print(f"Found Royal Castor booking: {entry['id']}, bookingNo: {entry.get('bookingNo', 'N/A')}")
+                print(f"[SOB] No Firestore entry for id {booking_id}")
+        except Exception as e:
+            lookup_failed = True
+            print(f"[SOB] Error fetching entry by id {booking_id}: {e}")
+
+    # Fallback: lookup by bookingNo if still unknown
+    if not location_from_db and booking_no:
+        try:
+            query_ref = (get_db().collection("entries").where("bookingNo", "==", booking_no)
+                         .select(["location"]).limit(1))
+            docs = list(query_ref.stream())
+            if docs:
+                entry = docs[0].to_dict()
+                location_from_db = _extract_loc_str(entry.get('location'))
+                print(f"[SOB] Location by bookingNo {booking_no}: {location_from_db}")
             else:
-                continue
-
-            reference_no = entry.get("referenceNo", "")
-            if not reference_no:
-                print(f"No referenceNo found for entry {entry['id']}")
-                continue
-
-            container_no = ""
-            if "equipmentDetails" in entry and entry["equipmentDetails"]:
-                if isinstance(entry["equipmentDetails"], list):
-                    container_no = ", ".join(
-                        eq.get("containerNo", "") for eq in entry["equipmentDetails"] if eq.get("containerNo")
-                    )
-                else:
-                    print(f"Entry {entry['id']}: 'equipmentDetails' is not a list, found {type(entry['equipmentDetails'])}")
-                    container_no = entry.get("containerNo", "")
-
-            etd = entry.get("etd", "")
-            if etd:
-                try:
-                    etd = pd.to_datetime(etd).strftime('%d-%m-%Y')
-                except Exception as e:
-                    print(f"Error parsing ETD for entry {entry['id']}: {e}")
-                    etd = ""
-
-            booking_data = {
-                "Customer": customer_name,
-                "Line": entry.get("line", ""),
-                "Reference No": reference_no,
-                "Booking No": entry.get("bookingNo", ""),
-                "Container No": container_no,
-                "Vessel": entry.get("vessel", ""),
-                "ETD": etd,
-                "Customer Email": customer.get("customerEmail", ["UJWALA@ROYALCASTOR.IN"])[0]
-            }
-            royal_castor_data.append(booking_data)
-
-        return royal_castor_data
+                print(f"[SOB] No Firestore entry for bookingNo {booking_no}")
+        except Exception as e:
+            lookup_failed = True
+            print(f"[SOB] Error querying by bookingNo {booking_no}: {e}")
 
-    except Exception as e:
-        print(f"Error fetching Royal Castor data: {str(e)}")
-        return []
-
-def send_royal_castor_vessel_update():
-    """Send daily vessel update to Royal Castor."""
-    try:
-        royal_castor_data = fetch_royal_castor_data()
-        if not royal_castor_data:
-            print("No bookings for Royal Castor with referenceNo.")
-            return
+    # Errors are not cached as "not found"
+    if location_from_db or not lookup_failed:
+        _remember_location(booking_id, booking_no, location_from_db)
+    return location_from_db
 
-        # Sort the data by ETD (earliest to latest)
-        royal_castor_data.sort(key=lambda x: pd.to_datetime(x.get('ETD', ''), errors='coerce'))
-
-        sender_email = SENDER_EMAIL_MUMBAI
-        sender_name = "Dessert Marine Services"
-        customer_email = royal_castor_data[0]["Customer Email"] if royal_castor_data else "UJWALA@ROYALCASTOR.IN"
-        to_emails = [customer_email]
-        cc_emails = ["info@dessertmarine.com"]
-        subject = f"Daily Vessel Update : {datetime.now().strftime('%Y-%m-%d')} || Royal Castor"
-        
-        plain_body = "Dear Royal Castor Team,\n\nPlease find below the daily vessel update.\n\n"
-        for booking in royal_castor_data:
-            plain_body += f"""
-Customer: {booking['Customer']}
-Line: {booking['Line']}
-Reference No: {booking['Reference No']}
-Booking No: {booking['Booking No']}
-Container No: {booking['Container No']}
-Vessel: {booking['Vessel']}
-ETD: {booking['ETD']}
-"""
-        plain_body += "\nNote: This is an Auto Generated Mail."
-        
-        html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear Royal Castor Team,</p>
-    <p>Please find below the daily vessel update.</p>
-    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
-        <tr style="background-color: #f2f2f2;">
-            <th>Customer</th>
-            <th>Line</th>
-            <th>Reference No</th>
-            <th>Booking No</th>
-            <th>Container No</th>
-            <th>Vessel</th>
-            <th>ETD</th>
-        </tr>
-"""
-        for booking in royal_castor_data:
-            html_body += f"""
-        <tr>
-            <td>{booking['Customer']}</td>
-            <td>{booking['Line'] if booking['Line'] else 'N/A'}</td>
-            <td>{booking['Reference No']}</td>
-            <td>{booking['Booking No']}</td>
-            <td>{booking['Container No'] if booking['Container No'] else 'N/A'}</td>
-            <td>{booking['Vessel']}</td>
-            <td>{booking['ETD']}</td>
-        </tr>
-"""
-        html_body += """
-    </table>
-    <p><em>Note: This is an Auto Generated Mail.</em></p>
-</body>
-</html>
-"""
-        
-        ok, details = send_email_smart(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
-        if ok:
-            print(f"Royal Castor vessel update sent: {details}")
-        else:
-            print(f"Failed to send Royal Castor update: {details}")
+def resolve_sob_locations(keys):
+    """
+    Locations for many (document id, bookingNo) pairs, aligned with `keys`
+    (None where unknown). Uses the live index when available, otherwise one
+    get_all for the ids and one "in" query (chunked at FIRESTORE_IN_LIMIT)
+    for the bookingNos still unresolved. Cached locations (including cached
+    misses) are served without a read.
+    """
+    locations = [None] * len(keys)
+    settled = [False] * len(keys)
+
+    if entries_index_available():
+        entries_index = get_entries_index()
+        for i, (booking_id, booking_no) in enumerate(keys):
+            indexed = (entries_index.get_by_id(booking_id) if booking_id else None) \
+                or (entries_index.get_by_booking_no(booking_no) if booking_no else None)
+            if indexed is not None:
+                locations[i] = indexed.location.strip() or None
+                settled[i] = bool(locations[i])
+
+    for i, (booking_id, booking_no) in enumerate(keys):
+        if not settled[i]:
+            settled[i], locations[i] = _cached_location(booking_id, booking_no)
+
+    ids = sorted({booking_id for i, (booking_id, _) in enumerate(keys) if booking_id and not settled[i]})
+    lookup_failed = False
+    if ids:
+        try:
+            entries = get_db().collection("entries")
+            by_id = {}
+            for doc in get_db().get_all([entries.document(doc_id) for doc_id in ids], field_paths=["location"]):
+                if doc.exists:
+                    by_id[doc.id] = _extract_loc_str(doc.to_dict().get('location'))
+            for i, (booking_id, _) in enumerate(keys):
+                if not locations[i] and by_id.get(booking_id):
+                    locations[i] = by_id[booking_id]
+            print(f"[SOB] Resolved {len(by_id)} of {len(ids)} ids in one read")
+        except Exception as e:
+            lookup_failed = True
+            print(f"[SOB] Error fetching entries by id: {e}")
+
+    booking_nos = sorted({booking_no for i, (_, booking_no) in enumerate(keys)
+                          if booking_no and not settled[i] and not locations[i]})
+    if booking_nos:
+        try:
+            by_booking_no = {}
+            for start in range(0, len(booking_nos), FIRESTORE_IN_LIMIT):
+                chunk = booking_nos[start:start + FIRESTORE_IN_LIMIT]
+                query_ref = (get_db().collection("entries").where("bookingNo", "in", chunk)
+                             .select(["bookingNo", "location"]))
+                for doc in query_ref.stream():
+                    entry = doc.to_dict()
+                    by_booking_no.setdefault(entry.get("bookingNo"), _extract_loc_str(entry.get('location')))
+            for i, (_, booking_no) in enumerate(keys):
+                if not locations[i] and by_booking_no.get(booking_no):
+                    locations[i] = by_booking_no[booking_no]
+            print(f"[SOB] Resolved {len(by_booking_no)} of {len(booking_nos)} bookingNos by query")
+        except Exception as e:
+            lookup_failed = True
+            print(f"[SOB] Error querying entries by bookingNo: {e}")
+
+    for i, (booking_id, booking_no) in enumerate(keys):
+        # Errors are not cached as "not found"
+        if not settled[i] and (locations[i] or not lookup_failed):
+            _remember_location(booking_id, booking_no, locations[i])
+    return locations
+
+def compose_sob_email(data, location):
+    """
+    Build the send_email_smart arguments for one SOB request body.
+    Returns (send_args, None), or (None, error message) when emails are missing.
+    """
+    booking_no = sob_booking_keys(data)[1]
+    container_no = data.get('container_no')
+
+    customer_emails = _coerce_emails(data.get('customer_email'))
+    sales_person_emails = _coerce_emails(data.get('sales_person_email'))
+
+    if not customer_emails or not sales_person_emails:
+        print("[SOB] Missing customer_email or sales_person_email")
+        return None, "Customer or salesperson email missing"
+
+    # Container no formatting
+    if container_no is None:
+        container_no_str = ""
+    elif isinstance(container_no, list):
+        container_no_str = ", ".join(str(c) for c in container_no if c)
+    elif isinstance(container_no, str):
+        container_no_str = container_no
+    else:
+        container_no_str = str(container_no)
 
-    except Exception as e:
-        print(f"Error sending Royal Castor vessel update: {str(e)}")
-        traceback.print_exc()
+    # Pick sender based on LOCATION
+    sender_email, _ = get_sender_by_location(location)
+    sender_name = "Dessert Marine Services"
+    
+    # Compose email
+    subject, plain_body, html_body = render_email(SOB_TEMPLATE, {
+        "customer_name": data.get('customer_name'),
+        "vessel": data.get('vessel'),
+        "voyage": data.get('voyage'),
+        "booking_no": booking_no,
+        "bl_no": data.get('bl_no', ''),
+        "pol": data.get('pol'),
+        "pod": data.get('pod'),
+        "fpod": data.get('fpod', ''),
+        "volume": data.get('volume'),
+        "container_no": container_no_str,
+        "container_no_or_na": container_no_str if container_no_str else 'N/A',
+        "sob_date": data.get('sob_date'),
+    })
+    print(f"[SOB] Sending from {sender_email} (location: {location}) to {customer_emails} CC {sales_person_emails}")
+    return (sender_email, sender_name, customer_emails, sales_person_emails, subject, plain_body, html_body), None
 
 @app.route('/api/send-sob-email', methods=['POST'])
 def send_sob_email():
@@ -813,170 +482,100 @@ def send_sob_email():
         data = request.get_json()
         print(f"Received data: {data}")
 
-        # Inputs from request
-        booking_id = data.get('id') or data.get('entry_id')
-        booking_no = data.get('booking_no') or data.get('bookingNo') or ''
-        customer_email = data.get('customer_email')
-        sales_person_email = data.get('sales_person_email')
-        customer_name = data.get('customer_name')
-        sob_date = data.get('sob_date')
-        vessel = data.get('vessel')
-        voyage = data.get('voyage')
-        pol = data.get('pol')
-        pod = data.get('pod')
-        fpod = data.get('fpod', '')
-        container_no = data.get('container_no')
-        volume = data.get('volume')
-        bl_no = data.get('bl_no', '')
-
         # Find LOCATION from Firestore
-        def _extract_loc_str(loc_val):
-            if isinstance(loc_val, dict):
-                return (loc_val.get('name') or '').strip()
-            return (loc_val or '').strip()
-
-        location_from_db = None
-
-        # Prefer lookup by Firestore document id
-        if booking_id:
-            try:
-                doc_ref = db.collection("entries").document(booking_id)
-                doc = doc_ref.get()
-                if doc.exists:
-                    entry = doc.to_dict()
-                    location_from_db = _extract_loc_str(entry.get('location'))
-                    print(f"[SOB] Location by id {booking_id}: {location_from_db}")
-                else:
-                    print(f"[SOB] No Firestore entry for id {booking_id}")
-            except Exception as e:
-                print(f"[SOB] Error fetching entry by id {booking_id}: {e}")
-
-        # Fallback: lookup by bookingNo if still unknown
-        if not location_from_db and booking_no:
-            try:
-                query_ref = db.collection("entries").where("bookingNo", "==", booking_no).limit(1)
-                docs = list(query_ref.stream())
-                if docs:
-                    entry = docs[0].to_dict()
-                    location_from_db = _extract_loc_str(entry.get('location'))
-                    print(f"[SOB] Location by bookingNo {booking_no}: {location_from_db}")
-                else:
-                    print(f"[SOB] No Firestore entry for bookingNo {booking_no}")
-            except Exception as e:
-                print(f"[SOB] Error querying by bookingNo {booking_no}: {e}")
+        booking_id, booking_no = sob_booking_keys(data)
+        location_from_db = resolve_sob_location(booking_id, booking_no)
 
         # Last resort: trust request body (or default MUMBAI)
         location = location_from_db or _extract_loc_str(data.get('location')) or "MUMBAI"
         print(f"[SOB] Using location: {location}")
 
-        # Coerce email arrays
-        def _coerce_emails(val):
-            if not val:
-                return []
-            if isinstance(val, list):
-                return [e.strip() for e in val if str(e).strip()]
-            if isinstance(val, str):
-                parts = [p.strip() for p in val.split(",")]
-                return [p for p in parts if p]
-            return [str(val).strip()] if str(val).strip() else []
-
-        customer_emails = _coerce_emails(customer_email)
-        sales_person_emails = _coerce_emails(sales_person_email)
-
-        if not customer_emails or not sales_person_emails:
-            print("[SOB] Missing customer_email or sales_person_email")
-            return jsonify({"error": "Customer or salesperson email missing"}), 400
-
-        # Container no formatting
-        if container_no is None:
-            container_no_str = ""
-        elif isinstance(container_no, list):
-            container_no_str = ", ".join(str(c) for c in container_no if c)
-        elif isinstance(container_no, str):
-            container_no_str = container_no
-        else:
-            container_no_str = str(container_no)
-
-        # Pick sender based on LOCATION
-        sender_email, _ = get_sender_by_location(location)
-        sender_name = "Dessert Marine Services"
+        send_args, error = compose_sob_email(data, location)
+        if error:
+            return jsonify({"error": error}), 400
         
-        # Compose email
-        subject = f"{customer_name} | SHIPPED ON BOARD | {vessel} | {booking_no} | {bl_no}"
-        
-        plain_body = f"""
-Dear Sir/Madam,
-
-We are pleased to confirm your Subject Shipment is Shipped On Board.
-Details as Below:
-
-BOOKING NO: {booking_no}
-POL: {pol}
-POD: {pod}
-FPOD: {fpod}
-VOLUME: {volume}
-CONTAINER NO: {container_no_str}
-VESSEL: {vessel}
-VOYAGE: {voyage}
-SOB DATE: {sob_date}
-
-For any queries please write to cs team.
-
-Note: This is an Auto Generated Mail.
-"""
-        html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear Sir/Madam,</p>
-    <p>We are pleased to confirm your Subject Shipment is Shipped On Board.</p>
-    <p>Details as Below:</p>
-    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
-        <tr style="background-color: #f2f2f2;">
-            <th>BOOKING NO</th>
-            <th>POL</th>
-            <th>POD</th>
-            <th>FPOD</th>
-            <th>VOLUME</th>
-            <th>CONTAINER NO</th>
-            <th>VESSEL</th>
-            <th>VOYAGE</th>
-            <th>SOB DATE</th>
-        </tr>
-        <tr>
-            <td>{booking_no}</td>
-            <td>{pol}</td>
-            <td>{pod}</td>
-            <td>{fpod}</td>
-            <td>{volume}</td>
-            <td>{container_no_str if container_no_str else 'N/A'}</td>
-            <td>{vessel}</td>
-            <td>{voyage}</td>
-            <td>{sob_date}</td>
-        </tr>
-    </table>
-    <p>For any queries please write to cs team.</p>
-    <p><em>Note: This is an Auto Generated Mail.</em></p>
-</body>
-</html>
-"""
-        print(f"[SOB] Sending from {sender_email} (location: {location}) to {customer_emails} CC {sales_person_emails}")
+        idempotency_key = (request_idempotency_key(data)
+                           or default_idempotency_key("sob", booking_no or booking_id, send_args))
+        if wants_async_send(data):
+            return queue_email_response("sob", send_args, idempotency_key)
         
         # Use smart email sending
-        ok, details = send_email_smart(sender_email, sender_name, customer_emails, 
-                                      sales_person_emails, subject, plain_body, html_body)
+        status, details, outbox_id = send_durable(idempotency_key, "sob", send_args)
         
-        if ok:
+        if status == "sent":
             print(f"[SOB] Email sent successfully via {details}")
             return jsonify({"message": f"Email sent successfully via {details.split(':')[0]}"}), 200
         else:
-            print(f"[SOB] Email sending failed: {details}")
-            return jsonify({"error": f"Email sending failed: {details}"}), 502
+            print(f"[SOB] Email sending failed ({status}): {details}")
+            return durable_send_response(status, details, outbox_id)
 
     except Exception as e:
         print(f"[SOB] Error sending email: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/send-sob-email/batch', methods=['POST'])
+def send_sob_email_batch():
+    """
+    Send SOB emails for many bookings in one request. The body is a list of
+    /api/send-sob-email payloads (or {"bookings": [...]}). Locations are
+    resolved with batched Firestore reads and the emails are sent
+    concurrently. Returns one result per booking, in request order.
+    """
+    try:
+        data = request.get_json()
+        items = data.get("bookings") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "Expected a non-empty list of bookings"}), 400
+        if len(items) > SOB_BATCH_MAX:
+            return jsonify({"error": f"At most {SOB_BATCH_MAX} bookings per request"}), 400
+        print(f"[SOB] Batch of {len(items)} bookings")
+
+        results = [None] * len(items)
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i] = {"index": i, "ok": False, "error": "Booking must be an object"}
+
+        keys = [sob_booking_keys(item) if isinstance(item, dict) else (None, "") for item in items]
+        locations = resolve_sob_locations(keys)
+
+        batch_key = request.headers.get("Idempotency-Key")
+        sends = {}
+        with ThreadPoolExecutor(max_workers=max(1, SOB_BATCH_WORKERS)) as pool:
+            for i, item in enumerate(items):
+                if results[i] is not None:
+                    continue
+                location = locations[i] or _extract_loc_str(item.get('location')) or "MUMBAI"
+                send_args, error = compose_sob_email(item, location)
+                if error:
+                    results[i] = {"index": i, "booking_no": keys[i][1], "ok": False, "error": error}
+                    continue
+                idempotency_key = item.get("idempotency_key") or (
+                    f"{batch_key}:{keys[i][1] or keys[i][0] or i}" if batch_key
+                    else default_idempotency_key("sob", keys[i][1] or keys[i][0], send_args))
+                sends[pool.submit(send_email_durable, idempotency_key, "sob", *send_args)] = (i, location)
+
+            for future in as_completed(sends):
+                i, location = sends[future]
+                try:
+                    ok, details = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    ok, details = False, str(e)
+                result = {"index": i, "booking_no": keys[i][1], "location": location, "ok": ok}
+                result["message" if ok else "error"] = details
+                results[i] = result
+
+        sent = sum(1 for r in results if r["ok"])
+        print(f"[SOB] Batch done: {sent} sent, {len(results) - sent} failed")
+        status = 200 if sent == len(results) else 207
+        return jsonify({"sent": sent, "failed": len(results) - sent, "results": results}), status
+
+    except Exception as e:
+        print(f"[SOB] Error sending batch: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/send-selling-email', methods=['POST'])
 def send_selling_email():
     """Send selling rate email."""
@@ -1006,282 +605,58 @@ def send_selling_email():
         sender_name = "Dessert Marine Services"
         to_emails = ["manas.jadhav.7779@gmail.com", "tech.manasjadhav@gmail.com"]
         cc_emails = [sales_person_email]
-        subject = f"Selling | {bl_no}"
-        
-        plain_body = f"""
-Dear Team,
-
-Please find below the details for the selling rate:
-
-BL/NO: {bl_no}
-BOOKING NO: {booking_no}
-CUSTOMER: {customer_name}
-POL: {pol}
-FPOD: {fpod}
-VOLUME: {volume}
-BUY RATE: {buy_rate}
-SELL RATE: {sell_rate}
-
-Note: This is an Auto Generated Mail.
-"""
-        html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear Team,</p>
-    <p>Please find below the details for the selling rate:</p>
-    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
-        <tr style="background-color: #f2f2f2;">
-            <th>BL/NO</th>
-            <th>BOOKING NO</th>
-            <th>CUSTOMER</th>
-            <th>POL</th>
-            <th>FPOD</th>
-            <th>VOLUME</th>
-            <th>BUY RATE</th>
-            <th>SELL RATE</th>
-        </tr>
-        <tr>
-            <td>{bl_no}</td>
-            <td>{booking_no}</td>
-            <td>{customer_name}</td>
-            <td>{pol}</td>
-            <td>{fpod}</td>
-            <td>{volume}</td>
-            <td>{buy_rate}</td>
-            <td>{sell_rate}</td>
-        </tr>
-    </table>
-    <p><em>Note: This is an Auto Generated Mail.</em></p>
-</body>
-</html>
-"""
+        subject, plain_body, html_body = render_email(SELLING_TEMPLATE, {
+            "bl_no": bl_no,
+            "booking_no": booking_no,
+            "customer_name": customer_name,
+            "pol": pol,
+            "fpod": fpod,
+            "volume": volume,
+            "buy_rate": buy_rate,
+            "sell_rate": sell_rate,
+        })
         print(f"Attempting to send selling email from {sender_email} to {to_emails} with CC {cc_emails}")
         
-        ok, details = send_email_smart(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
+        send_args = (sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
+        idempotency_key = (request_idempotency_key(data)
+                           or default_idempotency_key("selling", booking_no or bl_no, send_args))
+        if wants_async_send(data):
+            return queue_email_response("selling", send_args, idempotency_key)
+        
+        status, details, outbox_id = send_durable(idempotency_key, "selling", send_args)
         
-        if ok:
+        if status == "sent":
             print(f"Selling email sent successfully via {details}")
             return jsonify({"message": "Selling email sent successfully"}), 200
         else:
-            print(f"Failed to send selling email: {details}")
-            return jsonify({"error": f"Failed to send email: {details}"}), 502
+            print(f"Failed to send selling email ({status}): {details}")
+            return durable_send_response(status, details, outbox_id)
 
     except Exception as e:
         print(f"Error sending selling email: {str(e)}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-def fetch_bookings_by_salesperson():
-    """Fetch bookings grouped by salesperson."""
-    try:
-        bookings_ref = db.collection("entries")
-        docs = bookings_ref.stream()
-        bookings_by_salesperson = {}
-
-        for doc in docs:
-            entry = doc.to_dict()
-            entry["id"] = doc.id
-
-            customer = entry.get("customer", {})
-            if not isinstance(customer, dict):
-                print(f"Skipping entry {entry['id']}: 'customer' field is not a dictionary, found {type(customer)}: {customer}")
-                continue
-
-            sales_person_emails = customer.get("salesPersonEmail", [])
-            if not sales_person_emails:
-                print(f"No salesperson email found for entry {entry['id']}")
-                continue
-
-            container_no = ""
-            if "equipmentDetails" in entry and entry["equipmentDetails"]:
-                if isinstance(entry["equipmentDetails"], list):
-                    container_no = ", ".join(
-                        eq["containerNo"] for eq in entry["equipmentDetails"] if eq.get("containerNo")
-                    )
-                else:
-                    print(f"Skipping entry {entry['id']}: 'equipmentDetails' is not a list, found {type(entry['equipmentDetails'])}")
-            else:
-                container_no = entry.get("containerNo", "")
-
-            booking_data = {
-                "Customer Name": customer.get("name", ""),
-                "Sales Person": customer.get("salesPerson", ""),
-                "Booking No": entry.get("bookingNo", ""),
-                "SOB Date": entry.get("sobDate", ""),
-                "Vessel": entry.get("vessel", ""),
-                "Voyage": entry.get("voyage", ""),
-                "POL": entry.get("pol", ""),
-                "POD": entry.get("pod", ""),
-                "FPOD": entry.get("fpod", ""),
-                "Container No": container_no,
-                "Volume": entry.get("volume", ""),
-                "BL No": entry.get("blNo", ""),
-                "Booking Date": entry.get("bookingDate", ""),
-                "ETD": entry.get("etd", ""),
-                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "Pending SI": "Yes" if not entry.get("siFiled", False) else "No",
-                "Pending BL": "Yes" if not entry.get("blReleased", False) else "No",
-                "Location": entry.get("location", "")
-            }
-
-            for email in sales_person_emails:
-                if email:
-                    if email not in bookings_by_salesperson:
-                        bookings_by_salesperson[email] = {}
-                    loc = booking_data["Location"]
-                    if loc not in bookings_by_salesperson[email]:
-                        bookings_by_salesperson[email][loc] = []
-                    bookings_by_salesperson[email][loc].append(booking_data)
-
-        return bookings_by_salesperson
-
-    except Exception as e:
-        print(f"Error fetching bookings from Firestore: {str(e)}")
-        return {}
-
-def generate_excel_report(salesperson_email, bookings):
-    """Generate Excel report for salesperson."""
-    if not bookings:
-        print(f"No bookings found for salesperson {salesperson_email}")
-        return None
-
-    df = pd.DataFrame(bookings)
-    # Add SI Cutoff column if not present
-    if 'SI Cutoff' not in df.columns:
-        si_cutoff_list = []
-        for b in bookings:
-            val = b.get('SI Cutoff') or b.get('siCutOff') or ''
-            if isinstance(val, (str, type(None))):
-                si_cutoff_list.append(val)
-            elif hasattr(val, 'strftime'):
-                si_cutoff_list.append(val.strftime('%d/%m/%Y %H:%M'))
-            else:
-                si_cutoff_list.append(str(val))
-        df['SI Cutoff'] = si_cutoff_list
-    # Sort by ETD if present, else by SI Cutoff
-    sort_cols = []
-    if 'ETD' in df.columns:
-        sort_cols.append('ETD')
-    if 'SI Cutoff' in df.columns:
-        sort_cols.append('SI Cutoff')
-    if sort_cols:
-        for col in sort_cols:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-        df = df.sort_values(by=sort_cols, ascending=True)
-        # Format back to string for Excel
-        for col in sort_cols:
-            df[col] = df[col].dt.strftime('%d-%m-%Y')
-    # Format all date columns
-    date_columns = [col for col in df.columns if 'date' in col.lower() or col.upper() == 'ETD' or col.upper() == 'SI CUTOFF']
-    for col in date_columns:
-        df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%d-%m-%Y')
-    excel_filename = f"booking_report_{salesperson_email.split('@')[0]}_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
-    df.to_excel(excel_filename, index=False)
-    return excel_filename
-
-def send_daily_report():
-    """Send daily booking reports to salespeople."""
-    try:
-        bookings_by_salesperson = fetch_bookings_by_salesperson()
-        if not bookings_by_salesperson:
-            print("No bookings found for any salesperson.")
-            return
-        for salesperson_email, loc_dict in bookings_by_salesperson.items():
-            all_bookings = []
-            for location, bookings in loc_dict.items():
-                all_bookings.extend(bookings)
-            if not all_bookings:
-                continue
-            print(f"Generating report for {salesperson_email} with {len(all_bookings)} bookings (all locations)")
-            excel_file = generate_excel_report(salesperson_email, all_bookings)
-            if not excel_file:
-                continue
-            
-            # Read Excel file
-            with open(excel_file, 'rb') as f:
-                excel_content = f.read()
-            
-            sender_email, _ = get_sender_by_location(all_bookings[0].get('Location', ''))
-            sender_name = "Dessert Marine Services"
-            
-            # Parse recipient emails
-            all_sales_emails = []
-            if isinstance(salesperson_email, str):
-                all_sales_emails = [e.strip() for e in salesperson_email.split(',') if e.strip()]
-            elif isinstance(salesperson_email, list):
-                for e in salesperson_email:
-                    all_sales_emails.extend([x.strip() for x in str(e).split(',') if x.strip()])
-            else:
-                all_sales_emails = [str(salesperson_email)]
-            
-            subject = f"Daily Booking Report - {datetime.now().strftime('%Y-%m-%d')}"
-            sales_person_name = all_bookings[0].get('Sales Person', 'Salesperson') if all_bookings else 'Salesperson'
-            
-            plain_body = f"""
-Dear {sales_person_name},
-
-Please find attached the daily booking report as of {datetime.now().strftime('%Y-%m-%d')} (includes all locations).
-
-For any queries, please write to the CS team.
-
-Note: This is an Auto Generated Mail.
-"""
-            html_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif;">
-    <p>Dear {sales_person_name},</p>
-    <p>Please find attached the daily booking report as of {datetime.now().strftime('%Y-%m-%d')} (includes all locations).</p>
-    <p>For any queries, please write to the CS team.</p>
-    <p><em>Note: This is an Auto Generated Mail.</em></p>
-</body>
-</html>
-"""
-            # For local development with SMTP
-            if not IS_RENDER:
-                try:
-                    msg = MIMEMultipart()
-                    msg['From'] = sender_email
-                    msg['To'] = ', '.join(all_sales_emails)
-                    msg['Subject'] = subject
-                    
-                    msg.attach(MIMEText(plain_body, 'plain'))
-                    
-                    # Attach Excel file
-                    attachment = MIMEApplication(excel_content, _subtype="xlsx")
-                    attachment.add_header('Content-Disposition', 'attachment', filename=excel_file)
-                    msg.attach(attachment)
-                    
-                    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                        server.starttls()
-                        server.login(sender_email, normalized_app_password(SENDER_PASSWORD_MUMBAI))
-                        server.sendmail(sender_email, all_sales_emails, msg.as_string())
-                        print(f"Daily report sent via SMTP to {salesperson_email}")
-                except Exception as e:
-                    print(f"SMTP failed for daily report: {e}")
-                    # Fallback to API without attachment
-                    plain_body += "\n\n[Note: Attachment not available due to SMTP failure]"
-                    ok, details = send_email_smart(sender_email, sender_name, all_sales_emails, [], 
-                                                  subject + " (No attachment)", plain_body, html_body)
-                    if ok:
-                        print(f"Daily report sent via API (no attachment) to {salesperson_email}: {details}")
-            else:
-                # On Render: Use API without attachment
-                plain_body += "\n\n[Note: Excel attachment not available via API on Render]"
-                html_body += "<p><em>[Note: Excel attachment not available via API on Render]</em></p>"
-                
-                ok, details = send_email_smart(sender_email, sender_name, all_sales_emails, [], subject, plain_body, html_body)
-                if ok:
-                    print(f"Daily report sent via API to {salesperson_email}: {details}")
-                else:
-                    print(f"Failed to send daily report to {salesperson_email}: {details}")
-            
-            # Clean up
-            if os.path.exists(excel_file):
-                os.remove(excel_file)
-                
-    except Exception as e:
-        print(f"Error sending daily reports: {str(e)}")
-        traceback.print_exc()
+@app.route('/api/email-status/<message_id>', methods=['GET'])
+def email_status(message_id):
+    """Delivery status of an email queued by an async send."""
+    record = email_queue.status(message_id)
+    if record is None:
+        return jsonify({"error": "Unknown message id"}), 404
+    return jsonify(record), 200
+
+@app.route('/api/location-cache/invalidate', methods=['POST'])
+def invalidate_location_cache():
+    """Forget a booking's cached location (JSON {id, booking_no}); an empty body clears the cache."""
+    data = request.get_json(silent=True) or {}
+    booking_id, booking_no = sob_booking_keys(data)
+    location_cache.invalidate(booking_id, booking_no)
+    return jsonify({"success": True, "location_cache": location_cache.stats()}), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Counters and latency histograms in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/api/check-email-status', methods=['GET'])
 def check_email_status():
@@ -1291,29 +666,36 @@ def check_email_status():
         "resend_api_key": "Configured" if RESEND_API_KEY else "Not configured",
         "sendgrid_api_key": "Configured" if SENDGRID_API_KEY else "Not configured",
         "smtp_configured": True if SENDER_EMAIL_MUMBAI and SENDER_PASSWORD_MUMBAI else False,
-        "preferred_provider": "SendGrid" if SENDGRID_API_KEY else ("Resend" if RESEND_API_KEY else "SMTP")
+        "preferred_provider": "SendGrid" if SENDGRID_API_KEY else ("Resend" if RESEND_API_KEY else "SMTP"),
+        "circuit_breakers": {name: breaker.snapshot() for name, breaker in provider_breakers.items()},
+        "location_cache": location_cache.stats()
     }
     return jsonify(status), 200
 
-# Schedule tasks
-schedule.every().hour.do(send_si_cutoff_reminder)
-# Uncomment these when you want to enable them
-# schedule.every().day.at("18:00").do(send_pending_si_report)  # 6:00 PM IST
-# schedule.every().day.at("19:30").do(send_royal_castor_vessel_update)  # 7:30 PM IST
-# schedule.every().day.at("17:00").do(send_daily_report)  # 5:00 PM IST
+start_entries_index()
+start_outbox_worker()
+smtp_pool.start_reaper()
+
+# Optionally run the schedule inside every web worker (e.g. under gunicorn);
+# the lease in leader.py lets only one of them run the jobs at a time. Every
+# process that can take the lease registers the same jobs, daily reports
+# included, so whichever one holds it sends them.
+if (os.environ.get("SCHEDULER_IN_WEB", "false").lower() == "true"
+        and os.environ.get("RUN_SCHEDULER", "false").lower() != "true"):
+    from scheduler import register_jobs, run_scheduler
 
-def run_scheduler():
-    """Run the scheduled tasks."""
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    register_jobs()
+    threading.Thread(target=run_scheduler, name="scheduler", daemon=True).start()
 
 if __name__ == '__main__':
     if os.environ.get('RUN_SCHEDULER', 'false').lower() == 'true':
+        from scheduler import register_jobs, run_scheduler
+
         print(f"[WORKER] Starting scheduler on Render: {IS_RENDER}")
         print(f"[WORKER] Resend API Key: {'Configured' if RESEND_API_KEY else 'Not configured'}")
         print(f"[WORKER] SendGrid API Key: {'Configured' if SENDGRID_API_KEY else 'Not configured'}")
         print(f"[WORKER] Using SendGrid as primary email provider on Render")
+        register_jobs()
         scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
         scheduler_thread.start()
         while True:
@@ -1323,4 +705,4 @@ if __name__ == '__main__':
         print(f"[WEB] Resend API Key: {'Configured' if RESEND_API_KEY else 'Not configured'}")
         print(f"[WEB] SendGrid API Key: {'Configured' if SENDGRID_API_KEY else 'Not configured'}")
         print(f"[WEB] Using SendGrid as primary email provider on Render")
-        app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
\ No newline at end of file
+        app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,449 @@
+"""
+Offline benchmark for the report and reminder jobs.
+
+Generates synthetic "entries" documents, serves them from an in-memory
+Firestore fake and replaces every email transport with a no-op, then times
+the fetchers, Excel generation and the send_* jobs end to end. Nothing
+touches production Firestore and no mail is sent.
+
+    python benchmark.py --sizes 10000 100000 --save   # record a baseline
+    python benchmark.py --sizes 10000 100000          # compare against it
+    python benchmark.py --stage scan+build --read-latency-ms 50   # model RPC latency
+
+A stage slower than the baseline by more than --threshold is reported as a
+regression and the exit status is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Benchmark the default code paths regardless of the local .env
+os.environ.update({
+    "OUTBOX_ENABLED": "false",
+    "ENTRIES_LISTENER": "false",
+    "SI_CUTOFF_QUERY_MODE": "scan",
+    "SI_REMINDER_CATCHUP": "true",
+    "RENDER": "false",
+})
+
+import firestore_client
+import bookings
+import email_service
+import reminders
+import reports
+from config import IST
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmarks", "baseline.json")
+
+# ---------------------------------------------------------------------------
+# In-memory Firestore
+# ---------------------------------------------------------------------------
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection.id}/{self.id}"
+
+    def get(self, transaction=None, field_paths=None):
+        data = self._collection._docs.get(self.id)
+        if data is not None and field_paths is not None:
+            data = {k: data[k] for k in field_paths if k in data}
+        return FakeDocumentSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        docs = self._collection._docs
+        docs[self.id] = {**docs.get(self.id, {}), **data} if merge else dict(data)
+
+    def update(self, data):
+        if self.id not in self._collection._docs:
+            raise KeyError(f"No document to update: {self.path}")
+        self._collection._docs[self.id].update(data)
+
+    def delete(self):
+        self._collection._docs.pop(self.id, None)
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+}
+
+# Simulated round-trip time of one query RPC (--read-latency-ms)
+READ_LATENCY_SECONDS = 0.0
+
+class FakeQuery:
+    """Supports where (==, !=, <, <=, >, >=, in), order_by, limit, start_after and select."""
+
+    def __init__(self, collection, filters=(), order=None, limit=None, start_after=None, fields=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._order = order
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, limit=self._limit,
+                     start_after=self._start_after, fields=self._fields)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        if str(field) == "__name__":
+            value = getattr(value, "id", value)
+        return self._copy(filters=self._filters + ((str(field), op, value),))
+
+    def order_by(self, field, direction=None):
+        return self._copy(order=str(field))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document):
+        return self._copy(start_after=document)
+
+    def select(self, field_paths):
+        return self._copy(fields=tuple(field_paths))
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        return doc_id if field == "__name__" else data.get(field)
+
+    def stream(self, transaction=None):
+        if READ_LATENCY_SECONDS:
+            time.sleep(READ_LATENCY_SECONDS)
+        docs = self._collection._docs
+        items = [
+            (doc_id, data) for doc_id, data in docs.items()
+            if all(_OPERATORS[op](self._value(doc_id, data, field), value) for field, op, value in self._filters)
+        ]
+        if self._order:
+            items.sort(key=lambda item: (self._value(*item, self._order) is None, self._value(*item, self._order)))
+        if self._start_after is not None:
+            cursor = self._start_after
+            cursor = cursor.get("__name__") if isinstance(cursor, dict) else getattr(cursor, "id", cursor)
+            if self._order in (None, "__name__"):
+                items = [item for item in items if item[0] > cursor]
+            else:
+                cursor_value = self._value(cursor, docs.get(cursor, {}), self._order)
+                items = [item for item in items if self._value(*item, self._order) > cursor_value]
+        if self._limit is not None:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            if self._fields is not None:
+                data = {k: data[k] for k in self._fields if k in data}
+            yield FakeDocumentSnapshot(self._collection.document(doc_id), data)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+class FakeCollection(FakeQuery):
+    def __init__(self, name):
+        self.id = name
+        self._docs = {}
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self, doc_id)
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference, data):
+        self._ops.append(lambda: reference.update(data))
+
+    def delete(self, reference):
+        self._ops.append(reference.delete)
+
+    def commit(self):
+        for op in self._ops:
+            op()
+        self._ops = []
+
+class FakeFirestore:
+    """Just enough of google.cloud.firestore.Client for the jobs in this repo."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name)
+        return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch()
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for reference in references:
+            yield reference.get(field_paths=field_paths)
+
+    def collection_group(self, name):
+        return FakeCollectionGroup(self.collection(name))
+
+class FakeQueryPartition:
+    def __init__(self, start_at, end_at):
+        self.start_at = start_at
+        self.end_at = end_at
+
+class FakeCollectionGroup:
+    """Partition queries over one collection: split points at evenly spaced document ids."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def get_partitions(self, partition_count):
+        ids = sorted(self._collection._docs)
+        step = max(1, len(ids) // (partition_count + 1))
+        points = [self._collection.document(doc_id) for doc_id in ids[step::step]][:partition_count]
+        for start, end in zip([None] + points, points + [None]):
+            yield FakeQueryPartition(start, end)
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+PORTS = ["NHAVA SHEVA", "MUNDRA", "PIPAVAV", "HAZIRA", "CHENNAI"]
+DESTINATIONS = ["JEBEL ALI", "ROTTERDAM", "HAMBURG", "SINGAPORE", "NEW YORK", "SANTOS", "DURBAN"]
+VESSELS = ["MSC AURORA", "MAERSK KOLKATA", "CMA CGM TAGE", "ONE HARMONY", "EVER GIVEN"]
+EQUIPMENT = ["20GP", "40GP", "40HC", "20RF"]
+
+def make_entry(i, rng, now, salespeople):
+    """One realistic "entries" document, including the malformed shapes seen in production."""
+    cutoff = now + timedelta(hours=rng.choice([24, 48, rng.uniform(-48, 120)]), minutes=rng.randint(-20, 20))
+    etd = cutoff + timedelta(days=rng.randint(1, 5))
+    salesperson = rng.choice(salespeople)
+    customer_name = "ROYAL CASTOR SHIPPING" if rng.random() < 0.02 else f"CUSTOMER {rng.randint(1, 2000)}"
+    customer = {
+        "name": customer_name,
+        "customerEmail": [f"ops{rng.randint(1, 3)}@customer{i % 2000}.example.com"],
+        "salesPerson": salesperson.split("@")[0].title(),
+        "salesPersonEmail": [salesperson],
+    }
+    if rng.random() < 0.01:
+        customer = customer_name  # legacy string customer
+    containers = rng.randint(1, 4)
+    entry = {
+        "bookingNo": f"BK{i:08d}",
+        "customer": customer,
+        "location": rng.choice(["MUMBAI", "GUJARAT", {"name": "MUMBAI"}, {"name": "GUJARAT"}]),
+        "equipmentDetails": [
+            {"equipmentType": rng.choice(EQUIPMENT), "containerNo": f"MSKU{rng.randint(1000000, 9999999)}"}
+            for _ in range(containers)
+        ],
+        "vessel": rng.choice(VESSELS),
+        "voyage": f"{rng.randint(100, 999)}W",
+        "pol": rng.choice(PORTS),
+        "pod": rng.choice(DESTINATIONS),
+        "fpod": rng.choice(DESTINATIONS),
+        "volume": f"{containers} x {rng.choice(EQUIPMENT)}",
+        "blNo": f"BL{i:08d}" if rng.random() < 0.6 else "",
+        "line": rng.choice(["MSC", "MAERSK", "CMA", "ONE"]),
+        "referenceNo": f"REF{i}" if rng.random() < 0.5 else "",
+        "bookingDate": (now - timedelta(days=rng.randint(1, 30))).strftime("%Y-%m-%d"),
+        "sobDate": etd.strftime("%Y-%m-%d") if rng.random() < 0.3 else "",
+        "etd": rng.choice([etd.strftime("%Y-%m-%d"), etd.strftime("%Y-%m-%dT%H:%M:%S"), etd]),
+        "siCutOff": cutoff.strftime("%d/%m-%H%M HRS"),
+        "siCutOffAt": cutoff,
+        "siFiled": rng.random() < 0.4,
+        "blReleased": rng.random() < 0.3,
+    }
+    return entry
+
+def populate(client, size, seed=1):
+    rng = random.Random(seed)
+    now = datetime.now(IST)
+    salespeople = [f"sales{n}@dessertmarine.com" for n in range(50)]
+    entries = client.collection("entries")
+    for i in range(size):
+        entries.document(f"doc{i:08d}").set(make_entry(i, rng, now, salespeople))
+
+# ---------------------------------------------------------------------------
+# No-op transports
+# ---------------------------------------------------------------------------
+
+def install_noop_transports():
+    def noop_send(*args, **kwargs):
+        return True, "noop"
+
+    email_service.smtp_pool.sendmail = lambda *args, **kwargs: None
+    email_service.send_via_sendgrid = noop_send
+    email_service.send_via_resend = noop_send
+    email_service.send_batch_via_sendgrid = lambda messages: [(True, "noop")] * len(messages)
+
+def reset_caches():
+    """Forget every in-process cache so each run reads and parses from scratch."""
+    bookings.invalidate_entries_snapshot()
+    with bookings._bookings_cache_lock:
+        bookings._bookings_cache.update(source=None, bookings=None)
+    with bookings._date_cache_lock:
+        bookings._date_cache.clear()
+    bookings._parse_si_cutoff_cached.cache_clear()
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+def largest_salesperson(by_salesperson):
+    email, loc_dict = max(by_salesperson.items(), key=lambda item: sum(len(v) for v in item[1].values()))
+    return email, [b for rows in loc_dict.values() for b in rows]
+
+def stages():
+    """(name, setup, run). setup() returns the argument passed to run()."""
+    def warm():
+        reset_caches()
+        return bookings.get_bookings()
+
+    def fresh_reminders():
+        # Forget sent reminders too, or the ledger would skip every run after the first
+        reset_caches()
+        for name in (reminders.REMINDER_LEDGER_COLLECTION, reminders.REMINDER_STATE_COLLECTION):
+            firestore_client.get_db().collection(name)._docs.clear()
+
+    def daily_rows():
+        return largest_salesperson(reports.fetch_bookings_by_salesperson(warm()))
+
+    return [
+        ("scan+build", lambda: reset_caches(), lambda _: bookings.get_bookings()),
+        ("fetch_si_cutoff_data", warm, reminders.fetch_si_cutoff_data),
+        ("fetch_pending_si_data", warm, reports.fetch_pending_si_data),
+        ("fetch_royal_castor_data", warm, reports.fetch_royal_castor_data),
+        ("fetch_bookings_by_salesperson", warm, reports.fetch_bookings_by_salesperson),
+        ("generate_excel_report", daily_rows, lambda args: reports.generate_excel_report(*args)),
+        ("send_si_cutoff_reminder", fresh_reminders, lambda _: reminders.send_si_cutoff_reminder()),
+        ("send_daily_report", lambda: reset_caches(), lambda _: reports.send_daily_report()),
+    ]
+
+def run_stage(setup, run, runs, verbose):
+    samples = []
+    for _ in range(runs):
+        sink = sys.stdout if verbose else io.StringIO()
+        with contextlib.redirect_stdout(sink):
+            arg = setup()
+            start = time.perf_counter()
+            run(arg)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def warm_up():
+    """Pay the one-off lazy imports (pandas, openpyxl) before anything is timed."""
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+
+def benchmark(sizes, runs, verbose=False, only=None):
+    install_noop_transports()
+    warm_up()
+    results = {}
+    for size in sizes:
+        client = FakeFirestore()
+        firestore_client._db = client
+        reminders._reminder_ledger = None
+        print(f"[BENCH] Generating {size} entries...")
+        populate(client, size)
+        results[str(size)] = {}
+        for name, setup, run in stages():
+            if only and name not in only:
+                continue
+            seconds = run_stage(setup, run, runs, verbose)
+            results[str(size)][name] = round(seconds, 4)
+            print(f"[BENCH] {size:>8} {name:<32} {seconds * 1000:10.1f} ms")
+    return results
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for size, stage_results in results.items():
+        for name, seconds in stage_results.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = "REGRESSION" if ratio > threshold else ""
+            print(f"[BENCH] {size:>8} {name:<32} {before * 1000:10.1f} -> {seconds * 1000:10.1f} ms ({ratio:.2f}x) {flag}")
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the report and reminder jobs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000], help="Number of synthetic entries")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--stage", action="append", help="Only run this stage (repeatable)")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to compare against or write")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the jobs' own output")
+    parser.add_argument("--read-latency-ms", type=float, default=0.0,
+                        help="Simulated latency of each Firestore query (e.g. to compare SCAN_PARTITIONS)")
+    args = parser.parse_args()
+
+    global READ_LATENCY_SECONDS
+    READ_LATENCY_SECONDS = args.read_latency_ms / 1000
+
+    results = benchmark(args.sizes, args.runs, args.verbose, args.stage)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "runs": args.runs,
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"[BENCH] Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[BENCH] No baseline at {args.baseline}; run with --save to record one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"[BENCH] {len(regressions)} regression(s) over {args.threshold}x")
+        return 1
+    print("[BENCH] No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
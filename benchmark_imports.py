@@ -0,0 +1,59 @@
+"""
+Measure cold-start import time of the web and scheduler entry points.
+
+Each module is imported in a fresh interpreter several times; the median
+wall time is reported together with which heavy dependencies the import
+pulled in. Run from the repository root:
+
+    python benchmark_imports.py --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = ("app", "scheduler", "reminders", "reports", "email_service", "bookings")
+HEAVY = ("pandas", "openpyxl", "firebase_admin", "google.cloud.firestore", "requests", "flask")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module, runs):
+    samples = []
+    loaded = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+            capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            return {"module": module, "error": out.stderr.strip().splitlines()[-1]}
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"module": module, "median_ms": round(statistics.median(samples) * 1000, 1), "loaded": loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold import time of the entry modules")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("modules", nargs="*", default=MODULES, help="Modules to import")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = time_import(module, args.runs)
+        if "error" in result:
+            print(f"[BENCH] {module}: failed to import ({result['error']})")
+        else:
+            print(f"[BENCH] {module}: {result['median_ms']} ms, loaded: {', '.join(result['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,568 @@
+"""
+The "entries" collection: shared snapshot, live on_snapshot index, date
+parsing and the normalized Booking record every job reads.
+"""
+import os
+import time
+import threading
+import traceback
+from datetime import datetime
+from functools import lru_cache
+
+from config import IST, ENTRIES_LISTENER
+from firestore_client import get_db
+from scans import PaginatedScan, PartitionedScan, FirestoreCheckpoint, ScanError
+import metrics
+
+# Shared snapshot of the "entries" collection. Jobs that run in the same
+# window (e.g. the 13:30 daily report and Royal Castor update) reuse one read.
+ENTRIES_SNAPSHOT_TTL = int(os.environ.get("ENTRIES_SNAPSHOT_TTL", "300"))
+_entries_snapshot = {"entries": None, "fetched_at": 0.0, "fields": None}
+_entries_snapshot_lock = threading.Lock()
+# A snapshot scan that failed part-way; the next read within the TTL resumes it
+_partial_snapshot = {"scan": None, "fields": None, "started_at": 0.0}
+
+# Fields each job reads from "entries". Reads ask Firestore for only these
+# (a select() projection); the shared snapshot asks for the union.
+ENTRIES_PROJECTION = os.environ.get("ENTRIES_PROJECTION", "true").lower() == "true"
+_entry_fields = {}
+
+def declare_entry_fields(job, fields):
+    """Record the top-level "entries" fields `job` consumes. Returns them."""
+    fields = tuple(sorted(set(fields)))
+    _entry_fields[job] = fields
+    return fields
+
+def entry_fields(*jobs):
+    """
+    Projection for a read serving `jobs` (every declared job when none are
+    given): the sorted union of their fields, or None for whole documents
+    when projections are disabled or a job declared nothing.
+    """
+    if not ENTRIES_PROJECTION:
+        return None
+    jobs = jobs or tuple(_entry_fields)
+    if not jobs or any(job not in _entry_fields for job in jobs):
+        return None
+    return tuple(sorted({field for job in jobs for field in _entry_fields[job]}))
+
+def _covers(cached_fields, fields):
+    """True when a read made with projection `cached_fields` has every field in `fields`."""
+    if cached_fields is None:
+        return True
+    return fields is not None and set(fields) <= set(cached_fields)
+
+class EntriesIndex:
+    """
+    In-process index of "entries" as Booking records keyed by document id
+    and bookingNo, kept current by a Firestore on_snapshot listener.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_booking_no = {}
+        self._watch = None
+        self.ready = False
+        self.last_update = None
+        self._listeners = []
+        self._change_listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback()` after every applied batch of changes."""
+        self._listeners.append(callback)
+
+    def add_change_listener(self, callback):
+        """
+        Call `callback(entries)` with the added or modified entry dicts
+        (with "id" set) of every batch; after a (re)start, with all of them.
+        """
+        self._change_listeners.append(callback)
+
+    def start(self):
+        """
+        Start (or restart) the listener. The index is not ready until the
+        first snapshot, which rebuilds it from scratch so documents deleted
+        while the listener was down do not linger.
+        """
+        with self._lock:
+            self.ready = False
+            self._by_id = {}
+            self._by_booking_no = {}
+        self._watch = self._client.collection("entries").on_snapshot(self._on_snapshot)
+        print("[INDEX] Listening for changes on entries")
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        with self._lock:
+            self.ready = False
+
+    def is_connected(self):
+        watch = self._watch
+        return watch is not None and getattr(watch, "is_active", True)
+
+    def is_available(self):
+        """True when the index is populated and the listener is still running."""
+        return self.ready and self.is_connected()
+
+    def ensure_running(self):
+        """Restart the listener if the watch stream has been closed."""
+        if self._watch is not None and not self.is_connected():
+            print("[INDEX] Listener disconnected, restarting")
+            self.start()
+
+    def _remove(self, doc_id):
+        old = self._by_id.pop(doc_id, None)
+        if old and old.booking_no and self._by_booking_no.get(old.booking_no) is old:
+            del self._by_booking_no[old.booking_no]
+
+    def _add(self, doc):
+        entry = doc.to_dict()
+        entry["id"] = doc.id
+        booking = Booking.from_entry(entry)
+        self._by_id[doc.id] = booking
+        if booking.booking_no:
+            self._by_booking_no[booking.booking_no] = booking
+        return entry
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        changed = []
+        with self._lock:
+            if not self.ready:
+                # First snapshot after a (re)start: it holds the whole collection
+                self._by_id = {}
+                self._by_booking_no = {}
+                for doc in col_snapshot:
+                    changed.append(self._add(doc))
+            else:
+                for change in changes:
+                    self._remove(change.document.id)
+                    if change.type.name != "REMOVED":
+                        changed.append(self._add(change.document))
+            if not self.ready:
+                print(f"[INDEX] Ready with {len(self._by_id)} entries")
+            self.ready = True
+            self.last_update = time.time()
+        for callback in self._change_listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                print(f"[INDEX] Change listener failed: {e}")
+                traceback.print_exc()
+        for callback in self._listeners:
+            callback()
+
+    def bookings(self):
+        """Return the indexed bookings. Records are replaced on change, never modified."""
+        with self._lock:
+            return list(self._by_id.values())
+
+    def get_by_id(self, doc_id):
+        with self._lock:
+            return self._by_id.get(doc_id)
+
+    def get_by_booking_no(self, booking_no):
+        with self._lock:
+            return self._by_booking_no.get(booking_no)
+
+entries_index = None
+
+def entries_index_available():
+    """True when the live entries index can serve reads instead of Firestore."""
+    if entries_index is None:
+        return False
+    entries_index.ensure_running()
+    return entries_index.is_available()
+
+def _entry_from_doc(doc):
+    entry = doc.to_dict()
+    entry["id"] = doc.id
+    return entry
+
+def get_entries_snapshot(max_age=None, fields=None):
+    """
+    Return all "entries" documents as dicts (with "id" set), reading
+    Firestore at most once per ENTRIES_SNAPSHOT_TTL seconds.
+    Only `fields` are read (default: entry_fields(), the union every job
+    declared); a cached snapshot is reused when it has all of them.
+    The returned dicts are shared between callers and must not be modified.
+    """
+    ttl = ENTRIES_SNAPSHOT_TTL if max_age is None else max_age
+    fields = entry_fields() if fields is None else fields
+    with _entries_snapshot_lock:
+        cached = _entries_snapshot["entries"]
+        age = time.time() - _entries_snapshot["fetched_at"]
+        if cached is not None and age < ttl and _covers(_entries_snapshot["fields"], fields):
+            print(f"[SNAPSHOT] Reusing {len(cached)} entries ({age:.0f}s old)")
+            return cached
+
+        partial = _partial_snapshot
+        if (partial["scan"] is not None and partial["fields"] == fields
+                and time.time() - partial["started_at"] < ttl):
+            reader = partial["scan"]
+            print(f"[SNAPSHOT] Resuming scan with {reader.documents_read} entries already read")
+        else:
+            reader = PartitionedScan("entries_snapshot", get_db(), "entries", fields=fields)
+            partial.update(scan=reader, fields=fields, started_at=time.time())
+
+        read_before = reader.documents_read
+        with metrics.scan("entries_snapshot") as scan:
+            try:
+                entries = reader.read(_entry_from_doc)
+            finally:
+                scan.documents = reader.documents_read - read_before
+        partial.update(scan=None)
+
+        _entries_snapshot["entries"] = entries
+        _entries_snapshot["fetched_at"] = time.time()
+        _entries_snapshot["fields"] = fields
+        print(f"[SNAPSHOT] Read {len(entries)} entries from Firestore ({len(fields) if fields else 'all'} fields)")
+        return entries
+
+def invalidate_entries_snapshot():
+    """Drop the cached snapshot so the next reader goes back to Firestore."""
+    with _entries_snapshot_lock:
+        _entries_snapshot["entries"] = None
+        _entries_snapshot["fetched_at"] = 0.0
+        _entries_snapshot["fields"] = None
+        _partial_snapshot.update(scan=None)
+
+@lru_cache(maxsize=8192)
+def _parse_si_cutoff_cached(si_cutoff, reference_date):
+    date_part, time_part = si_cutoff.split('-')
+    hour_minute = time_part.replace(" HRS", "").strip()
+    day, month = date_part.split('/')
+    hour, minute = hour_minute[:2], hour_minute[2:]
+    # "dd/mm" has no year: take the candidate closest to the reference date so
+    # cutoffs in early January are not placed in the past during late December
+    candidates = []
+    for year in (reference_date.year - 1, reference_date.year, reference_date.year + 1):
+        try:
+            candidates.append(datetime.strptime(f"{day}/{month}/{year} {hour}:{minute}", "%d/%m/%Y %H:%M"))
+        except ValueError:
+            continue  # e.g. 29/02 outside a leap year
+    if not candidates:
+        raise ValueError(f"invalid day/month in {si_cutoff!r}")
+    reference = datetime.combine(reference_date, datetime.min.time())
+    dt = min(candidates, key=lambda c: abs(c - reference))
+    return IST.localize(dt)
+
+def parse_si_cutoff_date(si_cutoff, reference_date=None):
+    """
+    Parse SI cutoff date from dd/mm-hhmm HRS format to timezone-aware datetime.
+    Results are memoized per (raw string, reference day).
+    """
+    if reference_date is None:
+        reference_date = datetime.now(IST).date()
+    try:
+        return _parse_si_cutoff_cached(si_cutoff, reference_date)
+    except Exception as e:
+        print(f"Error parsing SI cutoff date {si_cutoff}: {str(e)}")
+        return None
+
+# Raw date value (ETD, SOB date, ...) -> naive pd.Timestamp in IST, or None
+_date_cache = {}
+_date_cache_lock = threading.Lock()
+
+def _to_naive_ist(ts):
+    import pandas as pd
+
+    if ts is None or pd.isna(ts):
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(IST).tz_localize(None)
+    return ts
+
+def parse_dates(values):
+    """
+    Parse a column of raw date values in one pass. Each distinct value is
+    parsed once (vectorized) and memoized, so repeated ETDs across fetchers,
+    sorts and Excel generation are not parsed again.
+    Returns a list of naive IST pd.Timestamp (or None) aligned with `values`.
+    """
+    # pandas is imported on first use so processes that never parse dates skip it
+    import pandas as pd
+
+    values = list(values)
+    with _date_cache_lock:
+        missing = list({v for v in values if v and _is_hashable(v) and v not in _date_cache})
+    if missing:
+        try:
+            parsed = pd.to_datetime(pd.Series(missing, dtype=object), errors='coerce', format='mixed')
+            parsed = [_to_naive_ist(ts) for ts in parsed]
+        except Exception:
+            parsed = []
+            for raw in missing:
+                try:
+                    parsed.append(_to_naive_ist(pd.to_datetime(raw)))
+                except Exception:
+                    parsed.append(None)
+        with _date_cache_lock:
+            _date_cache.update(zip(missing, parsed))
+    with _date_cache_lock:
+        return [_date_cache.get(v) if v and _is_hashable(v) else None for v in values]
+
+def _is_hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+def date_sort_key(ts):
+    """Sort key for parse_dates results: earliest first, missing dates last."""
+    return (ts is None, ts.value if ts is not None else 0)
+
+def _clean_emails(value):
+    """Email list from a Firestore field that may be a list or a comma-separated string."""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return ()
+    return tuple(e.strip() for e in value if isinstance(e, str) and e.strip())
+
+class Booking:
+    """
+    Normalized, read-only view of one "entries" document, built once at
+    ingestion and shared by every report. Customer and equipment shapes are
+    checked here; problems are kept in customer_error / equipment_error so
+    each report can still log and skip the entry as before.
+    """
+
+    __slots__ = (
+        "id", "booking_no", "customer_error", "customer_name", "customer_emails",
+        "sales_person", "sales_person_emails", "location", "equipment_error",
+        "equipment_type", "container_no", "vessel", "voyage", "pol", "pod", "fpod",
+        "volume", "bl_no", "line", "reference_no", "booking_date", "sob_date",
+        "etd_raw", "etd", "si_cutoff_raw", "si_filed", "bl_released",
+        "_si_cutoff", "_si_cutoff_day",
+    )
+
+    @classmethod
+    def from_entry(cls, entry, etd=None):
+        b = cls()
+        b.id = entry.get("id", "")
+        b.booking_no = entry.get("bookingNo", "")
+
+        customer = entry.get("customer", {})
+        if isinstance(customer, dict):
+            b.customer_error = None
+        else:
+            b.customer_error = f"'customer' field is not a dictionary, found {type(customer)}: {customer}"
+            customer = {}
+        b.customer_name = customer.get("name", "") or ""
+        b.customer_emails = _clean_emails(customer.get("customerEmail", []))
+        b.sales_person = customer.get("salesPerson", "")
+        b.sales_person_emails = _clean_emails(customer.get("salesPersonEmail", []))
+
+        # Location can be a string or {name: "..."}
+        raw_loc = entry.get("location", "")
+        b.location = str((raw_loc.get("name") if isinstance(raw_loc, dict) else raw_loc) or "")
+
+        equipment = entry.get("equipmentDetails")
+        b.equipment_error = None
+        b.equipment_type = ""
+        if equipment and isinstance(equipment, list):
+            items = [eq for eq in equipment if isinstance(eq, dict)]
+            b.equipment_type = items[0].get("equipmentType", "") if items else ""
+            b.container_no = ", ".join(eq["containerNo"] for eq in items if eq.get("containerNo"))
+        else:
+            if equipment:
+                b.equipment_error = f"'equipmentDetails' is not a list, found {type(equipment)}"
+            b.container_no = entry.get("containerNo", "") or ""
+
+        b.vessel = entry.get("vessel", "")
+        b.voyage = entry.get("voyage", "")
+        b.pol = entry.get("pol", "")
+        b.pod = entry.get("pod", "")
+        b.fpod = entry.get("fpod", "")
+        b.volume = entry.get("volume", "")
+        b.bl_no = entry.get("blNo", "")
+        b.line = entry.get("line", "")
+        b.reference_no = entry.get("referenceNo", "")
+        b.booking_date = entry.get("bookingDate", "")
+        b.sob_date = entry.get("sobDate", "")
+        b.etd_raw = entry.get("etd", "")
+        b.etd = etd if etd is not None else parse_dates([b.etd_raw])[0]
+        b.si_cutoff_raw = entry.get("siCutOff", "")
+        b.si_filed = bool(entry.get("siFiled", False))
+        b.bl_released = bool(entry.get("blReleased", False))
+        b._si_cutoff = None
+        b._si_cutoff_day = None
+        return b
+
+    @property
+    def si_cutoff(self):
+        """Parsed SI cutoff (IST), re-resolved when the day changes because "dd/mm" has no year."""
+        if not self.si_cutoff_raw:
+            return None
+        today = datetime.now(IST).date()
+        if self._si_cutoff_day != today:
+            self._si_cutoff = parse_si_cutoff_date(self.si_cutoff_raw, today)
+            self._si_cutoff_day = today
+        return self._si_cutoff
+
+def build_bookings(entries):
+    """Build Booking records for a list of entry dicts, parsing all ETDs in one batch."""
+    entries = list(entries)
+    etds = parse_dates(entry.get("etd", "") for entry in entries)
+    return [Booking.from_entry(entry, etd) for entry, etd in zip(entries, etds)]
+
+_bookings_cache = {"source": None, "bookings": None}
+_bookings_cache_lock = threading.Lock()
+
+def get_bookings():
+    """
+    Booking records for the whole collection: from the live index when it is
+    available, otherwise built once per shared entries snapshot.
+    """
+    if entries_index_available():
+        return entries_index.bookings()
+    entries = get_entries_snapshot()
+    with _bookings_cache_lock:
+        if _bookings_cache["source"] is not entries:
+            _bookings_cache["bookings"] = build_bookings(entries)
+            _bookings_cache["source"] = entries
+        return _bookings_cache["bookings"]
+
+def query_pending_si_entries(start, end, client=None, fields=None):
+    """
+    Return unfiled entries whose siCutOffAt falls within [start, end],
+    projected to `fields` when given.
+    Needs the composite index (siFiled ASC, siCutOffAt ASC) on "entries".
+    """
+    client = client or get_db()
+    query = (
+        client.collection("entries")
+        .where("siFiled", "==", False)
+        .where("siCutOffAt", ">=", start)
+        .where("siCutOffAt", "<=", end)
+    )
+    if fields:
+        query = query.select(list(fields))
+    entries = []
+    with metrics.scan("pending_si_query") as scan:
+        try:
+            for doc in query.stream():
+                entry = doc.to_dict()
+                entry["id"] = doc.id
+                entries.append(entry)
+        except Exception as e:
+            raise ScanError("pending_si_query", None, e) from e
+        scan.documents = len(entries)
+    print(f"[SI-INDEX] {len(entries)} unfiled entries with cutoff between {start} and {end}")
+    return entries
+
+def si_cutoff_updates(entry):
+    """
+    Fields to write so indexed queries match `entry`: siCutOffAt parsed from
+    siCutOff and a default siFiled. Returns (updates, siCutOff unparseable).
+    """
+    updates = {}
+    unparseable = False
+    si_cutoff = entry.get("siCutOff", "")
+    if si_cutoff:
+        si_cutoff_dt = parse_si_cutoff_date(si_cutoff)
+        if si_cutoff_dt is None:
+            unparseable = True
+        elif entry.get("siCutOffAt") != si_cutoff_dt:
+            updates["siCutOffAt"] = si_cutoff_dt
+    elif entry.get("siCutOffAt") is not None:
+        updates["siCutOffAt"] = None
+
+    if "siFiled" not in entry:
+        updates["siFiled"] = False
+    return updates, unparseable
+
+def sync_si_cutoff_timestamps(entries, client=None, batch_size=400):
+    """
+    Write siCutOffAt / siFiled for the given entry dicts (with "id") whose
+    stored values are stale. Used as an EntriesIndex change listener so
+    indexed queries see new and re-dated entries without waiting for a
+    backfill. Returns the number of entries updated.
+    """
+    client = client or get_db()
+    collection = client.collection("entries")
+    batch = client.batch()
+    pending = updated = 0
+    for entry in entries:
+        updates, _ = si_cutoff_updates(entry)
+        if not updates:
+            continue
+        batch.update(collection.document(entry["id"]), updates)
+        pending += 1
+        updated += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch = client.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    if updated:
+        print(f"[SI-SYNC] Updated siCutOffAt on {updated} changed entr{'y' if updated == 1 else 'ies'}")
+    return updated
+
+def backfill_si_cutoff_timestamps(client=None, dry_run=False, batch_size=400):
+    """
+    Store the parsed siCutOff string as a siCutOffAt timestamp on every entry
+    and default a missing siFiled to False so indexed queries can match it.
+    Safe to re-run: only entries whose values changed are written. Reads
+    are paginated and checkpointed, so a run that fails part-way resumes
+    after the last page it committed.
+    Returns a dict of counters.
+    """
+    client = client or get_db()
+    stats = {"scanned": 0, "updated": 0, "unparseable": 0, "unchanged": 0}
+    checkpoint = None if dry_run else FirestoreCheckpoint(client, "si_cutoff_backfill")
+    reader = PaginatedScan("si_cutoff_backfill", client.collection("entries"),
+                           fields=["siCutOff", "siCutOffAt", "siFiled"], checkpoint=checkpoint)
+    batch = client.batch()
+    pending = 0
+
+    for page in reader.pages():
+        for doc in page:
+            stats["scanned"] += 1
+            entry = doc.to_dict()
+            updates, unparseable = si_cutoff_updates(entry)
+            if unparseable:
+                stats["unparseable"] += 1
+
+            if not updates:
+                stats["unchanged"] += 1
+                continue
+
+            stats["updated"] += 1
+            if dry_run:
+                print(f"[SI-BACKFILL] Would update {doc.id}: {updates}")
+                continue
+
+            batch.update(doc.reference, updates)
+            pending += 1
+            if pending >= batch_size:
+                batch.commit()
+                batch = client.batch()
+                pending = 0
+
+        # Commit the page before its cursor is checkpointed
+        if pending:
+            batch.commit()
+            batch = client.batch()
+            pending = 0
+
+    print(f"[SI-BACKFILL] Done: {stats}")
+    return stats
+
+def start_entries_index(force=False):
+    """Start the live entries index when ENTRIES_LISTENER (or `force`) is set. Returns it, or None."""
+    global entries_index
+    if (ENTRIES_LISTENER or force) and entries_index is None:
+        entries_index = EntriesIndex(get_db())
+        entries_index.start()
+    return entries_index
+
+def get_entries_index():
+    """The live entries index, or None when the listener is not enabled."""
+    return entries_index
@@ -0,0 +1,25 @@
+"""
+Environment loading and settings shared by the web and scheduler processes.
+"""
+import os
+
+import pytz
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Check if we're on Render
+IS_RENDER = os.environ.get('RENDER', '').lower() == 'true'
+RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
+SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
+
+# "scan" reads the whole collection; "indexed" queries the normalized
+# siCutOffAt timestamp (see backfill_si_cutoff_timestamps / migrate_si_cutoff.py).
+SI_CUTOFF_QUERY_MODE = os.environ.get("SI_CUTOFF_QUERY_MODE", "scan").lower()
+SI_CUTOFF_BACKFILL_INTERVAL_HOURS = int(os.environ.get("SI_CUTOFF_BACKFILL_INTERVAL_HOURS", "6"))
+
+# Optional long-lived on_snapshot listener that keeps an in-process index of entries
+ENTRIES_LISTENER = os.environ.get("ENTRIES_LISTENER", "false").lower() == "true"
@@ -0,0 +1,934 @@
+"""
+Email transport: pooled SMTP, the SendGrid and Resend APIs over a shared
+HTTP session, per-provider circuit breakers and the durable outbox.
+"""
+import os
+import re
+import time
+import threading
+import json
+import sqlite3
+import smtplib
+import traceback
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IS_RENDER, RESEND_API_KEY, SENDGRID_API_KEY
+import metrics
+
+# Email configuration
+SMTP_SERVER = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_TIMEOUT = int(os.environ.get("SMTP_TIMEOUT", "10"))
+SMTP_POOL_MAX_IDLE = int(os.environ.get("SMTP_POOL_MAX_IDLE", "2"))  # per sender account
+SMTP_POOL_IDLE_TIMEOUT = int(os.environ.get("SMTP_POOL_IDLE_TIMEOUT", "300"))
+SMTP_POOL_REAP_SECONDS = int(os.environ.get("SMTP_POOL_REAP_SECONDS", "60"))
+
+# Email credentials
+SENDER_EMAIL_MUMBAI = "info@dessertmarine.com"
+SENDER_PASSWORD_MUMBAI = "myud rkxh uomg qjra"
+SENDER_EMAIL_GUJARAT = "mundra@dessertmarine.com"
+SENDER_PASSWORD_GUJARAT = "zvvw gynt tedl ihbq"
+
+BRANCH_EMAILS = {
+    "MUMBAI": (SENDER_EMAIL_MUMBAI, SENDER_PASSWORD_MUMBAI),
+    "GUJARAT": (SENDER_EMAIL_GUJARAT, SENDER_PASSWORD_GUJARAT),
+}
+
+# Shared keep-alive HTTP client for the API providers
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+SENDGRID_TIMEOUT = float(os.environ.get("SENDGRID_TIMEOUT", "15"))
+RESEND_TIMEOUT = float(os.environ.get("RESEND_TIMEOUT", "15"))
+SENDGRID_URL = 'https://api.sendgrid.com/v3/mail/send'
+RESEND_URL = 'https://api.resend.com/emails'
+
+def build_http_session(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES):
+    """
+    Build a pooled requests.Session for the email APIs.
+    Only retries failures where the message cannot have been accepted:
+    connection errors and 429 responses. Read errors are never retried.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=(429,),
+        allowed_methods=frozenset(["POST"]),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """The shared HTTP session, built (and requests imported) on first use."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = build_http_session()
+    return _http_session
+
+def normalized_app_password(pw: str) -> str:
+    """Gmail app passwords are shown with spaces; SMTP expects no spaces."""
+    return pw.replace(" ", "") if isinstance(pw, str) else pw
+
+class SMTPConnectionPool:
+    """
+    Thread-safe pool of authenticated SMTP sessions keyed by sender account
+    and password, so a session is only reused by callers holding the
+    credentials it logged in with. Sessions are reused across messages,
+    checked with NOOP after sitting idle, replaced when the server has
+    dropped them and closed once idle too long (see start_reaper).
+    """
+
+    NOOP_AFTER_SECONDS = 10
+
+    def __init__(self, host, port, timeout=10, max_idle_per_account=2, idle_timeout=300):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle_per_account = max_idle_per_account
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # (account, password) -> [(server, last_used), ...]
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def _connect(self, account, password):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(account, normalized_app_password(password))
+        except Exception:
+            self._close(server)
+            raise
+        print(f"[SMTP-POOL] Opened new session for {account}")
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self, account, password):
+        while True:
+            with self._lock:
+                idle = self._idle.get((account, password))
+                if not idle:
+                    break
+                server, last_used = idle.pop()
+            idle_for = time.time() - last_used
+            if idle_for > self.idle_timeout:
+                self._close(server)
+                continue
+            if idle_for < self.NOOP_AFTER_SECONDS or self._is_alive(server):
+                return server
+            self._close(server)
+        return self._connect(account, password)
+
+    def _release(self, account, password, server):
+        with self._lock:
+            idle = self._idle.setdefault((account, password), [])
+            if len(idle) < self.max_idle_per_account:
+                idle.append((server, time.time()))
+                return
+        self._close(server)
+
+    def sendmail(self, account, password, from_addr, recipients, message):
+        """Send a message over a pooled session, reconnecting once if the server dropped it."""
+        for attempt in range(2):
+            server = self._acquire(account, password)
+            try:
+                server.sendmail(from_addr, recipients, message)
+            except smtplib.SMTPServerDisconnected:
+                self._close(server)
+                if attempt:
+                    raise
+                print(f"[SMTP-POOL] Session for {account} was dropped, reconnecting")
+                continue
+            except Exception:
+                self._close(server)
+                raise
+            self._release(account, password, server)
+            return
+
+    def close_idle(self):
+        """Close sessions idle for longer than idle_timeout."""
+        now = time.time()
+        expired = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for server, last_used in idle:
+                    if now - last_used > self.idle_timeout:
+                        expired.append(server)
+                    else:
+                        keep.append((server, last_used))
+                self._idle[key] = keep
+        for server in expired:
+            self._close(server)
+        if expired:
+            print(f"[SMTP-POOL] Closed {len(expired)} idle session(s)")
+
+    def start_reaper(self, interval=SMTP_POOL_REAP_SECONDS):
+        """Run close_idle every `interval` seconds on a daemon thread. Safe to call more than once."""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, args=(interval,), name="smtp-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.close_idle()
+            except Exception as e:
+                print(f"[SMTP-POOL] Failed to close idle sessions: {e}")
+
+    def close_all(self):
+        with self._lock:
+            servers = [server for idle in self._idle.values() for server, _ in idle]
+            self._idle = {}
+        for server in servers:
+            self._close(server)
+
+smtp_pool = SMTPConnectionPool(
+    SMTP_SERVER, SMTP_PORT,
+    timeout=SMTP_TIMEOUT,
+    max_idle_per_account=SMTP_POOL_MAX_IDLE,
+    idle_timeout=SMTP_POOL_IDLE_TIMEOUT,
+)
+
+def get_sender_by_location(location):
+    """Get email credentials based on location."""
+    if location:
+        loc = str(location).strip().upper()
+        if "MUMBAI" in loc:
+            return BRANCH_EMAILS["MUMBAI"]
+        if "GUJARAT" in loc:
+            return BRANCH_EMAILS["GUJARAT"]
+    return BRANCH_EMAILS["MUMBAI"]
+
+def send_via_resend(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
+    """Send email using the Resend REST API over the shared HTTP session."""
+    if not RESEND_API_KEY:
+        return False, 'RESEND_API_KEY not set'
+    
+    headers = {
+        'Authorization': f'Bearer {RESEND_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    
+    try:
+        # Prepare recipients
+        to_list = []
+        for email in to_emails:
+            if isinstance(email, str) and email.strip():
+                to_list.append(email.strip())
+        
+        cc_list = []
+        for email in cc_emails:
+            if isinstance(email, str) and email.strip():
+                cc_list.append(email.strip())
+        
+        # Prepare from address with name
+        from_address = f"{sender_name} <{sender_email}>" if sender_name else sender_email
+        
+        # Build email params
+        params = {
+            "from": from_address,
+            "to": to_list,
+            "subject": subject,
+            "html": html_body,
+            "text": plain_body,
+        }
+        
+        # Add CC if exists
+        if cc_list:
+            params["cc"] = cc_list
+        
+        # Send email
+        resp = get_http_session().post(RESEND_URL, headers=headers, json=params, timeout=RESEND_TIMEOUT)
+        if resp.status_code not in (200, 201, 202):
+            print(f"[RESEND][ERROR] Status {resp.status_code}: {resp.text}")
+            return False, f'status={resp.status_code}, body={resp.text}'
+        email_id = resp.json().get('id', 'unknown')
+        print(f"[RESEND] Email sent successfully! ID: {email_id}")
+        return True, f"Email sent (ID: {email_id})"
+        
+    except Exception as e:
+        print(f"[RESEND][ERROR] {str(e)}")
+        traceback.print_exc()
+        return False, str(e)
+
+def send_via_sendgrid(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
+    """Send email using SendGrid Web API v3."""
+    if not SENDGRID_API_KEY:
+        return False, 'SENDGRID_API_KEY not set'
+    
+    headers = {
+        'Authorization': f'Bearer {SENDGRID_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    
+    def to_list(emails):
+        out = []
+        for e in emails:
+            if isinstance(e, str) and e:
+                out.append({"email": e})
+        return out
+    
+    # Build payload according to SendGrid API v3
+    payload = {
+        "personalizations": [
+            {
+                "to": to_list(to_emails),
+                "cc": to_list(cc_emails)
+            }
+        ],
+        "from": {
+            "email": sender_email,
+            "name": sender_name or ""
+        },
+        "subject": subject,
+        "content": [
+            {
+                "type": "text/plain",
+                "value": plain_body
+            },
+            {
+                "type": "text/html",
+                "value": html_body
+            }
+        ]
+    }
+    
+    try:
+        resp = get_http_session().post(SENDGRID_URL, headers=headers, json=payload, timeout=SENDGRID_TIMEOUT)
+        if resp.status_code in (200, 202):
+            print(f"[SENDGRID] Email sent successfully (status={resp.status_code})")
+            return True, f'status={resp.status_code}'
+        else:
+            print(f"[SENDGRID][ERROR] Status {resp.status_code}: {resp.text}")
+            return False, f'status={resp.status_code}, body={resp.text}'
+    except Exception as e:
+        print(f"[SENDGRID][ERROR] {str(e)}")
+        return False, str(e)
+
+# Argument order shared by send_email_smart and the batch/outbox helpers
+EMAIL_ARG_NAMES = ("sender_email", "sender_name", "to_emails", "cc_emails", "subject", "plain_body", "html_body")
+
+# SendGrid accepts up to 1000 personalizations and 1000 recipients in total
+# (to, cc and bcc across all personalizations) per request, and 10,000 bytes
+# of substitutions per personalization
+SENDGRID_BATCH_LIMIT = int(os.environ.get("SENDGRID_BATCH_LIMIT", "1000"))
+SENDGRID_RECIPIENT_LIMIT = int(os.environ.get("SENDGRID_RECIPIENT_LIMIT", "1000"))
+SENDGRID_SUBSTITUTION_LIMIT = 10000
+
+def send_batch_via_sendgrid(messages):
+    """
+    Send several distinct messages in one SendGrid v3 request, one
+    personalization per message. Subject, sender and bodies are passed as
+    per-personalization substitutions. Each message is a dict with the
+    send_via_sendgrid argument names. Returns a list of (ok, details)
+    aligned with `messages`; when SendGrid rejects specific
+    personalizations, only those messages fail and the rest are resent.
+    """
+    if not SENDGRID_API_KEY:
+        return [(False, 'SENDGRID_API_KEY not set')] * len(messages)
+    
+    headers = {
+        'Authorization': f'Bearer {SENDGRID_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    
+    def to_list(emails):
+        return [{"email": e} for e in emails if isinstance(e, str) and e]
+    
+    def recipient_count(m):
+        return len(to_list(m["to_emails"])) + len(to_list(m["cc_emails"]))
+    
+    results = [None] * len(messages)
+    batchable = []
+    for i, m in enumerate(messages):
+        if (len(m["plain_body"].encode()) + len(m["html_body"].encode()) > SENDGRID_SUBSTITUTION_LIMIT
+                or recipient_count(m) > SENDGRID_RECIPIENT_LIMIT):
+            # Too large to substitute or to share a request; send on its own
+            results[i] = send_via_sendgrid(m["sender_email"], m["sender_name"], m["to_emails"],
+                                           m["cc_emails"], m["subject"], m["plain_body"], m["html_body"])
+        else:
+            batchable.append(i)
+    
+    # Chunks stay within both the personalization and the total recipient limit
+    chunks = []
+    chunk, recipients = [], 0
+    for i in batchable:
+        count = recipient_count(messages[i])
+        if chunk and (len(chunk) >= SENDGRID_BATCH_LIMIT or recipients + count > SENDGRID_RECIPIENT_LIMIT):
+            chunks.append(chunk)
+            chunk, recipients = [], 0
+        chunk.append(i)
+        recipients += count
+    if chunk:
+        chunks.append(chunk)
+    
+    for pending in chunks:
+        while pending:
+            personalizations = []
+            for i in pending:
+                m = messages[i]
+                p = {
+                    "to": to_list(m["to_emails"]),
+                    "from": {"email": m["sender_email"], "name": m["sender_name"] or ""},
+                    "subject": m["subject"],
+                    "substitutions": {"-plain_body-": m["plain_body"], "-html_body-": m["html_body"]},
+                }
+                cc = to_list(m["cc_emails"])
+                if cc:
+                    p["cc"] = cc
+                personalizations.append(p)
+            
+            first = messages[pending[0]]
+            payload = {
+                "personalizations": personalizations,
+                "from": {"email": first["sender_email"], "name": first["sender_name"] or ""},
+                "content": [
+                    {"type": "text/plain", "value": "-plain_body-"},
+                    {"type": "text/html", "value": "-html_body-"},
+                ],
+            }
+            
+            try:
+                resp = get_http_session().post(SENDGRID_URL, headers=headers, json=payload, timeout=SENDGRID_TIMEOUT)
+            except Exception as e:
+                print(f"[SENDGRID][ERROR] Batch of {len(pending)}: {e}")
+                for i in pending:
+                    results[i] = (False, str(e))
+                break
+            
+            if resp.status_code in (200, 202):
+                print(f"[SENDGRID] Batch of {len(pending)} sent (status={resp.status_code})")
+                for i in pending:
+                    results[i] = (True, f'status={resp.status_code}, batch={len(pending)}')
+                break
+            
+            print(f"[SENDGRID][ERROR] Batch status {resp.status_code}: {resp.text}")
+            rejected = set()
+            try:
+                for err in resp.json().get("errors", []):
+                    match = re.match(r"personalizations\.(\d+)", err.get("field") or "")
+                    if match and int(match.group(1)) < len(pending):
+                        idx = pending[int(match.group(1))]
+                        rejected.add(idx)
+                        results[idx] = (False, f'status={resp.status_code}, error={err.get("message")}')
+            except ValueError:
+                pass
+            
+            if resp.status_code != 400 or not rejected:
+                for i in pending:
+                    if results[i] is None:
+                        results[i] = (False, f'status={resp.status_code}, body={resp.text}')
+                break
+            
+            # Resend the personalizations SendGrid did not complain about
+            pending = [i for i in pending if i not in rejected]
+    
+    return results
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker. Opens after `failure_threshold` consecutive
+    failures, rejects calls for `open_seconds`, then lets a single half-open
+    probe through: success closes it, failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=3, open_seconds=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.time() - self.opened_at < self.open_seconds:
+                    return False
+                self.state = "half_open"
+                print(f"[BREAKER] {self.name} half-open, sending probe")
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"[BREAKER] {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[BREAKER] {self.name} open for {self.open_seconds}s after {self.failures} failure(s)")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0, round(self.open_seconds - (time.time() - self.opened_at)))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_seconds": retry_in,
+                "last_error": self.last_error,
+            }
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_OPEN_SECONDS = int(os.environ.get("BREAKER_OPEN_SECONDS", "300"))
+
+provider_breakers = {
+    name: CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS)
+    for name in ("sendgrid", "smtp", "resend")
+}
+
+def _record_send(provider, started, ok):
+    outcome = "ok" if ok else "error"
+    metrics.send_seconds.observe(time.perf_counter() - started, provider=provider, outcome=outcome)
+    metrics.send_attempts.inc(provider=provider, outcome=outcome)
+
+def _try_api_provider(name, send_fn, *args):
+    """Run an API provider through its circuit breaker. Returns (ok, details) or None if skipped."""
+    breaker = provider_breakers[name]
+    if not breaker.allow():
+        print(f"[EMAIL] Skipping {name}: circuit open")
+        metrics.send_attempts.inc(provider=name, outcome="circuit_open")
+        return None
+    started = time.perf_counter()
+    ok, details = send_fn(*args)
+    _record_send(name, started, ok)
+    if ok:
+        breaker.record_success()
+    else:
+        breaker.record_failure(details)
+    return ok, details
+
+def send_email_smart(sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body):
+    """
+    Smart email sending that chooses the best provider.
+    Prioritize SendGrid when on Render. Providers whose circuit breaker
+    is open are skipped.
+    """
+    print(f"[EMAIL] Attempting to send email from: {sender_email}")
+    print(f"[EMAIL] To: {to_emails}, CC: {cc_emails}")
+    print(f"[EMAIL] Subject: {subject}")
+    send_args = (sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
+    depth = 0  # providers actually tried, for the fallback-depth metric
+    
+    # If we're on Render and have SendGrid key, use SendGrid first
+    if IS_RENDER and SENDGRID_API_KEY:
+        print("[EMAIL] On Render, trying SendGrid first...")
+        result = _try_api_provider("sendgrid", send_via_sendgrid, *send_args)
+        if result:
+            depth += 1
+            ok, details = result
+            if ok:
+                metrics.fallback_depth.observe(depth, outcome="sent")
+                return True, f"SendGrid: {details}"
+            print(f"[EMAIL] SendGrid failed: {details}")
+    
+    # Then try SMTP (even on Render - might work with Gmail)
+    smtp_breaker = provider_breakers["smtp"]
+    if not smtp_breaker.allow():
+        print("[EMAIL] Skipping SMTP: circuit open")
+    else:
+        depth += 1
+        started = time.perf_counter()
+        try:
+            print("[EMAIL] Trying SMTP...")
+            # Use Mumbai credentials for all emails
+            smtp_email = "info@dessertmarine.com"
+            smtp_password = "wrkq sobg qdyc ujff"
+            
+            msg = MIMEMultipart('alternative')
+            msg['From'] = f"{sender_name} <{smtp_email}>"
+            msg['To'] = ", ".join(to_emails)
+            if cc_emails:
+                msg['Cc'] = ", ".join(cc_emails)
+            msg['Subject'] = subject
+            
+            msg.attach(MIMEText(plain_body, 'plain'))
+            msg.attach(MIMEText(html_body, 'html'))
+            
+            recipients = to_emails + cc_emails
+            smtp_pool.sendmail(smtp_email, smtp_password, smtp_email, recipients, msg.as_string())
+            smtp_breaker.record_success()
+            _record_send("smtp", started, True)
+            metrics.fallback_depth.observe(depth, outcome="sent")
+            print("[EMAIL] Sent via SMTP (Gmail)")
+            return True, "SMTP (Gmail)"
+                
+        except Exception as e:
+            smtp_breaker.record_failure(e)
+            _record_send("smtp", started, False)
+            print(f"[EMAIL] SMTP failed: {str(e)}")
+    
+    # Then try Resend if available
+    if RESEND_API_KEY:
+        print("[EMAIL] Trying Resend...")
+        result = _try_api_provider("resend", send_via_resend, *send_args)
+        depth += 1 if result else 0
+        if result and result[0]:
+            metrics.fallback_depth.observe(depth, outcome="sent")
+            return True, f"Resend: {result[1]}"
+    
+    # Last fallback: Try SendGrid again (in case it wasn't tried above)
+    if SENDGRID_API_KEY:
+        print("[EMAIL] Trying SendGrid as fallback...")
+        result = _try_api_provider("sendgrid", send_via_sendgrid, *send_args)
+        depth += 1 if result else 0
+        if result and result[0]:
+            metrics.fallback_depth.observe(depth, outcome="sent")
+            return True, f"SendGrid (fallback): {result[1]}"
+    
+    metrics.fallback_depth.observe(depth, outcome="failed")
+    return False, "All email methods failed"
+
+# Durable local outbox: every composed message is recorded before sending
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "false").lower() == "true"
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", os.path.join(os.path.dirname(__file__), "outbox.sqlite3"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_DELAY_SECONDS = int(os.environ.get("OUTBOX_BASE_DELAY_SECONDS", "30"))
+OUTBOX_MAX_DELAY_SECONDS = int(os.environ.get("OUTBOX_MAX_DELAY_SECONDS", "3600"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_DRAIN_CONCURRENCY = int(os.environ.get("OUTBOX_DRAIN_CONCURRENCY", "4"))
+OUTBOX_POLL_SECONDS = int(os.environ.get("OUTBOX_POLL_SECONDS", "60"))
+
+class EmailOutbox:
+    """
+    SQLite (WAL) outbox for send_email_smart calls.
+    Messages are stored before the first attempt, retried with exponential
+    backoff until OUTBOX_MAX_ATTEMPTS, and deduplicated by idempotency key.
+    """
+
+    # A "sending" row older than this is assumed to belong to a dead process
+    SENDING_LEASE_SECONDS = 300
+
+    def __init__(self, path, max_attempts=8, base_delay=30, max_delay=3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def add(self, kind, send_args, idempotency_key=None):
+        """
+        Record a message: send_email_smart arguments, or a dict for a
+        prepared MIME message (see send_mime_durable). Returns (row_id,
+        status); for a known idempotency key the existing row is returned
+        unchanged.
+        """
+        now = time.time()
+        payload = send_args if isinstance(send_args, dict) else list(send_args)
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, kind, payload, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (idempotency_key, kind, json.dumps(payload), now, now, now),
+            )
+            if cur.rowcount:
+                return cur.lastrowid, "pending"
+            row = self._conn.execute(
+                "SELECT id, status FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+            return row["id"], row["status"]
+
+    def claim(self, row_id):
+        """Mark one pending row as sending. Returns False if another worker has it."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ? AND status = 'pending'",
+                (now, row_id),
+            )
+            return cur.rowcount == 1
+
+    def claim_due(self, limit):
+        """Claim up to `limit` rows that are due for a (re)try."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND updated_at < ?",
+                    (now - self.SENDING_LEASE_SECONDS,),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, kind, payload, attempts FROM outbox "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+                    [(now, row["id"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [dict(row, payload=json.loads(row["payload"])) for row in rows]
+
+    def mark_sent(self, row_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL, updated_at = ? WHERE id = ?",
+                (time.time(), row_id),
+            )
+
+    def mark_failed(self, row_id, error):
+        """Schedule the next retry with exponential backoff, or give up after max_attempts."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            status = "dead" if attempts >= self.max_attempts else "pending"
+            delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                (status, attempts, str(error), now + delay, now, row_id),
+            )
+        return status
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+outbox = EmailOutbox(
+    OUTBOX_PATH,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    base_delay=OUTBOX_BASE_DELAY_SECONDS,
+    max_delay=OUTBOX_MAX_DELAY_SECONDS,
+) if OUTBOX_ENABLED else None
+
+def send_mime_via_smtp(sender_email, recipients, message):
+    """Send a prepared MIME message (e.g. one with attachments) over the SMTP pool."""
+    password = dict(BRANCH_EMAILS.values()).get(sender_email, SENDER_PASSWORD_MUMBAI)
+    try:
+        smtp_pool.sendmail(sender_email, password, sender_email, recipients, message)
+        return True, "SMTP"
+    except Exception as e:
+        return False, str(e)
+
+def _deliver(payload):
+    """Send one outbox payload: a prepared MIME message or send_email_smart arguments."""
+    if isinstance(payload, dict):
+        return send_mime_via_smtp(payload["sender_email"], payload["recipients"], payload["message"])
+    return send_email_smart(*payload)
+
+def _send_outbox_row(row_id, send_args):
+    try:
+        ok, details = _deliver(send_args)
+    except Exception as e:
+        ok, details = False, str(e)
+    status = "sent"
+    if ok:
+        outbox.mark_sent(row_id)
+    else:
+        status = outbox.mark_failed(row_id, details)
+        print(f"[OUTBOX] Message {row_id} failed ({status}): {details}")
+    return ok, details, status
+
+def send_durable(idempotency_key, kind, payload):
+    """
+    Send `payload` (see _deliver) through the outbox. The message is
+    recorded first and a failed attempt stays queued for drain_outbox; a
+    message whose idempotency key was already sent is not sent again.
+    Returns (status, details, outbox_id) with status "sent", "sending"
+    (another worker has it), "queued" (failed, will be retried) or
+    "failed". Without OUTBOX_ENABLED it is a plain send: "sent" or "failed".
+    """
+    if outbox is None:
+        ok, details = _deliver(payload)
+        return ("sent" if ok else "failed"), details, None
+
+    row_id, status = outbox.add(kind, payload, idempotency_key)
+    if status == "sent":
+        print(f"[OUTBOX] Skipping {kind} email, already sent for key {idempotency_key}")
+        return "sent", f"Already sent (key: {idempotency_key})", row_id
+    if status == "dead":
+        return "failed", f"Gave up after {OUTBOX_MAX_ATTEMPTS} attempts (key: {idempotency_key})", row_id
+    if not outbox.claim(row_id):
+        return "sending", f"Queued in outbox (id: {row_id})", row_id
+
+    ok, details, status = _send_outbox_row(row_id, payload)
+    if ok:
+        return "sent", details, row_id
+    if status == "dead":
+        return "failed", details, row_id
+    return "queued", f"{details} (queued for retry, outbox id: {row_id})", row_id
+
+def send_email_durable(idempotency_key, kind, *send_args):
+    """
+    send_email_smart through the outbox (see send_durable). Returns (ok,
+    details); a message left queued for retry counts as not sent.
+    """
+    status, details, _ = send_durable(idempotency_key, kind, send_args)
+    return status in ("sent", "sending"), details
+
+def send_mime_durable(idempotency_key, kind, sender_email, recipients, message):
+    """A prepared MIME message (attachments included) over SMTP, through the outbox."""
+    payload = {"sender_email": sender_email, "recipients": list(recipients), "message": message}
+    return send_durable(idempotency_key, kind, payload)
+
+def send_emails_batch(messages):
+    """
+    Send many distinct messages with as few provider calls as possible.
+    Each message is a dict with the send_email_smart argument names plus
+    optional "kind" and "idempotency_key". Messages go through the outbox
+    when it is enabled, are packed into SendGrid batches when SendGrid is
+    configured and its circuit is closed, and fall back to send_email_smart
+    one by one otherwise. Returns a list of (ok, details) aligned with `messages`.
+    """
+    results = [None] * len(messages)
+    row_ids = {}
+    
+    if outbox is not None:
+        for i, m in enumerate(messages):
+            send_args = tuple(m[k] for k in EMAIL_ARG_NAMES)
+            row_id, status = outbox.add(m.get("kind", "batch"), send_args, m.get("idempotency_key"))
+            if status == "sent":
+                results[i] = (True, f"Already sent (key: {m.get('idempotency_key')})")
+            elif status == "dead":
+                results[i] = (False, f"Gave up after {OUTBOX_MAX_ATTEMPTS} attempts")
+            elif not outbox.claim(row_id):
+                results[i] = (True, f"Queued in outbox (id: {row_id})")
+            else:
+                row_ids[i] = row_id
+    
+    todo = [i for i in range(len(messages)) if results[i] is None]
+    
+    if todo and SENDGRID_API_KEY and provider_breakers["sendgrid"].allow():
+        started = time.perf_counter()
+        batch_results = send_batch_via_sendgrid([messages[i] for i in todo])
+        _record_send("sendgrid_batch", started, any(ok for ok, _ in batch_results))
+        if any(ok for ok, _ in batch_results):
+            provider_breakers["sendgrid"].record_success()
+        else:
+            provider_breakers["sendgrid"].record_failure(batch_results[0][1])
+        for i, (ok, details) in zip(todo, batch_results):
+            if ok:
+                results[i] = (True, f"SendGrid (batch): {details}")
+        todo = [i for i in todo if results[i] is None]
+    
+    for i in todo:
+        results[i] = send_email_smart(*(messages[i][k] for k in EMAIL_ARG_NAMES))
+    
+    if outbox is not None:
+        for i, row_id in row_ids.items():
+            ok, details = results[i]
+            if ok:
+                outbox.mark_sent(row_id)
+            else:
+                outbox.mark_failed(row_id, details)
+    
+    return results
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE, concurrency=OUTBOX_DRAIN_CONCURRENCY):
+    """Send every due outbox message, a batch at a time with concurrent sends."""
+    if outbox is None:
+        return 0
+    sent = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            rows = outbox.claim_due(batch_size)
+            if not rows:
+                break
+            print(f"[OUTBOX] Draining {len(rows)} message(s)")
+            results = pool.map(lambda row: _send_outbox_row(row["id"], row["payload"])[0], rows)
+            sent += sum(1 for ok in results if ok)
+    if sent:
+        print(f"[OUTBOX] Drained {sent} message(s), counts now {outbox.counts()}")
+    return sent
+
+def run_outbox_worker():
+    """Retry loop for the outbox, started as a daemon thread when OUTBOX_ENABLED."""
+    while True:
+        try:
+            drain_outbox()
+        except Exception as e:
+            print(f"[OUTBOX] Drain failed: {e}")
+            traceback.print_exc()
+        time.sleep(OUTBOX_POLL_SECONDS)
+
+def start_outbox_worker():
+    """Start the outbox retry thread when OUTBOX_ENABLED. Safe to call more than once."""
+    global _outbox_worker
+    if outbox is None or _outbox_worker is not None:
+        return
+    _outbox_worker = threading.Thread(target=run_outbox_worker, name="outbox-worker", daemon=True)
+    _outbox_worker.start()
+
+_outbox_worker = None
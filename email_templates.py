@@ -0,0 +1,366 @@
+"""
+Email templates, compiled once at import and rendered with string.Template.
+"""
+import os
+import json
+import hashlib
+import threading
+import html as html_lib
+from collections import OrderedDict
+from string import Template
+
+# Email templates: compiled once at import, rendered with string.Template.
+# Values are HTML-escaped in the html layout; table rows are rendered
+# separately and joined.
+EMAIL_RENDER_CACHE_SIZE = int(os.environ.get("EMAIL_RENDER_CACHE_SIZE", "256"))
+
+class EmailTemplate:
+    """Subject, plain and HTML layouts, with optional per-row layouts for tables."""
+
+    def __init__(self, name, subject, plain, html, plain_row="", html_row=""):
+        self.name = name
+        self.subject = Template(subject)
+        self.plain = Template(plain)
+        self.html = Template(html)
+        self.plain_row = Template(plain_row)
+        self.html_row = Template(html_row)
+
+    @staticmethod
+    def _escaped(context):
+        return {key: html_lib.escape(str(value)) for key, value in context.items()}
+
+    @staticmethod
+    def _plain(context):
+        return {key: str(value) for key, value in context.items()}
+
+    def render(self, context, rows=()):
+        """Return (subject, plain_body, html_body)."""
+        plain_ctx = self._plain(context)
+        html_ctx = self._escaped(context)
+        plain_rows = "".join(self.plain_row.substitute(self._plain(row)) for row in rows)
+        html_rows = "".join(self.html_row.substitute(self._escaped(row)) for row in rows)
+        return (
+            self.subject.substitute(plain_ctx),
+            self.plain.substitute(plain_ctx, rows=plain_rows),
+            self.html.substitute(html_ctx, rows=html_rows),
+        )
+
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+def render_email(template, context, rows=()):
+    """
+    Render a template, reusing the result for identical data. The cache is
+    keyed by template name and a hash of the context and rows.
+    """
+    key = (template.name, hashlib.sha1(
+        json.dumps([context, list(rows)], sort_keys=True, default=str).encode()
+    ).hexdigest())
+    with _render_cache_lock:
+        if key in _render_cache:
+            _render_cache.move_to_end(key)
+            return _render_cache[key]
+    rendered = template.render(context, rows)
+    with _render_cache_lock:
+        _render_cache[key] = rendered
+        if len(_render_cache) > EMAIL_RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return rendered
+
+SI_REMINDER_TEMPLATE = EmailTemplate(
+    "si-reminder",
+    "!! Reminder for Pending SI !! Booking No: ${booking_no} // Vessel: ${vessel} // Customer Name: ${customer_name}",
+    """
+Dear Sir / Madam,
+
+Please note the SI cut-off for below shipment is nearing & request you to please send us the SI on info@dessertmarine.com without delays.
+
+Any change in shipment planning please notify CS team for timely roll-over.
+
+DO NOT REPLY ON THIS MAIL.
+
+Booking No: ${booking_no}
+SI Cutoff: ${si_cutoff}
+Volume: ${volume}
+POL: ${pol}
+FPOD: ${fpod}
+Vessel: ${vessel}
+Voyage: ${voyage}
+
+Note: This is System Generated email. If the SI is already submitted, please ignore & coordinate with doc team for the first print & further process.
+
+Thank you for your support.
+
+Regards,
+Dessert Marine Services (I) Pvt Ltd
+info@dessertmarine.com
+doc@dessertmarine.com
+""",
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear Sir / Madam,</p>
+    <p>Please note the SI cut-off for below shipment is nearing & request you to please send us the SI on <a href="mailto:info@dessertmarine.com">info@dessertmarine.com</a> without delays.</p>
+    <p>Any change in shipment planning please notify CS team for timely roll-over.</p>
+    <p><strong>DO NOT REPLY ON THIS MAIL.</strong></p>
+    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
+        <tr style="background-color: #f2f2f2;">
+            <th>Booking No</th>
+            <th>SI Cutoff</th>
+            <th>Volume</th>
+            <th>POL</th>
+            <th>FPOD</th>
+            <th>Vessel</th>
+            <th>Voyage</th>
+        </tr>
+        <tr>
+            <td>${booking_no}</td>
+            <td>${si_cutoff}</td>
+            <td>${volume_or_na}</td>
+            <td>${pol_or_na}</td>
+            <td>${fpod}</td>
+            <td>${vessel}</td>
+            <td>${voyage}</td>
+        </tr>
+    </table>
+    <p><em>Note: This is System Generated email. If the SI is already submitted, please ignore & coordinate with doc team for the first print & further process.</em></p>
+    <p>Thank you for your support.</p>
+    <p>Regards,<br>
+    Dessert Marine Services (I) Pvt Ltd<br>
+    <a href="mailto:info@dessertmarine.com">info@dessertmarine.com</a><br>
+    <a href="mailto:doc@dessertmarine.com">doc@dessertmarine.com</a></p>
+</body>
+</html>
+""",
+)
+
+PENDING_SI_REPORT_TEMPLATE = EmailTemplate(
+    "pending-si-report",
+    "PENDING SI : | ${date}",
+    'Dear Team,\n\nPlease find below the list of bookings with SI cutoff dates within the next 24 hours.\n\n${rows}\nAn Excel file with the details is also attached.\n\nNote: This is an Auto Generated Mail.',
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear Team,</p>
+    <p>Please find below the list of bookings with SI cutoff dates within the next 24 hours.</p>
+    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
+        <tr style="background-color: #f2f2f2;">
+            <th>Booking No</th>
+            <th>Customer</th>
+            <th>FPOD</th>
+            <th>Equipment Type</th>
+            <th>Vessel</th>
+            <th>ETD</th>
+            <th>SI Cutoff</th>
+        </tr>
+${rows}
+    </table>
+    <p>An Excel file with the details is also attached.</p>
+    <p><em>Note: This is an Auto Generated Mail.</em></p>
+</body>
+</html>
+""",
+    plain_row="""
+Booking No: ${booking_no}
+Customer: ${customer}
+FPOD: ${fpod}
+Equipment Type: ${equipment_type}
+Vessel: ${vessel}
+ETD: ${etd}
+SI Cutoff: ${si_cutoff}
+""",
+    html_row="""
+        <tr>
+            <td>${booking_no}</td>
+            <td>${customer}</td>
+            <td>${fpod}</td>
+            <td>${equipment_type_or_na}</td>
+            <td>${vessel}</td>
+            <td>${etd}</td>
+            <td>${si_cutoff}</td>
+        </tr>
+""",
+)
+
+ROYAL_CASTOR_UPDATE_TEMPLATE = EmailTemplate(
+    "royal-castor-update",
+    "Daily Vessel Update : ${date} || Royal Castor",
+    'Dear Royal Castor Team,\n\nPlease find below the daily vessel update.\n\n${rows}\nNote: This is an Auto Generated Mail.',
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear Royal Castor Team,</p>
+    <p>Please find below the daily vessel update.</p>
+    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
+        <tr style="background-color: #f2f2f2;">
+            <th>Customer</th>
+            <th>Line</th>
+            <th>Reference No</th>
+            <th>Booking No</th>
+            <th>Container No</th>
+            <th>Vessel</th>
+            <th>ETD</th>
+        </tr>
+${rows}
+    </table>
+    <p><em>Note: This is an Auto Generated Mail.</em></p>
+</body>
+</html>
+""",
+    plain_row="""
+Customer: ${customer}
+Line: ${line}
+Reference No: ${reference_no}
+Booking No: ${booking_no}
+Container No: ${container_no}
+Vessel: ${vessel}
+ETD: ${etd}
+""",
+    html_row="""
+        <tr>
+            <td>${customer}</td>
+            <td>${line_or_na}</td>
+            <td>${reference_no}</td>
+            <td>${booking_no}</td>
+            <td>${container_no_or_na}</td>
+            <td>${vessel}</td>
+            <td>${etd}</td>
+        </tr>
+""",
+)
+
+SOB_TEMPLATE = EmailTemplate(
+    "sob",
+    "${customer_name} | SHIPPED ON BOARD | ${vessel} | ${booking_no} | ${bl_no}",
+    """
+Dear Sir/Madam,
+
+We are pleased to confirm your Subject Shipment is Shipped On Board.
+Details as Below:
+
+BOOKING NO: ${booking_no}
+POL: ${pol}
+POD: ${pod}
+FPOD: ${fpod}
+VOLUME: ${volume}
+CONTAINER NO: ${container_no}
+VESSEL: ${vessel}
+VOYAGE: ${voyage}
+SOB DATE: ${sob_date}
+
+For any queries please write to cs team.
+
+Note: This is an Auto Generated Mail.
+""",
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear Sir/Madam,</p>
+    <p>We are pleased to confirm your Subject Shipment is Shipped On Board.</p>
+    <p>Details as Below:</p>
+    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
+        <tr style="background-color: #f2f2f2;">
+            <th>BOOKING NO</th>
+            <th>POL</th>
+            <th>POD</th>
+            <th>FPOD</th>
+            <th>VOLUME</th>
+            <th>CONTAINER NO</th>
+            <th>VESSEL</th>
+            <th>VOYAGE</th>
+            <th>SOB DATE</th>
+        </tr>
+        <tr>
+            <td>${booking_no}</td>
+            <td>${pol}</td>
+            <td>${pod}</td>
+            <td>${fpod}</td>
+            <td>${volume}</td>
+            <td>${container_no_or_na}</td>
+            <td>${vessel}</td>
+            <td>${voyage}</td>
+            <td>${sob_date}</td>
+        </tr>
+    </table>
+    <p>For any queries please write to cs team.</p>
+    <p><em>Note: This is an Auto Generated Mail.</em></p>
+</body>
+</html>
+""",
+)
+
+SELLING_TEMPLATE = EmailTemplate(
+    "selling",
+    "Selling | ${bl_no}",
+    """
+Dear Team,
+
+Please find below the details for the selling rate:
+
+BL/NO: ${bl_no}
+BOOKING NO: ${booking_no}
+CUSTOMER: ${customer_name}
+POL: ${pol}
+FPOD: ${fpod}
+VOLUME: ${volume}
+BUY RATE: ${buy_rate}
+SELL RATE: ${sell_rate}
+
+Note: This is an Auto Generated Mail.
+""",
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear Team,</p>
+    <p>Please find below the details for the selling rate:</p>
+    <table border="1" cellpadding="5" cellspacing="0" style="border-collapse: collapse;">
+        <tr style="background-color: #f2f2f2;">
+            <th>BL/NO</th>
+            <th>BOOKING NO</th>
+            <th>CUSTOMER</th>
+            <th>POL</th>
+            <th>FPOD</th>
+            <th>VOLUME</th>
+            <th>BUY RATE</th>
+            <th>SELL RATE</th>
+        </tr>
+        <tr>
+            <td>${bl_no}</td>
+            <td>${booking_no}</td>
+            <td>${customer_name}</td>
+            <td>${pol}</td>
+            <td>${fpod}</td>
+            <td>${volume}</td>
+            <td>${buy_rate}</td>
+            <td>${sell_rate}</td>
+        </tr>
+    </table>
+    <p><em>Note: This is an Auto Generated Mail.</em></p>
+</body>
+</html>
+""",
+)
+
+DAILY_REPORT_TEMPLATE = EmailTemplate(
+    "daily-report",
+    "Daily Booking Report - ${date}",
+    """
+Dear ${sales_person_name},
+
+Please find attached the daily booking report as of ${date} (includes all locations).
+
+For any queries, please write to the CS team.
+
+Note: This is an Auto Generated Mail.
+""",
+    """
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Dear ${sales_person_name},</p>
+    <p>Please find attached the daily booking report as of ${date} (includes all locations).</p>
+    <p>For any queries, please write to the CS team.</p>
+    <p><em>Note: This is an Auto Generated Mail.</em></p>
+</body>
+</html>
+""",
+)
@@ -0,0 +1,30 @@
+"""
+Firestore client, initialized on first use so that importing a module
+does not pay for firebase_admin or the credentials check.
+"""
+import os
+import threading
+
+import config  # noqa: F401  (loads .env before GOOGLE_APPLICATION_CREDENTIALS is read)
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Return the shared Firestore client, initializing Firebase on the first call."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                from firebase_admin import credentials, firestore, initialize_app
+
+                credential_path = os.environ.get(
+                    "GOOGLE_APPLICATION_CREDENTIALS",
+                    os.path.join(os.path.dirname(__file__), "firebase-admin-sdk.json"),
+                )
+                if not os.path.exists(credential_path):
+                    raise FileNotFoundError(f"Firebase credentials file not found at: {credential_path}")
+
+                initialize_app(credentials.Certificate(credential_path))
+                _db = firestore.client()
+    return _db
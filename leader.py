@@ -0,0 +1,184 @@
+"""
+Leader election for the background schedule. Only the process holding the
+lease runs scheduled jobs; the others stand by and take over when the
+lease is released or expires.
+
+"file" uses an flock on a shared lock file (several workers on one host),
+"firestore" a lease document with an expiry (several hosts), and "none"
+makes every process the leader, as before.
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from firestore_client import get_db
+
+SCHEDULER_LEASE = os.environ.get("SCHEDULER_LEASE", "file").lower()
+SCHEDULER_LEASE_FILE = os.environ.get("SCHEDULER_LEASE_FILE", "/tmp/booking-email-scheduler.lock")
+SCHEDULER_LEASE_COLLECTION = os.environ.get("SCHEDULER_LEASE_COLLECTION", "scheduler_leases")
+SCHEDULER_LEASE_NAME = os.environ.get("SCHEDULER_LEASE_NAME", "scheduler")
+SCHEDULER_LEASE_TTL_SECONDS = int(os.environ.get("SCHEDULER_LEASE_TTL_SECONDS", "60"))
+SCHEDULER_LEASE_RENEW_SECONDS = int(os.environ.get("SCHEDULER_LEASE_RENEW_SECONDS", "20"))
+
+def lease_holder_id():
+    """Identifies this process in lease documents and logs."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class FileLease:
+    """
+    Exclusive non-blocking flock on a lock file. The kernel drops the lock
+    when the holder exits, so a standby takes over on its next attempt.
+    """
+
+    def __init__(self, path, holder):
+        self.path = path
+        self.holder = holder
+        self._fd = None
+
+    def acquire(self):
+        """Try to take (or keep) the lease. Returns True while held."""
+        import fcntl
+
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, self.holder.encode("utf-8"))
+        self._fd = fd
+        return True
+
+    def release(self):
+        import fcntl
+
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+class FirestoreLease:
+    """
+    Lease document {holder, expiresAt} taken and renewed in a transaction.
+    The holder renews well before expiresAt; anyone may take an expired lease.
+    """
+
+    def __init__(self, client, collection, name, holder, ttl_seconds=60):
+        self.client = client
+        self.ref = client.collection(collection).document(name)
+        self.holder = holder
+        self.ttl = timedelta(seconds=ttl_seconds)
+
+    def acquire(self):
+        """Take the lease if free, expired or already ours. Returns True while held."""
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def take(transaction):
+            snapshot = self.ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            lease = snapshot.to_dict() if snapshot.exists else None
+            if lease and lease.get("holder") != self.holder and lease.get("expiresAt") and lease["expiresAt"] > now:
+                return False
+            transaction.set(self.ref, {"holder": self.holder, "expiresAt": now + self.ttl, "renewedAt": now})
+            return True
+
+        return take(self.client.transaction())
+
+    def release(self):
+        """Give the lease up early so a standby does not wait for expiry."""
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def give_up(transaction):
+            snapshot = self.ref.get(transaction=transaction)
+            if snapshot.exists and (snapshot.to_dict() or {}).get("holder") == self.holder:
+                transaction.delete(self.ref)
+
+        give_up(self.client.transaction())
+
+class NoLease:
+    """Every process is the leader (single-process deployments)."""
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+class LeaderElector:
+    """
+    Background thread that keeps trying to acquire (or renew) the lease
+    every `renew_seconds`. is_leader() is what the schedule checks.
+    A failed renewal demotes this process immediately.
+    """
+
+    def __init__(self, lease, holder, renew_seconds=20):
+        self.lease = lease
+        self.holder = holder
+        self.renew_seconds = renew_seconds
+        self._leader = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._attempt()
+            self._thread = threading.Thread(target=self._run, name="leader-elector", daemon=True)
+            self._thread.start()
+
+    def is_leader(self):
+        return self._leader.is_set()
+
+    def wait_until_leader(self, timeout=None):
+        return self._leader.wait(timeout)
+
+    def _attempt(self):
+        try:
+            held = self.lease.acquire()
+        except Exception as e:
+            print(f"[LEADER] Lease attempt failed: {e}")
+            traceback.print_exc()
+            held = False
+        if held and not self._leader.is_set():
+            print(f"[LEADER] {self.holder} now owns the schedule")
+            self._leader.set()
+        elif not held and self._leader.is_set():
+            print(f"[LEADER] {self.holder} lost the lease, standing by")
+            self._leader.clear()
+
+    def _run(self):
+        while True:
+            time.sleep(self.renew_seconds)
+            self._attempt()
+
+    def stop(self):
+        """Release the lease (e.g. on shutdown)."""
+        self._leader.clear()
+        try:
+            self.lease.release()
+        except Exception as e:
+            print(f"[LEADER] Failed to release lease: {e}")
+
+def build_leader_elector(backend=None):
+    """LeaderElector for SCHEDULER_LEASE ("file", "firestore" or "none")."""
+    backend = (backend or SCHEDULER_LEASE).lower()
+    holder = lease_holder_id()
+    if backend == "firestore":
+        lease = FirestoreLease(get_db(), SCHEDULER_LEASE_COLLECTION, SCHEDULER_LEASE_NAME,
+                               holder, SCHEDULER_LEASE_TTL_SECONDS)
+    elif backend == "file":
+        lease = FileLease(SCHEDULER_LEASE_FILE, holder)
+    else:
+        lease = NoLease()
+    print(f"[LEADER] Using {backend} lease as {holder}")
+    return LeaderElector(lease, holder, SCHEDULER_LEASE_RENEW_SECONDS)
@@ -0,0 +1,220 @@
+"""
+In-process counters and histograms, rendered in the Prometheus text
+exposition format. The web process serves them on /api/metrics; the
+scheduler process can serve them on METRICS_PORT.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DOCUMENT_BUCKETS = (0, 10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+DEPTH_BUCKETS = (1, 2, 3, 4)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(label_names, values, extra=()):
+    pairs = list(zip(label_names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def render():
+    """Every registered metric in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+job_seconds = _register(Histogram(
+    "booking_job_duration_seconds", "Wall time of a scheduled job run.", ("job",)))
+job_runs = _register(Counter(
+    "booking_job_runs_total", "Scheduled job runs by outcome.", ("job", "outcome")))
+scan_seconds = _register(Histogram(
+    "booking_firestore_scan_duration_seconds", "Time spent reading a Firestore query or collection.", ("job", "scan")))
+scan_documents = _register(Histogram(
+    "booking_firestore_scan_documents", "Documents returned by one Firestore read.", ("job", "scan"),
+    buckets=DOCUMENT_BUCKETS))
+documents_read = _register(Counter(
+    "booking_firestore_documents_read_total", "Firestore documents read.", ("job", "scan")))
+scan_pages = _register(Counter(
+    "booking_firestore_scan_pages_total", "Pages read by paginated scans.", ("scan",)))
+scan_retries = _register(Counter(
+    "booking_firestore_scan_retries_total", "Paginated scan pages retried after an error.", ("scan",)))
+entries_skipped = _register(Counter(
+    "booking_entries_skipped_total", "Entries a job skipped, by reason.", ("job", "reason")))
+send_seconds = _register(Histogram(
+    "booking_email_send_duration_seconds", "Latency of one provider send attempt.", ("provider", "outcome")))
+send_attempts = _register(Counter(
+    "booking_email_send_attempts_total", "Provider send attempts by outcome (ok, error, circuit_open).",
+    ("provider", "outcome")))
+fallback_depth = _register(Histogram(
+    "booking_email_fallback_depth", "Providers tried by send_email_smart before it returned.", ("outcome",),
+    buckets=DEPTH_BUCKETS))
+excel_seconds = _register(Histogram(
+    "booking_excel_generation_seconds", "Time to render an Excel attachment.", ("report",)))
+location_cache = _register(Counter(
+    "booking_location_cache_lookups_total", "SOB location cache lookups (hit, negative_hit, miss).", ("result",)))
+request_seconds = _register(Histogram(
+    "booking_http_request_duration_seconds", "Flask request latency.", ("route", "method", "status")))
+
+# The job a thread is currently running, used to label scans and skips
+_current = threading.local()
+
+def current_job():
+    return getattr(_current, "job", None) or "other"
+
+def instrument_job(name):
+    """Decorator: time a job and label the scans and skips made while it runs."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            previous = getattr(_current, "job", None)
+            _current.job = name
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                job_seconds.observe(time.perf_counter() - start, job=name)
+                job_runs.inc(job=name, outcome=outcome)
+                _current.job = previous
+        return wrapper
+    return decorator
+
+def record_skip(reason):
+    """Count an entry skipped by the current job."""
+    entries_skipped.inc(job=current_job(), reason=reason)
+
+class ScanTimer:
+    """Counts documents while a scan runs; see scan()."""
+
+    def __init__(self):
+        self.documents = 0
+
+@contextmanager
+def scan(name):
+    """Time a Firestore read and record how many documents it returned (set .documents)."""
+    timer = ScanTimer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        job = current_job()
+        scan_seconds.observe(time.perf_counter() - start, job=job, scan=name)
+        scan_documents.observe(timer.documents, job=job, scan=name)
+        documents_read.inc(timer.documents, job=job, scan=name)
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve render() on http://0.0.0.0:<port>/metrics from a daemon thread (for the scheduler process)."""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[METRICS] Serving metrics on port {port}")
+    return server
@@ -0,0 +1,26 @@
+"""
+Backfill the normalized siCutOffAt timestamp on existing entries.
+
+Run against the Firestore emulator by exporting FIRESTORE_EMULATOR_HOST
+before starting, e.g.:
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python migrate_si_cutoff.py --dry-run
+"""
+import argparse
+
+from bookings import backfill_si_cutoff_timestamps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill siCutOffAt on entries")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the updates that would be made")
+    parser.add_argument("--batch-size", type=int, default=400, help="Writes per Firestore batch (max 500)")
+    args = parser.parse_args()
+
+    print("[MIGRATE] Backfilling siCutOffAt...")
+    stats = backfill_si_cutoff_timestamps(dry_run=args.dry_run, batch_size=args.batch_size)
+    print(f"[MIGRATE] Finished: {stats}")
+
+
+if __name__ == "__main__":
+    main()
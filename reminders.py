@@ -0,0 +1,577 @@
+"""
+SI cutoff reminders: the hourly sweep, the exact-time scheduler and the
+catch-up pass for reminders missed while the worker was down.
+"""
+import os
+import time
+import heapq
+import itertools
+import hashlib
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from config import IST, SI_CUTOFF_QUERY_MODE
+from firestore_client import get_db
+from bookings import (
+    entries_index_available, build_bookings, get_bookings, query_pending_si_entries,
+    declare_entry_fields, entry_fields,
+)
+from email_service import get_sender_by_location, send_emails_batch
+from scans import ScanError
+from email_templates import render_email, SI_REMINDER_TEMPLATE
+import metrics
+
+# "entries" fields read by fetch_si_cutoff_data ("customer" carries the name and emails)
+declare_entry_fields("si_reminder", (
+    "bookingNo", "customer", "siCutOff", "siFiled", "vessel", "voyage",
+    "fpod", "volume", "location", "pol",
+))
+
+def fetch_si_cutoff_data(bookings=None):
+    """
+    Fetch bookings with SI cutoff dates and group by customer/salesperson.
+    Returns a dictionary with customer emails as keys and lists of bookings as values.
+    A failed read of the entries raises, so callers never mistake it for
+    "nothing due" and move the reminder high-water mark past it.
+    """
+    if bookings is None:
+        bookings = get_bookings()
+    try:
+        si_cutoff_data = {}
+
+        for booking in bookings:
+            # Skip if SI is already filed
+            if booking.si_filed:
+                print(f"SI already filed for entry {booking.id}, skipping SI cutoff reminder.")
+                metrics.record_skip("si_filed")
+                continue
+
+            if not booking.si_cutoff_raw:
+                print(f"No SI cutoff found for entry {booking.id}")
+                metrics.record_skip("no_si_cutoff")
+                continue
+
+            si_cutoff_dt = booking.si_cutoff
+            if not si_cutoff_dt:
+                print(f"Invalid SI cutoff date for entry {booking.id}: {booking.si_cutoff_raw}")
+                metrics.record_skip("invalid_si_cutoff")
+                continue
+
+            if booking.customer_error:
+                print(f"Skipping entry {booking.id}: {booking.customer_error}")
+                metrics.record_skip("customer_error")
+                continue
+
+            customer_emails = list(booking.customer_emails)
+            if not customer_emails:
+                print(f"No customer email found for entry {booking.id}")
+                metrics.record_skip("no_customer_email")
+                continue
+            print(f"Fetched customer emails for booking {booking.booking_no or booking.id}: {customer_emails}")
+
+            sales_person_emails = list(booking.sales_person_emails)
+            if not sales_person_emails:
+                print(f"No salesperson email found for entry {booking.id}")
+                metrics.record_skip("no_salesperson_email")
+                continue
+
+            if not booking.booking_no:
+                print(f"No booking number found for entry {booking.id}")
+                metrics.record_skip("no_booking_no")
+                continue
+
+            reminder_data = {
+                "Customer Emails": customer_emails,
+                "Sales Person Emails": sales_person_emails,
+                "Customer Name": booking.customer_name,
+                "Booking No": booking.booking_no,
+                "SI Cutoff": si_cutoff_dt,
+                "Vessel": booking.vessel,
+                "Voyage": booking.voyage,
+                "FPOD": booking.fpod,
+                "Volume": booking.volume,
+                "Location": booking.location,
+                "POL": booking.pol
+            }
+
+            # Group by customer emails as a tuple to handle multiple emails
+            si_cutoff_data.setdefault(booking.customer_emails, []).append(reminder_data)
+
+        return si_cutoff_data
+
+    except Exception as e:
+        print(f"Error fetching SI cutoff data: {str(e)}")
+        raise
+
+def load_si_cutoff_data(start, end):
+    """
+    SI cutoff data for reminders whose cutoff may fall in [start, end]:
+    an indexed Firestore query when configured, else the shared bookings.
+    """
+    bookings = None
+    if SI_CUTOFF_QUERY_MODE == "indexed" and not entries_index_available():
+        bookings = build_bookings(query_pending_si_entries(start, end, fields=entry_fields("si_reminder")))
+    return fetch_si_cutoff_data(bookings)
+
+def si_reminder_key(booking, reminder_type):
+    """Identity of one reminder; also used as its outbox idempotency key."""
+    return (
+        f"si-reminder:{booking['Booking No']}:{reminder_type}:"
+        f"{booking['SI Cutoff'].strftime('%Y-%m-%d %H:%M')}"
+    )
+
+def build_si_reminder(booking, customer_emails, reminder_type):
+    """Compose the reminder message for one booking from fetch_si_cutoff_data."""
+    sender_email, _ = get_sender_by_location(booking.get("Location", "MUMBAI"))
+    sender_name = "Dessert Marine Services"
+    
+    subject, plain_body, html_body = render_email(SI_REMINDER_TEMPLATE, {
+        "booking_no": booking['Booking No'],
+        "vessel": booking['Vessel'],
+        "voyage": booking['Voyage'],
+        "customer_name": booking['Customer Name'],
+        "si_cutoff": booking['SI Cutoff'].strftime('%d/%m/%Y %H:%M') if booking['SI Cutoff'] else 'N/A',
+        "volume": booking['Volume'],
+        "volume_or_na": booking['Volume'] if booking['Volume'] else 'N/A',
+        "pol": booking['POL'],
+        "pol_or_na": booking['POL'] if booking['POL'] else 'N/A',
+        "fpod": booking['FPOD'],
+    })
+    return {
+        "kind": "si-reminder",
+        "idempotency_key": si_reminder_key(booking, reminder_type),
+        "sender_email": sender_email,
+        "sender_name": sender_name,
+        "to_emails": customer_emails,
+        "cc_emails": booking["Sales Person Emails"],
+        "subject": subject,
+        "plain_body": plain_body,
+        "html_body": html_body,
+        "booking_no": booking["Booking No"],
+        "reminder_type": reminder_type,
+    }
+
+def send_si_reminders(reminders):
+    """
+    Send composed reminders together so SendGrid can batch them, skipping
+    any the reminder ledger has already recorded. Returns one (ok, details)
+    per reminder, in order; a skipped reminder counts as ok.
+    """
+    all_reminders = reminders
+    already_sent = set()
+    ledger = get_reminder_ledger()
+    if ledger is not None:
+        try:
+            already_sent = ledger.sent_keys([r["idempotency_key"] for r in reminders])
+        except Exception as e:
+            # Fail open: a duplicate reminder beats a missing one
+            print(f"[REMINDER] Ledger lookup failed, sending without it: {e}")
+        for reminder in reminders:
+            if reminder["idempotency_key"] in already_sent:
+                print(f"SI Cutoff reminder ({reminder['reminder_type']}) for booking {reminder['booking_no']} already sent, skipping")
+        reminders = [r for r in reminders if r["idempotency_key"] not in already_sent]
+
+    results = send_emails_batch(reminders) if reminders else []
+    for reminder, (ok, details) in zip(reminders, results):
+        if ok:
+            print(f"SI Cutoff reminder ({reminder['reminder_type']}) sent to {reminder['to_emails']} (CC: {reminder['cc_emails']}) for booking {reminder['booking_no']} via {details}")
+        else:
+            print(f"Failed to send SI Cutoff reminder: {details}")
+
+    if ledger is not None:
+        try:
+            ledger.record([r for r, (ok, _) in zip(reminders, results) if ok])
+        except Exception as e:
+            print(f"[REMINDER] Failed to record sent reminders in the ledger: {e}")
+    sent = dict(zip((r["idempotency_key"] for r in reminders), results))
+    return [sent.get(r["idempotency_key"], (True, "already sent")) for r in all_reminders]
+
+@metrics.instrument_job("si_reminder")
+def send_si_cutoff_reminder():
+    """Send SI cutoff reminders 48 and 24 hours before the cutoff date."""
+    try:
+        now = datetime.now(IST)
+
+        si_cutoff_data = load_si_cutoff_data(now + timedelta(hours=23.5), now + timedelta(hours=48.5))
+        if not si_cutoff_data:
+            print("No SI cutoff data found.")
+
+        print(f"Checking SI cutoff reminders at {now}")
+
+        reminders = []
+        for customer_emails_key, bookings in si_cutoff_data.items():
+            customer_emails = list(customer_emails_key)  # Convert tuple back to list
+            for booking in bookings:
+                si_cutoff = booking["SI Cutoff"]
+                time_diff = si_cutoff - now
+                hours_diff = time_diff.total_seconds() / 3600
+
+                if hours_diff < 0:
+                    print(f"Skipping booking {booking['Booking No']} for {customer_emails}: SI Cutoff at {si_cutoff} has already passed (hours remaining: {hours_diff})")
+                    metrics.record_skip("cutoff_passed")
+                    continue
+
+                print(f"Booking {booking['Booking No']} for {customer_emails}: SI Cutoff at {si_cutoff}, hours remaining: {hours_diff}")
+
+                reminder_type = None
+                if 47.5 <= hours_diff <= 48.5:
+                    reminder_type = "48 hours"
+                elif 23.5 <= hours_diff <= 24.5:
+                    reminder_type = "24 hours"
+
+                if reminder_type:
+                    reminders.append(build_si_reminder(booking, customer_emails, reminder_type))
+
+        results = send_si_reminders(reminders) if reminders else []
+
+        # Only a complete sweep moves the mark; catch-up retries the rest
+        ledger = get_reminder_ledger()
+        if ledger is not None and all(ok for ok, _ in results):
+            ledger.advance(now)
+
+    except ScanError:
+        # The entries could not be read: fail the run instead of reporting nothing
+        raise
+    except Exception as e:
+        print(f"Error sending SI cutoff reminders: {str(e)}")
+        traceback.print_exc()
+
+# "hourly" scans on the hour with a +/-30 minute window; "exact" plans each
+# booking's 48h/24h fire time and sleeps until the next one is due
+SI_REMINDER_MODE = os.environ.get("SI_REMINDER_MODE", "hourly").lower()
+SI_REMINDER_OFFSETS = (("48 hours", 48), ("24 hours", 24))
+SI_REMINDER_GRACE_MINUTES = int(os.environ.get("SI_REMINDER_GRACE_MINUTES", "30"))
+SI_REMINDER_REPLAN_MINUTES = int(os.environ.get("SI_REMINDER_REPLAN_MINUTES", "60"))
+# Backoff for a reminder whose read or send failed: doubles from the base up to the max
+SI_REMINDER_RETRY_BASE_SECONDS = int(os.environ.get("SI_REMINDER_RETRY_BASE_SECONDS", "60"))
+SI_REMINDER_RETRY_MAX_SECONDS = int(os.environ.get("SI_REMINDER_RETRY_MAX_SECONDS", "1800"))
+
+class ReminderScheduler:
+    """
+    Due-time scheduler for SI reminders. Each booking's fire times
+    (cutoff - 48h, cutoff - 24h) are computed once into a heap; a worker
+    thread sleeps until the earliest one, re-checks that the booking is
+    still pending and sends everything due. The plan is rebuilt when the
+    live index reports changes, or every SI_REMINDER_REPLAN_MINUTES.
+    Plans and fires read the live index or the indexed range query; with
+    `source_ready` set, the thread waits until it returns True rather than
+    scanning the whole collection. A reminder whose read or send failed is
+    retried with backoff until its cutoff passes, and the catch-up mark is
+    never moved past the earliest one still unsent.
+    """
+
+    def __init__(self, grace_minutes=30, replan_minutes=60):
+        self.grace = timedelta(minutes=grace_minutes)
+        self.replan_seconds = replan_minutes * 60
+        self._heap = []
+        self._sent = {}  # reminder key -> cutoff, so replans don't fire twice
+        self._retry = {}  # reminder key -> (original fire time, next attempt, attempts)
+        self._cond = threading.Condition()
+        self._replan_requested = True
+        self._next_replan = 0.0
+        self._counter = itertools.count()
+        self._thread = None
+        self.gate = None  # optional callable; the scheduler only plans and fires while it returns True
+        self.source_ready = None  # optional callable; True once reads can be served without a full scan
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="si-reminder-scheduler", daemon=True)
+            self._thread.start()
+            print("[REMINDER] Exact-time reminder scheduler started")
+
+    def request_replan(self):
+        with self._cond:
+            self._replan_requested = True
+            self._cond.notify()
+
+    def pending(self):
+        """Planned (fire time, reminder key) pairs, earliest first."""
+        with self._cond:
+            return [(datetime.fromtimestamp(item[0], IST), item[2]) for item in sorted(self._heap)]
+
+    @metrics.instrument_job("si_reminder_plan")
+    def plan(self, now=None):
+        """Rebuild the heap of fire times from current SI cutoff data."""
+        now = now or datetime.now(IST)
+        horizon = max(hours for _, hours in SI_REMINDER_OFFSETS)
+        si_cutoff_data = load_si_cutoff_data(now - self.grace, now + timedelta(hours=horizon + 24) + self.grace)
+        heap = []
+        planned = set()
+        for customer_emails_key, bookings in si_cutoff_data.items():
+            for booking in bookings:
+                for reminder_type, hours in SI_REMINDER_OFFSETS:
+                    fire_at = booking["SI Cutoff"] - timedelta(hours=hours)
+                    key = si_reminder_key(booking, reminder_type)
+                    if key in self._sent:
+                        continue
+                    if key in self._retry:
+                        heap.append((self._retry[key][1], next(self._counter), key, reminder_type))
+                        planned.add(key)
+                        continue
+                    if fire_at < now - self.grace:
+                        continue
+                    heap.append((fire_at.timestamp(), next(self._counter), key, reminder_type))
+        heapq.heapify(heap)
+        with self._cond:
+            self._heap = heap
+            self._replan_requested = False
+            self._next_replan = time.time() + self.replan_seconds
+            # Forget sent reminders whose cutoff has passed, and retries whose
+            # booking is no longer pending (SI filed, cutoff passed or changed)
+            self._sent = {k: c for k, c in self._sent.items() if c > now}
+            self._retry = {k: r for k, r in self._retry.items() if k in planned}
+        self._advance_mark(now - self.grace)
+        if heap:
+            print(f"[REMINDER] Planned {len(heap)} reminder(s), next at {datetime.fromtimestamp(heap[0][0], IST)}")
+        else:
+            print("[REMINDER] No reminders planned")
+
+    def _take_due(self):
+        due = []
+        now = time.time()
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    @metrics.instrument_job("si_reminder_fire")
+    def fire(self, due):
+        """Send the due reminders whose bookings are still pending."""
+        now = datetime.now(IST)
+        wanted = {key: reminder_type for _, _, key, reminder_type in due}
+        try:
+            si_cutoff_data = load_si_cutoff_data(now - self.grace, now + timedelta(hours=48) + self.grace)
+        except Exception:
+            self._retry_later(due, "read failed")
+            raise
+        reminders = []
+        cutoffs = {}
+        for customer_emails_key, bookings in si_cutoff_data.items():
+            for booking in bookings:
+                for reminder_type, _ in SI_REMINDER_OFFSETS:
+                    key = si_reminder_key(booking, reminder_type)
+                    if wanted.get(key) == reminder_type and key not in self._sent:
+                        reminders.append(build_si_reminder(booking, list(customer_emails_key), reminder_type))
+                        cutoffs[key] = booking["SI Cutoff"]
+        skipped = len(wanted) - len(reminders)
+        if skipped:
+            print(f"[REMINDER] {skipped} due reminder(s) no longer pending (SI filed or cutoff changed)")
+        results = send_si_reminders(reminders) if reminders else []
+        failed = set()
+        with self._cond:
+            for reminder, (ok, _) in zip(reminders, results):
+                key = reminder["idempotency_key"]
+                if ok:
+                    self._sent[key] = cutoffs[key]
+                else:
+                    failed.add(key)
+            # Sent or no longer pending: nothing left to retry
+            for key in wanted:
+                if key not in failed:
+                    self._retry.pop(key, None)
+        if failed:
+            self._retry_later([item for item in due if item[2] in failed], "send failed")
+        self._advance_mark(now)
+
+    def _retry_later(self, due, reason):
+        """Put due items back on the heap, each after its own backoff."""
+        now = time.time()
+        with self._cond:
+            for fire_at, _, key, reminder_type in due:
+                first_fire, _, attempts = self._retry.get(key, (fire_at, None, 0))
+                delay = min(SI_REMINDER_RETRY_BASE_SECONDS * (2 ** attempts), SI_REMINDER_RETRY_MAX_SECONDS)
+                self._retry[key] = (first_fire, now + delay, attempts + 1)
+                heapq.heappush(self._heap, (now + delay, next(self._counter), key, reminder_type))
+        print(f"[REMINDER] {reason.capitalize()}, {len(due)} due reminder(s) requeued")
+
+    def _advance_mark(self, ts):
+        """Move the catch-up mark to `ts`, but not past the earliest reminder still unsent."""
+        ledger = get_reminder_ledger()
+        if ledger is None:
+            return
+        with self._cond:
+            unsent = [first_fire for first_fire, _, _ in self._retry.values()]
+        if unsent:
+            # Just before it, so catch-up's [mark, now] window still covers it
+            ts = min(ts, datetime.fromtimestamp(min(unsent), IST) - timedelta(seconds=1))
+        ledger.advance(ts)
+
+    def _run(self):
+        active = False
+        waiting = False
+        while True:
+            try:
+                if self.gate is not None and not self.gate():
+                    active = False
+                    time.sleep(15)
+                    continue
+                if self.source_ready is not None and not self.source_ready():
+                    if not waiting:
+                        print("[REMINDER] Waiting for the entries index before planning reminders")
+                    waiting = True
+                    time.sleep(5)
+                    continue
+                waiting = False
+                if not active:
+                    # Started or newly elected: replay what was missed, then plan afresh
+                    active = True
+                    try:
+                        catch_up_si_reminders()
+                    except Exception as e:
+                        print(f"[REMINDER] Catch-up failed: {e}")
+                        traceback.print_exc()
+                    self._replan_requested = True
+                with self._cond:
+                    needs_plan = self._replan_requested or time.time() >= self._next_replan
+                if needs_plan:
+                    self.plan()
+                due = self._take_due()
+                if due:
+                    self.fire(due)
+                    continue
+                with self._cond:
+                    wake_at = self._next_replan
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    if not self._replan_requested:
+                        self._cond.wait(timeout=max(0.0, wake_at - time.time()))
+            except Exception as e:
+                print(f"[REMINDER] Scheduler error: {e}")
+                traceback.print_exc()
+                time.sleep(60)
+
+reminder_scheduler = ReminderScheduler(SI_REMINDER_GRACE_MINUTES, SI_REMINDER_REPLAN_MINUTES)
+
+# Catch-up of reminders missed while the worker was down. State is kept in
+# Firestore because the worker's disk does not survive a Render restart.
+SI_REMINDER_CATCHUP = os.environ.get("SI_REMINDER_CATCHUP", "true").lower() == "true"
+SI_REMINDER_CATCHUP_MAX_HOURS = int(os.environ.get("SI_REMINDER_CATCHUP_MAX_HOURS", "48"))
+REMINDER_STATE_COLLECTION = os.environ.get("REMINDER_STATE_COLLECTION", "reminder_state")
+REMINDER_LEDGER_COLLECTION = os.environ.get("REMINDER_LEDGER_COLLECTION", "reminder_ledger")
+
+class ReminderLedger:
+    """
+    Persisted record of SI reminder sweeps. A single state document holds
+    the high-water mark (every reminder due at or before it has been
+    handled) and one ledger document per sent reminder, keyed by a hash of
+    its idempotency key, keeps catch-up and regular sweeps from sending the
+    same reminder twice. Ledger documents carry an expiresAt field for a
+    Firestore TTL policy.
+    """
+
+    def __init__(self, client, state_collection="reminder_state", ledger_collection="reminder_ledger"):
+        self.client = client
+        self.state_ref = client.collection(state_collection).document("si_reminders")
+        self.ledger = client.collection(ledger_collection)
+
+    def _ref(self, key):
+        return self.ledger.document(hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def high_water_mark(self):
+        """Time of the last completed sweep, or None if none was recorded."""
+        snapshot = self.state_ref.get()
+        if not snapshot.exists:
+            return None
+        last_sweep = (snapshot.to_dict() or {}).get("lastSweepAt")
+        return last_sweep.astimezone(IST) if last_sweep else None
+
+    def advance(self, ts):
+        """Record a completed sweep. The mark only moves forward."""
+        current = self.high_water_mark()
+        if current is None or ts > current:
+            self.state_ref.set({"lastSweepAt": ts}, merge=True)
+
+    def sent_keys(self, keys):
+        """The subset of `keys` already recorded, read in one round trip."""
+        if not keys:
+            return set()
+        refs = {self._ref(key).id: key for key in keys}
+        snapshots = self.client.get_all([self.ledger.document(doc_id) for doc_id in refs])
+        return {refs[snap.id] for snap in snapshots if snap.exists}
+
+    def record(self, reminders, batch_size=400):
+        """Record sent reminders (dicts from build_si_reminder)."""
+        now = datetime.now(IST)
+        batch = self.client.batch()
+        pending = 0
+        for reminder in reminders:
+            batch.set(self._ref(reminder["idempotency_key"]), {
+                "key": reminder["idempotency_key"],
+                "bookingNo": reminder["booking_no"],
+                "reminderType": reminder["reminder_type"],
+                "sentAt": now,
+                "expiresAt": now + timedelta(days=7),
+            })
+            pending += 1
+            if pending >= batch_size:
+                batch.commit()
+                batch = self.client.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+
+_reminder_ledger = None
+_reminder_ledger_lock = threading.Lock()
+
+def get_reminder_ledger():
+    """The shared ReminderLedger, or None when SI_REMINDER_CATCHUP is off."""
+    global _reminder_ledger
+    if SI_REMINDER_CATCHUP and _reminder_ledger is None:
+        with _reminder_ledger_lock:
+            if _reminder_ledger is None:
+                _reminder_ledger = ReminderLedger(get_db(), REMINDER_STATE_COLLECTION, REMINDER_LEDGER_COLLECTION)
+    return _reminder_ledger
+
+@metrics.instrument_job("si_reminder_catchup")
+def catch_up_si_reminders(now=None):
+    """
+    Send, in one batched pass, the reminders that came due between the last
+    recorded sweep and now while no sweep ran. Only the latest due reminder
+    per booking is sent (a missed 48h reminder is superseded by a due 24h
+    one), bookings whose cutoff has passed are skipped, and the gap looked
+    at is capped at SI_REMINDER_CATCHUP_MAX_HOURS. Returns the number sent.
+    The mark only advances once the read and every send succeeded; a failed
+    read raises.
+    """
+    ledger = get_reminder_ledger()
+    if ledger is None:
+        return 0
+    now = now or datetime.now(IST)
+    high_water_mark = ledger.high_water_mark()
+    if high_water_mark is None:
+        print("[REMINDER] No previous sweep recorded, nothing to catch up")
+        ledger.advance(now)
+        return 0
+
+    start = max(high_water_mark, now - timedelta(hours=SI_REMINDER_CATCHUP_MAX_HOURS))
+    if start >= now:
+        return 0
+    print(f"[REMINDER] Catching up reminders due between {start} and {now}")
+
+    # Reminders due in [start, now] belong to cutoffs up to now + the largest offset
+    horizon = max(hours for _, hours in SI_REMINDER_OFFSETS)
+    si_cutoff_data = load_si_cutoff_data(now, now + timedelta(hours=horizon))
+    reminders = []
+    for customer_emails_key, bookings in si_cutoff_data.items():
+        for booking in bookings:
+            if booking["SI Cutoff"] <= now:
+                continue
+            due = [
+                (booking["SI Cutoff"] - timedelta(hours=hours), reminder_type)
+                for reminder_type, hours in SI_REMINDER_OFFSETS
+                if start <= booking["SI Cutoff"] - timedelta(hours=hours) <= now
+            ]
+            if due:
+                _, reminder_type = max(due)
+                reminders.append(build_si_reminder(booking, list(customer_emails_key), reminder_type))
+
+    results = send_si_reminders(reminders) if reminders else []
+    sent = sum(1 for ok, _ in results if ok)
+    print(f"[REMINDER] Catch-up sent {sent} of {len(reminders)} missed reminder(s)")
+    # A failed send keeps the mark where it was so the next pass retries it;
+    # the ledger stops the ones that did go out from being sent again
+    if sent == len(results):
+        ledger.advance(now)
+    return sent
@@ -0,0 +1,592 @@
+"""
+Scheduled reports: pending SI, Royal Castor vessel update and the daily
+per-salesperson booking report with its Excel attachment.
+"""
+import os
+import io
+import time
+import traceback
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from config import IST, IS_RENDER, SI_CUTOFF_QUERY_MODE
+import metrics
+from bookings import (
+    entries_index_available, build_bookings, get_bookings, query_pending_si_entries,
+    parse_dates, date_sort_key, declare_entry_fields, entry_fields,
+)
+from scans import ScanError
+from email_service import (
+    SENDER_EMAIL_MUMBAI, get_sender_by_location, send_email_durable, send_emails_batch, send_mime_durable,
+)
+from email_templates import (
+    render_email, PENDING_SI_REPORT_TEMPLATE, ROYAL_CASTOR_UPDATE_TEMPLATE, DAILY_REPORT_TEMPLATE,
+)
+
+# Reports with more rows than this are written with openpyxl's write-only workbook
+EXCEL_STREAMING_THRESHOLD = int(os.environ.get("EXCEL_STREAMING_THRESHOLD", "5000"))
+
+# Parallel fan-out of the daily salesperson report
+DAILY_REPORT_WORKERS = int(os.environ.get("DAILY_REPORT_WORKERS", "4"))
+
+def format_and_sort_by_etd(rows):
+    """
+    Take (Booking, report row) pairs, sort earliest ETD first (missing or
+    unparseable ETDs last) and return the rows with "ETD" as dd-mm-YYYY.
+    """
+    rows = sorted(rows, key=lambda pair: date_sort_key(pair[0].etd))
+    result = []
+    for booking, row in rows:
+        if booking.etd_raw and booking.etd is None:
+            print(f"Error parsing ETD for entry {booking.id}: {booking.etd_raw!r}")
+        row["ETD"] = booking.etd.strftime('%d-%m-%Y') if booking.etd is not None else ""
+        result.append(row)
+    return result
+
+# "entries" fields each report reads ("customer" carries the name, salesperson and emails)
+declare_entry_fields("pending_si_report", (
+    "bookingNo", "customer", "siCutOff", "fpod", "equipmentDetails", "vessel", "etd",
+))
+declare_entry_fields("royal_castor_update", (
+    "bookingNo", "customer", "line", "referenceNo", "equipmentDetails", "containerNo", "vessel", "etd",
+))
+declare_entry_fields("daily_report", (
+    "bookingNo", "customer", "sobDate", "vessel", "voyage", "pol", "pod", "fpod",
+    "equipmentDetails", "containerNo", "volume", "blNo", "bookingDate", "etd",
+    "siFiled", "blReleased", "location",
+))
+
+def fetch_pending_si_data(bookings=None):
+    """
+    Fetch bookings where SI cutoff is within the next 24 hours from 6:00 PM IST.
+    Returns a list of dictionaries with the required fields, sorted by ETD.
+    """
+    try:
+        pending_si_data = []
+
+        now = datetime.now(IST)
+        reference_time = now.replace(hour=18, minute=0, second=0, microsecond=0)
+        if now.time() > reference_time.time():
+            reference_time = reference_time + timedelta(days=1)
+
+        if bookings is None:
+            if SI_CUTOFF_QUERY_MODE == "indexed" and not entries_index_available():
+                bookings = build_bookings(query_pending_si_entries(
+                    reference_time, reference_time + timedelta(hours=24), fields=entry_fields("pending_si_report")))
+            else:
+                bookings = get_bookings()
+
+        for booking in bookings:
+            if not booking.si_cutoff_raw:
+                print(f"No SI cutoff found for entry {booking.id}")
+                metrics.record_skip("no_si_cutoff")
+                continue
+
+            si_cutoff_dt = booking.si_cutoff
+            if not si_cutoff_dt:
+                print(f"Invalid SI cutoff date for entry {booking.id}: {booking.si_cutoff_raw}")
+                metrics.record_skip("invalid_si_cutoff")
+                continue
+
+            time_diff = si_cutoff_dt - reference_time
+            hours_diff = time_diff.total_seconds() / 3600
+
+            if 0 <= hours_diff <= 24:
+                if booking.customer_error:
+                    print(f"Skipping entry {booking.id}: {booking.customer_error}")
+                    metrics.record_skip("customer_error")
+                    continue
+
+                if not booking.booking_no:
+                    print(f"No booking number found for entry {booking.id}")
+                    metrics.record_skip("no_booking_no")
+                    continue
+
+                booking_data = {
+                    "Booking No": booking.booking_no,
+                    "Customer": booking.customer_name,
+                    "FPOD": booking.fpod,
+                    "Equipment Type": booking.equipment_type,
+                    "Vessel": booking.vessel,
+                    "ETD": "",
+                    "SI Cutoff": si_cutoff_dt.strftime('%d/%m/%Y %H:%M')
+                }
+                pending_si_data.append((booking, booking_data))
+
+        return format_and_sort_by_etd(pending_si_data)
+
+    except ScanError:
+        # The entries could not be read: fail the run instead of reporting nothing
+        raise
+    except Exception as e:
+        print(f"Error fetching pending SI data: {str(e)}")
+        return []
+
+def dataframe_to_xlsx_bytes(df):
+    """
+    Render a DataFrame to xlsx bytes in memory, without touching the disk.
+    Frames larger than EXCEL_STREAMING_THRESHOLD rows are written with
+    openpyxl's write-only workbook, which skips building a cell object per
+    value. The frame itself, and the bookings it came from, are still held
+    in memory, so memory use still grows with the row count.
+    """
+    import pandas as pd
+    from openpyxl import Workbook
+
+    buffer = io.BytesIO()
+    if len(df) <= EXCEL_STREAMING_THRESHOLD:
+        df.to_excel(buffer, index=False, engine="openpyxl")
+        return buffer.getvalue()
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append([str(col) for col in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        sheet.append([None if pd.isna(value) else value for value in row])
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def generate_pending_si_excel(data):
+    """
+    Generate the pending SI workbook in memory.
+    Returns (attachment filename, xlsx bytes), or (None, None) without data.
+    """
+    if not data:
+        print("No pending SI data to generate Excel report.")
+        return None, None
+
+    import pandas as pd
+
+    df = pd.DataFrame(data)
+    if 'SI Cutoff' in df.columns:
+        df = df.drop(columns=['SI Cutoff'])
+    excel_filename = f"pending_si_report_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
+    with metrics.excel_seconds.time(report="pending_si"):
+        return excel_filename, dataframe_to_xlsx_bytes(df)
+
+@metrics.instrument_job("pending_si_report")
+def send_pending_si_report():
+    """Send a daily report at 6:00 PM IST with pending SI bookings."""
+    try:
+        pending_si_data = fetch_pending_si_data()
+        if not pending_si_data:
+            print("No bookings with SI cutoff within the next 24 hours.")
+            return
+
+        excel_file, excel_content = generate_pending_si_excel(pending_si_data)
+        if not excel_file:
+            print("Failed to generate Excel file for pending SI report.")
+            return
+
+        # Email content
+        sender_email = SENDER_EMAIL_MUMBAI
+        sender_name = "Dessert Marine Services"
+        to_emails = ["info@dessertmarine.com", "doc@dessertmarine.com"]
+        cc_emails = ["chirag@dessertmarine.com"]
+        subject, plain_body, html_body = render_email(
+            PENDING_SI_REPORT_TEMPLATE,
+            {"date": datetime.now().strftime('%Y-%m-%d')},
+            [
+                {
+                    "booking_no": booking['Booking No'],
+                    "customer": booking['Customer'],
+                    "fpod": booking['FPOD'],
+                    "equipment_type": booking['Equipment Type'],
+                    "equipment_type_or_na": booking['Equipment Type'] if booking['Equipment Type'] else 'N/A',
+                    "vessel": booking['Vessel'],
+                    "etd": booking['ETD'],
+                    "si_cutoff": booking['SI Cutoff'],
+                }
+                for booking in pending_si_data
+            ],
+        )
+        
+        # For API-based email services, we need to handle attachments differently
+        # Since Resend/SendGrid API don't easily support attachments in this simple implementation,
+        # we'll send without attachment for now, or use SMTP if local
+        idempotency_key = f"pending-si-report:{datetime.now().strftime('%Y-%m-%d')}"
+        if not IS_RENDER:
+            # Local: Use SMTP with attachment
+            msg = MIMEMultipart('alternative')
+            msg['From'] = sender_email
+            msg['To'] = ", ".join(to_emails)
+            msg['Cc'] = ", ".join(cc_emails)
+            msg['Subject'] = subject
+            
+            msg.attach(MIMEText(plain_body, 'plain'))
+            msg.attach(MIMEText(html_body, 'html'))
+            
+            # Attach Excel file
+            attachment = MIMEApplication(excel_content, _subtype="xlsx")
+            attachment.add_header('Content-Disposition', 'attachment', filename=excel_file)
+            msg.attach(attachment)
+            
+            status, details, _ = send_mime_durable(idempotency_key, "pending-si-report", sender_email,
+                                                   to_emails + cc_emails, msg.as_string())
+            if status == "sent":
+                print(f"Pending SI report sent via SMTP")
+            elif status != "failed":
+                # The outbox retries it with the attachment
+                print(f"Pending SI report not sent yet: {details}")
+            else:
+                print(f"SMTP failed for pending SI report: {details}")
+                # Fallback to API without attachment
+                ok, details = send_email_durable(f"{idempotency_key}:no-attachment",
+                                                 "pending-si-report",
+                                                 sender_email, sender_name, to_emails, cc_emails, 
+                                                 subject + " (No attachment - SMTP failed)", plain_body, html_body)
+                if ok:
+                    print(f"Pending SI report sent via API (no attachment): {details}")
+        else:
+            # On Render: Use API without attachment for now
+            plain_body += "\n\n[Note: Excel attachment not available via API on Render]"
+            html_body += "<p><em>[Note: Excel attachment not available via API on Render]</em></p>"
+            
+            ok, details = send_email_durable(idempotency_key,
+                                             "pending-si-report",
+                                             sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
+            if ok:
+                print(f"Pending SI report sent via API: {details}")
+            else:
+                print(f"Failed to send pending SI report: {details}")
+
+    except ScanError:
+        raise
+    except Exception as e:
+        print(f"Error sending pending SI report: {str(e)}")
+        traceback.print_exc()
+
+def fetch_royal_castor_data(bookings=None):
+    """Fetch bookings for Royal Castor where referenceNo exists, sorted by ETD."""
+    try:
+        if bookings is None:
+            bookings = get_bookings()
+        royal_castor_data = []
+
+        for booking in bookings:
+            if booking.customer_error:
+                print(f"Skipping entry {booking.id}: {booking.customer_error}")
+                metrics.record_skip("customer_error")
+                continue
+
+            if "ROYAL CASTOR" in booking.customer_name.upper():
+                print(f"Found Royal Castor booking: {booking.id}, bookingNo: {booking.booking_no or 'N/A'}")
+            else:
+                continue
+
+            if not booking.reference_no:
+                print(f"No referenceNo found for entry {booking.id}")
+                metrics.record_skip("no_reference_no")
+                continue
+
+            if booking.equipment_error:
+                print(f"Entry {booking.id}: {booking.equipment_error}")
+
+            booking_data = {
+                "Customer": booking.customer_name,
+                "Line": booking.line,
+                "Reference No": booking.reference_no,
+                "Booking No": booking.booking_no,
+                "Container No": booking.container_no,
+                "Vessel": booking.vessel,
+                "ETD": "",
+                "Customer Email": booking.customer_emails[0] if booking.customer_emails else "UJWALA@ROYALCASTOR.IN"
+            }
+            royal_castor_data.append((booking, booking_data))
+
+        return format_and_sort_by_etd(royal_castor_data)
+
+    except ScanError:
+        raise
+    except Exception as e:
+        print(f"Error fetching Royal Castor data: {str(e)}")
+        return []
+
+@metrics.instrument_job("royal_castor_update")
+def send_royal_castor_vessel_update():
+    """Send daily vessel update to Royal Castor."""
+    try:
+        royal_castor_data = fetch_royal_castor_data()
+        if not royal_castor_data:
+            print("No bookings for Royal Castor with referenceNo.")
+            return
+
+        sender_email = SENDER_EMAIL_MUMBAI
+        sender_name = "Dessert Marine Services"
+        customer_email = royal_castor_data[0]["Customer Email"] if royal_castor_data else "UJWALA@ROYALCASTOR.IN"
+        to_emails = [customer_email]
+        cc_emails = ["info@dessertmarine.com"]
+        subject, plain_body, html_body = render_email(
+            ROYAL_CASTOR_UPDATE_TEMPLATE,
+            {"date": datetime.now().strftime('%Y-%m-%d')},
+            [
+                {
+                    "customer": booking['Customer'],
+                    "line": booking['Line'],
+                    "line_or_na": booking['Line'] if booking['Line'] else 'N/A',
+                    "reference_no": booking['Reference No'],
+                    "booking_no": booking['Booking No'],
+                    "container_no": booking['Container No'],
+                    "container_no_or_na": booking['Container No'] if booking['Container No'] else 'N/A',
+                    "vessel": booking['Vessel'],
+                    "etd": booking['ETD'],
+                }
+                for booking in royal_castor_data
+            ],
+        )
+        
+        ok, details = send_email_durable(f"royal-castor-update:{datetime.now().strftime('%Y-%m-%d')}",
+                                         "royal-castor-update",
+                                         sender_email, sender_name, to_emails, cc_emails, subject, plain_body, html_body)
+        if ok:
+            print(f"Royal Castor vessel update sent: {details}")
+        else:
+            print(f"Failed to send Royal Castor update: {details}")
+
+    except ScanError:
+        raise
+    except Exception as e:
+        print(f"Error sending Royal Castor vessel update: {str(e)}")
+        traceback.print_exc()
+
+def fetch_bookings_by_salesperson(bookings=None):
+    """
+    Fetch bookings grouped by salesperson and location. Each report row is
+    built once and shared by reference between the salespeople it belongs to.
+    """
+    try:
+        if bookings is None:
+            bookings = get_bookings()
+        bookings_by_salesperson = {}
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        for booking in bookings:
+            if booking.customer_error:
+                print(f"Skipping entry {booking.id}: {booking.customer_error}")
+                metrics.record_skip("customer_error")
+                continue
+
+            if not booking.sales_person_emails:
+                print(f"No salesperson email found for entry {booking.id}")
+                metrics.record_skip("no_salesperson_email")
+                continue
+
+            if booking.equipment_error:
+                print(f"Entry {booking.id}: {booking.equipment_error}")
+
+            booking_data = {
+                "Customer Name": booking.customer_name,
+                "Sales Person": booking.sales_person,
+                "Booking No": booking.booking_no,
+                "SOB Date": booking.sob_date,
+                "Vessel": booking.vessel,
+                "Voyage": booking.voyage,
+                "POL": booking.pol,
+                "POD": booking.pod,
+                "FPOD": booking.fpod,
+                "Container No": booking.container_no,
+                "Volume": booking.volume,
+                "BL No": booking.bl_no,
+                "Booking Date": booking.booking_date,
+                "ETD": booking.etd if booking.etd is not None else booking.etd_raw,
+                "Timestamp": timestamp,
+                "Pending SI": "Yes" if not booking.si_filed else "No",
+                "Pending BL": "Yes" if not booking.bl_released else "No",
+                "Location": booking.location
+            }
+
+            for email in booking.sales_person_emails:
+                by_location = bookings_by_salesperson.setdefault(email, {})
+                by_location.setdefault(booking.location, []).append(booking_data)
+
+        return bookings_by_salesperson
+
+    except ScanError:
+        raise
+    except Exception as e:
+        print(f"Error fetching bookings from Firestore: {str(e)}")
+        return {}
+
+def generate_excel_report(salesperson_email, bookings):
+    """
+    Generate the Excel report for a salesperson in memory.
+    Returns (attachment filename, xlsx bytes), or (None, None) without bookings.
+    """
+    if not bookings:
+        print(f"No bookings found for salesperson {salesperson_email}")
+        return None, None
+
+    import pandas as pd
+
+    df = pd.DataFrame(bookings)
+    # Add SI Cutoff column if not present
+    if 'SI Cutoff' not in df.columns:
+        si_cutoff_list = []
+        for b in bookings:
+            val = b.get('SI Cutoff') or b.get('siCutOff') or ''
+            if isinstance(val, (str, type(None))):
+                si_cutoff_list.append(val)
+            elif hasattr(val, 'strftime'):
+                si_cutoff_list.append(val.strftime('%d/%m/%Y %H:%M'))
+            else:
+                si_cutoff_list.append(str(val))
+        df['SI Cutoff'] = si_cutoff_list
+    # Parse every date column once, sort by ETD then SI Cutoff, then format
+    date_columns = [col for col in df.columns if 'date' in col.lower() or col.upper() == 'ETD' or col.upper() == 'SI CUTOFF']
+    for col in date_columns:
+        df[col] = pd.to_datetime(pd.Series(parse_dates(df[col].tolist()), index=df.index, dtype=object))
+    sort_cols = [col for col in ('ETD', 'SI Cutoff') if col in df.columns]
+    if sort_cols:
+        df = df.sort_values(by=sort_cols, ascending=True)
+    for col in date_columns:
+        df[col] = df[col].dt.strftime('%d-%m-%Y')
+    excel_filename = f"booking_report_{salesperson_email.split('@')[0]}_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
+    with metrics.excel_seconds.time(report="daily"):
+        return excel_filename, dataframe_to_xlsx_bytes(df)
+
+def send_daily_report_to(salesperson_email, loc_dict, api_messages):
+    """
+    Build and send one salesperson's daily report.
+    Returns (status, details) where status is "sent", "failed", "skipped",
+    "queued" (left in the outbox for retry) or "batched" (On Render the
+    message is appended to api_messages instead).
+    """
+    all_bookings = []
+    for location, bookings in loc_dict.items():
+        all_bookings.extend(bookings)
+    if not all_bookings:
+        return "skipped", "no bookings"
+    print(f"Generating report for {salesperson_email} with {len(all_bookings)} bookings (all locations)")
+    excel_file, excel_content = generate_excel_report(salesperson_email, all_bookings)
+    if not excel_file:
+        return "skipped", "no report generated"
+    
+    sender_email, _ = get_sender_by_location(all_bookings[0].get('Location', ''))
+    sender_name = "Dessert Marine Services"
+    
+    # Parse recipient emails
+    all_sales_emails = []
+    if isinstance(salesperson_email, str):
+        all_sales_emails = [e.strip() for e in salesperson_email.split(',') if e.strip()]
+    elif isinstance(salesperson_email, list):
+        for e in salesperson_email:
+            all_sales_emails.extend([x.strip() for x in str(e).split(',') if x.strip()])
+    else:
+        all_sales_emails = [str(salesperson_email)]
+    
+    sales_person_name = all_bookings[0].get('Sales Person', 'Salesperson') if all_bookings else 'Salesperson'
+    
+    subject, plain_body, html_body = render_email(DAILY_REPORT_TEMPLATE, {
+        "date": datetime.now().strftime('%Y-%m-%d'),
+        "sales_person_name": sales_person_name,
+    })
+    idempotency_key = f"daily-report:{salesperson_email}:{datetime.now().strftime('%Y-%m-%d')}"
+    
+    # For local development with SMTP
+    if not IS_RENDER:
+        msg = MIMEMultipart()
+        msg['From'] = sender_email
+        msg['To'] = ', '.join(all_sales_emails)
+        msg['Subject'] = subject
+        
+        msg.attach(MIMEText(plain_body, 'plain'))
+        
+        # Attach Excel file
+        attachment = MIMEApplication(excel_content, _subtype="xlsx")
+        attachment.add_header('Content-Disposition', 'attachment', filename=excel_file)
+        msg.attach(attachment)
+        
+        status, details, _ = send_mime_durable(idempotency_key, "daily-report", sender_email,
+                                               all_sales_emails, msg.as_string())
+        if status == "sent":
+            print(f"Daily report sent via SMTP to {salesperson_email}")
+            return "sent", "SMTP"
+        if status != "failed":
+            # The outbox retries it with the attachment
+            print(f"Daily report to {salesperson_email} not sent yet: {details}")
+            return "queued", details
+        print(f"SMTP failed for daily report: {details}")
+        # Fallback to API without attachment
+        plain_body += "\n\n[Note: Attachment not available due to SMTP failure]"
+        ok, details = send_email_durable(f"{idempotency_key}:no-attachment", "daily-report",
+                                         sender_email, sender_name, all_sales_emails, [], 
+                                         subject + " (No attachment)", plain_body, html_body)
+        if ok:
+            print(f"Daily report sent via API (no attachment) to {salesperson_email}: {details}")
+        return ("sent" if ok else "failed"), details
+    
+    # On Render: Use API without attachment
+    plain_body += "\n\n[Note: Excel attachment not available via API on Render]"
+    html_body += "<p><em>[Note: Excel attachment not available via API on Render]</em></p>"
+    
+    api_messages.append({
+        "kind": "daily-report",
+        "idempotency_key": idempotency_key,
+        "sender_email": sender_email,
+        "sender_name": sender_name,
+        "to_emails": all_sales_emails,
+        "cc_emails": [],
+        "subject": subject,
+        "plain_body": plain_body,
+        "html_body": html_body,
+        "salesperson_email": salesperson_email,
+    })
+    return "batched", "queued for batch send"
+
+@metrics.instrument_job("daily_report")
+def send_daily_report():
+    """
+    Send daily booking reports to salespeople.
+    Reports are built and sent on up to DAILY_REPORT_WORKERS threads; a
+    failure for one salesperson does not affect the others. Returns a
+    summary dict of salesperson emails by outcome.
+    """
+    summary = {"sent": [], "failed": [], "skipped": [], "queued": []}
+    try:
+        bookings_by_salesperson = fetch_bookings_by_salesperson()
+        if not bookings_by_salesperson:
+            print("No bookings found for any salesperson.")
+            return summary
+        
+        started = time.time()
+        api_messages = []
+        with ThreadPoolExecutor(max_workers=max(1, DAILY_REPORT_WORKERS)) as pool:
+            futures = {
+                pool.submit(send_daily_report_to, salesperson_email, loc_dict, api_messages): salesperson_email
+                for salesperson_email, loc_dict in bookings_by_salesperson.items()
+            }
+            for future in as_completed(futures):
+                salesperson_email = futures[future]
+                try:
+                    status, details = future.result()
+                except Exception as e:
+                    print(f"Error sending daily report to {salesperson_email}: {e}")
+                    traceback.print_exc()
+                    status, details = "failed", str(e)
+                if status != "batched":
+                    summary[status].append({"email": salesperson_email, "details": details})
+        
+        # On Render the reports go out together so SendGrid can batch them
+        if api_messages:
+            for message, (ok, details) in zip(api_messages, send_emails_batch(api_messages)):
+                if ok:
+                    print(f"Daily report sent via API to {message['salesperson_email']}: {details}")
+                else:
+                    print(f"Failed to send daily report to {message['salesperson_email']}: {details}")
+                summary["sent" if ok else "failed"].append({"email": message["salesperson_email"], "details": details})
+        
+        print(f"[DAILY] Done in {time.time() - started:.1f}s: {len(summary['sent'])} sent, "
+              f"{len(summary['failed'])} failed, {len(summary['skipped'])} skipped, "
+              f"{len(summary['queued'])} queued for retry")
+        for failure in summary["failed"]:
+            print(f"[DAILY] Failed: {failure['email']}: {failure['details']}")
+                
+    except ScanError:
+        raise
+    except Exception as e:
+        print(f"Error sending daily reports: {str(e)}")
+        traceback.print_exc()
+    return summary
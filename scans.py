@@ -0,0 +1,322 @@
+"""
+Cursor-paginated reads of Firestore collections. Pages are ordered by
+document id, a failed page is retried with backoff, and the cursor is
+checkpointed so an interrupted scan resumes where it stopped instead of
+starting again from the first document. Large collections can be split
+into document-id ranges that are read in parallel.
+"""
+import os
+import time
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import metrics
+
+SCAN_PAGE_SIZE = int(os.environ.get("SCAN_PAGE_SIZE", "1000"))
+SCAN_MAX_RETRIES = int(os.environ.get("SCAN_MAX_RETRIES", "5"))
+SCAN_BASE_DELAY_SECONDS = float(os.environ.get("SCAN_BASE_DELAY_SECONDS", "1"))
+SCAN_MAX_DELAY_SECONDS = float(os.environ.get("SCAN_MAX_DELAY_SECONDS", "30"))
+# Pages read ahead on a background thread while the caller handles the current one (0 = none)
+SCAN_PREFETCH_PAGES = int(os.environ.get("SCAN_PREFETCH_PAGES", "1"))
+# Log progress every this many pages
+SCAN_PROGRESS_PAGES = int(os.environ.get("SCAN_PROGRESS_PAGES", "10"))
+SCAN_CHECKPOINT_COLLECTION = os.environ.get("SCAN_CHECKPOINT_COLLECTION", "scan_checkpoints")
+
+# Full-collection reads are split into this many document-id ranges and read
+# by up to SCAN_PARTITION_WORKERS threads (1 = one serial scan)
+SCAN_PARTITIONS = int(os.environ.get("SCAN_PARTITIONS", "4"))
+SCAN_PARTITION_WORKERS = int(os.environ.get("SCAN_PARTITION_WORKERS", str(SCAN_PARTITIONS)))
+# "query" asks Firestore for split points (partition queries), "range" splits
+# the auto-id key space evenly, "auto" tries "query" and falls back to "range"
+SCAN_PARTITION_MODE = os.environ.get("SCAN_PARTITION_MODE", "auto").lower()
+
+# Characters of Firestore auto-generated ids, in byte (sort) order
+AUTO_ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+class ScanError(Exception):
+    """A page still failed after SCAN_MAX_RETRIES; `cursor` is the last document id read."""
+
+    def __init__(self, name, cursor, error):
+        super().__init__(f"{name} scan failed after {cursor or 'the start'}: {error}")
+        self.cursor = cursor
+
+class MemoryCheckpoint:
+    """Cursor kept in process, so a later scan of the same name resumes it."""
+
+    def __init__(self):
+        self.cursor = None
+        self.documents = 0
+
+    def load(self):
+        return self.cursor
+
+    def save(self, cursor, documents):
+        self.cursor = cursor
+        self.documents = documents
+
+    def clear(self):
+        self.cursor = None
+        self.documents = 0
+
+class FirestoreCheckpoint:
+    """Cursor stored in SCAN_CHECKPOINT_COLLECTION/<name>, so a scan survives a restart."""
+
+    def __init__(self, client, name, collection=SCAN_CHECKPOINT_COLLECTION):
+        self.ref = client.collection(collection).document(name)
+
+    def load(self):
+        snapshot = self.ref.get()
+        if not snapshot.exists:
+            return None
+        return (snapshot.to_dict() or {}).get("cursor")
+
+    def save(self, cursor, documents):
+        self.ref.set({"cursor": cursor, "documents": documents, "updatedAt": datetime.now(timezone.utc)})
+
+    def clear(self):
+        self.ref.delete()
+
+class PaginatedScan:
+    """
+    Reads `query` (a collection or a filtered query on it) a page at a time,
+    ordered by document id. Iterate pages() for lists of document snapshots,
+    or documents() for single snapshots. The checkpoint is saved after the
+    caller has finished with each page and cleared once the scan completes.
+    """
+
+    def __init__(self, name, query, page_size=None, fields=None, checkpoint=None,
+                 max_retries=None, prefetch=None):
+        self.name = name
+        self.query = query
+        self.page_size = page_size or SCAN_PAGE_SIZE
+        self.fields = list(fields) if fields else None
+        self.checkpoint = checkpoint
+        self.max_retries = SCAN_MAX_RETRIES if max_retries is None else max_retries
+        self.prefetch = SCAN_PREFETCH_PAGES if prefetch is None else prefetch
+        self.cursor = None
+        self.pages_read = 0
+        self.documents_read = 0
+        self.retries = 0
+
+    def _page_query(self, cursor):
+        query = self.query.order_by("__name__")
+        if self.fields:
+            query = query.select(self.fields)
+        if cursor:
+            query = query.start_after({"__name__": cursor})
+        return query.limit(self.page_size)
+
+    def _read_page(self, cursor):
+        """One page after `cursor`, retried with exponential backoff (and jitter)."""
+        attempt = 0
+        while True:
+            try:
+                return list(self._page_query(cursor).stream())
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise ScanError(self.name, cursor, e) from e
+                self.retries += 1
+                metrics.scan_retries.inc(scan=self.name)
+                delay = min(SCAN_BASE_DELAY_SECONDS * (2 ** (attempt - 1)), SCAN_MAX_DELAY_SECONDS)
+                delay = random.uniform(delay / 2, delay)
+                print(f"[SCAN] {self.name}: page after {cursor or 'start'} failed ({e}), "
+                      f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _fetch_pages(self, cursor):
+        """Pages from `cursor` to the end of the collection, read in order."""
+        while True:
+            page = self._read_page(cursor)
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            cursor = page[-1].id
+
+    def _prefetched_pages(self, cursor):
+        """_fetch_pages on a reader thread, at most `prefetch` pages ahead of the caller."""
+        pages = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def offer(item):
+            """Queue `item` unless the caller has stopped reading. Returns False once it has."""
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def reader():
+            try:
+                for page in self._fetch_pages(cursor):
+                    if not offer(page):
+                        return
+                offer(done)
+            except Exception as e:
+                offer(e)
+
+        threading.Thread(target=reader, name=f"scan-{self.name}", daemon=True).start()
+        try:
+            while True:
+                item = pages.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def pages(self):
+        started = time.perf_counter()
+        cursor = self.checkpoint.load() if self.checkpoint else None
+        if cursor:
+            print(f"[SCAN] {self.name}: resuming after {cursor}")
+        self.cursor = cursor
+        source = self._prefetched_pages(cursor) if self.prefetch > 0 else self._fetch_pages(cursor)
+        for page in source:
+            self.pages_read += 1
+            self.documents_read += len(page)
+            metrics.scan_pages.inc(scan=self.name)
+            yield page
+            self.cursor = page[-1].id
+            if self.checkpoint:
+                self.checkpoint.save(self.cursor, self.documents_read)
+            if SCAN_PROGRESS_PAGES and self.pages_read % SCAN_PROGRESS_PAGES == 0:
+                elapsed = time.perf_counter() - started
+                print(f"[SCAN] {self.name}: {self.pages_read} pages, {self.documents_read} documents "
+                      f"in {elapsed:.1f}s (cursor {self.cursor})")
+        if self.checkpoint:
+            self.checkpoint.clear()
+        print(f"[SCAN] {self.name}: done, {self.documents_read} documents in {self.pages_read} pages "
+              f"({time.perf_counter() - started:.1f}s, {self.retries} retries)")
+
+    def documents(self):
+        for page in self.pages():
+            yield from page
+
+def _query_split_points(client, collection_name, partitions):
+    """
+    Split points from a Firestore partition query. These run over the
+    collection group, so any point outside the top-level collection means
+    the answer is unusable here and None is returned.
+    """
+    points = []
+    # partition_count is the number of split points, so this yields `partitions` ranges
+    for partition in client.collection_group(collection_name).get_partitions(partitions - 1):
+        ref = partition.end_at
+        if ref is None:
+            continue
+        if ref.path != f"{collection_name}/{ref.id}":
+            return None
+        points.append(ref.id)
+    return points
+
+def _range_split_points(partitions):
+    """Even split of the auto-id key space (ids that are not auto-generated may land unevenly)."""
+    step = len(AUTO_ID_ALPHABET) / partitions
+    return [AUTO_ID_ALPHABET[round(i * step)] for i in range(1, partitions)]
+
+def partition_bounds(client, collection_name, partitions=None, mode=None):
+    """
+    Document-id ranges [(start, end), ...] that together cover the whole
+    collection: start is inclusive, end exclusive, None is open.
+    """
+    partitions = partitions or SCAN_PARTITIONS
+    mode = (mode or SCAN_PARTITION_MODE).lower()
+    if partitions <= 1:
+        return [(None, None)]
+
+    points = None
+    if mode in ("query", "auto"):
+        try:
+            points = _query_split_points(client, collection_name, partitions)
+        except Exception as e:
+            if mode == "query":
+                raise
+            print(f"[SCAN] Partition query on {collection_name} failed ({e}), splitting by id range")
+    if points is None:
+        points = _range_split_points(partitions)
+
+    points = sorted(set(points))
+    return list(zip([None] + points, points + [None]))
+
+class PartitionedScan:
+    """
+    Reads a whole collection as document-id ranges in parallel, each range
+    a PaginatedScan (paged, retried, checkpointed) on a bounded thread pool.
+    read() returns the converted documents in document-id order. If a range
+    fails, read() raises; calling it again re-reads only what is missing:
+    finished ranges are kept and the others resume from their cursor.
+    """
+
+    def __init__(self, name, client, collection_name, partitions=None, workers=None, fields=None,
+                 page_size=None, mode=None):
+        self.name = name
+        self.client = client
+        self.collection = client.collection(collection_name)
+        self.collection_name = collection_name
+        self.partitions = partitions or SCAN_PARTITIONS
+        self.workers = workers or SCAN_PARTITION_WORKERS
+        self.fields = fields
+        self.page_size = page_size
+        self.mode = mode
+        self.documents_read = 0
+        self._ranges = None
+        self._lock = threading.Lock()
+
+    def _range_query(self, start, end):
+        query = self.collection
+        if start:
+            query = query.where("__name__", ">=", self.collection.document(start))
+        if end:
+            query = query.where("__name__", "<", self.collection.document(end))
+        return query
+
+    def _read_range(self, index, part, convert):
+        single = len(self._ranges) == 1
+        reader = PaginatedScan(self.name if single else f"{self.name}[{index}]",
+                               self._range_query(*part["bounds"]), page_size=self.page_size,
+                               fields=self.fields, checkpoint=part["checkpoint"],
+                               prefetch=None if single else 0)
+        try:
+            for page in reader.pages():
+                part["results"].extend([convert(doc) for doc in page])
+        finally:
+            with self._lock:
+                self.documents_read += reader.documents_read
+        part["done"] = True
+
+    def read(self, convert=lambda doc: doc):
+        if self._ranges is None:
+            bounds = partition_bounds(self.client, self.collection_name, self.partitions, self.mode)
+            self._ranges = [{"bounds": b, "results": [], "checkpoint": MemoryCheckpoint(), "done": False}
+                            for b in bounds]
+            if len(bounds) > 1:
+                print(f"[SCAN] {self.name}: {len(bounds)} partitions on {min(self.workers, len(bounds))} threads")
+
+        pending = [(i, part) for i, part in enumerate(self._ranges) if not part["done"]]
+        errors = []
+        if len(pending) == 1:
+            self._read_range(*pending[0], convert)
+        elif pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                    thread_name_prefix=f"scan-{self.name}") as pool:
+                futures = [pool.submit(self._read_range, i, part, convert) for i, part in pending]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+        if errors:
+            done = sum(1 for part in self._ranges if part["done"])
+            print(f"[SCAN] {self.name}: {len(errors)} partition(s) failed, {done}/{len(self._ranges)} complete")
+            raise errors[0]
+        return [doc for part in self._ranges for doc in part["results"]]
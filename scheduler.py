@@ -1,6 +1,15 @@
-from app import send_daily_report, send_pending_si_report, send_royal_castor_vessel_update
+from config import SI_CUTOFF_QUERY_MODE, SI_CUTOFF_BACKFILL_INTERVAL_HOURS
+from bookings import (
+    backfill_si_cutoff_timestamps, entries_index_available, start_entries_index, sync_si_cutoff_timestamps,
+)
+from email_service import smtp_pool, start_outbox_worker
+from leader import build_leader_elector
+from metrics import start_metrics_server
+from reminders import SI_REMINDER_MODE, reminder_scheduler, send_si_cutoff_reminder, catch_up_si_reminders
+from reports import send_daily_report, send_pending_si_report, send_royal_castor_vessel_update
 import schedule
 import time
+import traceback
 
 # Wrapper functions with print statements
 
@@ -28,16 +37,106 @@ def run_send_royal_castor_vessel_update():
     except Exception as e:
         print(f"[SCHEDULER] Error in send_royal_castor_vessel_update: {e}")
 
-# Schedule tasks
-schedule.every().day.at("13:30").do(run_send_daily_report)
-schedule.every().day.at("12:30").do(run_send_pending_si_report)
-schedule.every().day.at("13:30").do(run_send_royal_castor_vessel_update)
+def run_send_si_cutoff_reminder():
+    try:
+        send_si_cutoff_reminder()
+    except Exception as e:
+        print(f"[SCHEDULER] Error in send_si_cutoff_reminder: {e}")
+
+def run_backfill_si_cutoff_timestamps():
+    if entries_index_available():
+        print("[SCHEDULER] Entries listener is keeping siCutOffAt current, skipping backfill")
+        return
+    print("[SCHEDULER] Running backfill_si_cutoff_timestamps...")
+    try:
+        backfill_si_cutoff_timestamps()
+        print("[SCHEDULER] backfill_si_cutoff_timestamps completed.")
+    except Exception as e:
+        print(f"[SCHEDULER] Error in backfill_si_cutoff_timestamps: {e}")
+
+# Lease that decides which process runs the schedule (see leader.py)
+leader_elector = None
+
+def register_jobs():
+    """
+    Start the leader election and the background threads the jobs need.
+    Every process that may run the schedule calls this; the jobs themselves
+    are added to `schedule` by schedule_jobs() only while this process holds
+    the lease, so every lease holder runs the same set.
+    Nothing is registered at import.
+    """
+    global leader_elector
+    if leader_elector is not None:
+        return
+    leader_elector = build_leader_elector()
+    leader_elector.start()
+
+    # Indexed queries only match entries whose siCutOffAt is current, so in
+    # that mode the listener runs regardless of ENTRIES_LISTENER: its first
+    # snapshot backfills stale entries at startup and every later change is
+    # synced as it arrives. Exact reminders replan and fire far more often
+    # than an hourly sweep, so they need the listener too rather than
+    # rescanning the collection each time.
+    entries_index = start_entries_index(force=SI_CUTOFF_QUERY_MODE == "indexed" or SI_REMINDER_MODE == "exact")
+    if SI_CUTOFF_QUERY_MODE == "indexed":
+        entries_index.add_change_listener(sync_si_cutoff_timestamps)
+    start_outbox_worker()
+    smtp_pool.start_reaper()
+
+    if SI_REMINDER_MODE == "exact":
+        if entries_index is not None:
+            entries_index.add_listener(reminder_scheduler.request_replan)
+        reminder_scheduler.gate = leader_elector.is_leader
+        if SI_CUTOFF_QUERY_MODE != "indexed":
+            # Without the indexed range query, a read before the index is ready would be a full scan
+            reminder_scheduler.source_ready = entries_index_available
+        reminder_scheduler.start()
+
+def schedule_jobs():
+    """
+    Add the scheduled jobs, timed from now. Called when this process gains
+    the lease: jobs kept registered while standing by would be overdue by
+    then and all run at once on takeover.
+    """
+    if SI_REMINDER_MODE != "exact":
+        schedule.every().hour.do(run_send_si_cutoff_reminder).tag("leader")
+    if SI_CUTOFF_QUERY_MODE == "indexed":
+        # Safety net for when the listener is down; skipped while it is connected
+        schedule.every(SI_CUTOFF_BACKFILL_INTERVAL_HOURS).hours.do(run_backfill_si_cutoff_timestamps).tag("leader")
+
+    schedule.every().day.at("13:30").do(run_send_daily_report).tag("leader")
+    schedule.every().day.at("12:30").do(run_send_pending_si_report).tag("leader")
+    schedule.every().day.at("13:30").do(run_send_royal_castor_vessel_update).tag("leader")
 
 def run_scheduler():
+    leading = False
     while True:
+        if leader_elector is not None and not leader_elector.is_leader():
+            if leading:
+                print("[SCHEDULER] No longer the leader, pausing scheduled jobs")
+                schedule.clear("leader")
+            leading = False
+            time.sleep(15)
+            continue
+        if not leading:
+            leading = True
+            print("[SCHEDULER] Running scheduled jobs as leader")
+            schedule_jobs()
+            if SI_REMINDER_MODE != "exact":
+                try:
+                    catch_up_si_reminders()
+                except Exception as e:
+                    print(f"[REMINDER] Catch-up failed: {e}")
+                    traceback.print_exc()
+                # Catch-up covers reminders due up to now, and the first hourly
+                # sweep (an hour from now) only those from now + 30 min, so
+                # sweep once straight away to cover the time in between
+                run_send_si_cutoff_reminder()
         schedule.run_pending()
         time.sleep(60)
 
 if __name__ == "__main__":
     print("[SCHEDULER] Starting scheduler process...")
-    run_scheduler()
\ No newline at end of file
+    start_metrics_server()
+    register_jobs()
+    run_scheduler()